@@ -1 +1,23 @@
-from binge.models import FactorizationModel, PopularityModel, Scorer, XNORScorer
+import importlib
+
+
+# Exports are imported on first access, so that importing the
+# torch-free scorers does not load the training stack.
+_EXPORTS = {'FactorizationModel': 'binge.models',
+            'PopularityModel': 'binge.models',
+            'PQScorer': 'binge.serving',
+            'ResultCache': 'binge.cache',
+            'Scorer': 'binge.serving',
+            'ScoringPool': 'binge.serving',
+            'XNORScorer': 'binge.serving'}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+
+    if name not in _EXPORTS:
+        raise AttributeError("module 'binge' has no attribute '{}'"
+                             .format(name))
+
+    return getattr(importlib.import_module(_EXPORTS[name]), name)
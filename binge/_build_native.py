@@ -0,0 +1,128 @@
+"""
+Build the native scoring kernels as an out-of-line, API-mode cffi
+extension module, `binge._native`.
+
+This is run by `setup.py` through `cffi_modules`; to build in place,
+run `python setup.py build_ext --inplace`.
+"""
+
+from cffi import FFI
+
+
+CDEF = """
+void predict_float_256(float* user_vector,
+                       float* item_vectors,
+                       float user_bias,
+                       float* item_biases,
+                       float* out,
+                       intptr_t num_items,
+                       intptr_t latent_dim);
+void predict_xnor_256(int32_t* user_vector,
+                      int32_t* item_vectors,
+                      float user_bias,
+                      float* item_biases,
+                      float user_norm,
+                      float* item_norms,
+                      float* out,
+                      intptr_t num_items,
+                      intptr_t latent_dim);
+void rank_float_256(float* user_vector,
+                    float* item_vectors,
+                    float user_bias,
+                    float* item_biases,
+                    int32_t* target_ids,
+                    intptr_t num_targets,
+                    int32_t* excluded_ids,
+                    intptr_t num_excluded,
+                    float* target_scores,
+                    int64_t* workspace,
+                    int64_t* higher,
+                    int64_t* equal,
+                    intptr_t num_items,
+                    intptr_t latent_dim,
+                    intptr_t variant);
+void rank_xnor_256(int32_t* user_vector,
+                   int32_t* item_vectors,
+                   float user_bias,
+                   float* item_biases,
+                   float user_norm,
+                   float* item_norms,
+                   int32_t* target_ids,
+                   intptr_t num_targets,
+                   int32_t* excluded_ids,
+                   intptr_t num_excluded,
+                   float* target_scores,
+                   int64_t* workspace,
+                   int64_t* higher,
+                   int64_t* equal,
+                   intptr_t num_items,
+                   intptr_t latent_dim);
+void predict_pq8(float* lut,
+                 uint8_t* codes,
+                 float user_bias,
+                 float* out,
+                 intptr_t num_items,
+                 intptr_t num_subspaces);
+void predict_pq4(uint8_t* lut,
+                 uint8_t* codes,
+                 float scale,
+                 float offset,
+                 float* out,
+                 intptr_t num_items,
+                 intptr_t num_subspaces);
+void predict_xnor_residual(int32_t* user_planes,
+                           float* user_scales,
+                           int32_t* item_planes,
+                           float* item_scales,
+                           float user_bias,
+                           float* item_biases,
+                           float* out,
+                           intptr_t num_items,
+                           intptr_t latent_dim,
+                           intptr_t num_bits);
+intptr_t top_k_float_256(float* user_vector,
+                         float* item_vectors,
+                         float user_bias,
+                         float* item_biases,
+                         int32_t* order,
+                         float* block_norms,
+                         float* block_biases,
+                         intptr_t block_size,
+                         float user_norm,
+                         int32_t* excluded_ids,
+                         intptr_t num_excluded,
+                         intptr_t k,
+                         int32_t* top_ids,
+                         float* top_scores,
+                         int64_t* num_scored,
+                         float* workspace,
+                         int32_t* workspace_ids,
+                         intptr_t num_items,
+                         intptr_t latent_dim,
+                         intptr_t variant);
+intptr_t num_float_variants(void);
+void float_variant_config(intptr_t variant, intptr_t* config);
+void predict_float_variant(intptr_t variant,
+                           float* user_vector,
+                           float* item_vectors,
+                           float user_bias,
+                           float* item_biases,
+                           float* out,
+                           intptr_t num_items,
+                           intptr_t latent_dim);
+"""
+
+COMPILE_ARGS = ['-ffast-math', '-march=native', '-std=c11']
+
+ffibuilder = FFI()
+ffibuilder.cdef(CDEF)
+# The kernels are compiled into the module itself: calls go straight
+# to the C functions, with no dlopen or symbol lookup.
+ffibuilder.set_source('binge._native',
+                      '#include <stdint.h>\n' + CDEF,
+                      sources=['binge/predict.c'],
+                      extra_compile_args=COMPILE_ARGS)
+
+
+if __name__ == '__main__':
+    ffibuilder.compile(verbose=True)
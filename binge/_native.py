@@ -1,8 +0,0 @@
-# auto-generated file
-import _cffi_backend
-
-ffi = _cffi_backend.FFI('_native',
-    _version = 0x2601,
-    _types = b'\x00\x00\x14\x0D\x00\x00\x03\x03\x00\x00\x01\x11\x00\x00\x0D\x01\x00\x00\x01\x11\x00\x00\x01\x11\x00\x00\x19\x01\x00\x00\x19\x01\x00\x00\x00\x0F\x00\x00\x14\x0D\x00\x00\x01\x11\x00\x00\x01\x11\x00\x00\x0D\x01\x00\x00\x01\x11\x00\x00\x0D\x01\x00\x00\x01\x11\x00\x00\x01\x11\x00\x00\x19\x01\x00\x00\x19\x01\x00\x00\x00\x0F\x00\x00\x00\x01',
-    _globals = (b'\x00\x00\x00\x23predict_float_256',0,b'\x00\x00\x09\x23predict_xnor_256',0),
-)
@@ -0,0 +1,339 @@
+"""
+A bounded cache of top-k results in front of a scorer.
+
+Repeated top-k requests for a user are served from memory instead of
+scanning the catalog. Results are keyed by user, `k` and a signature
+of the excluded items, and are dropped whenever the scorer's `version`
+changes (as `Scorer.update_items` does) or the scorer is replaced
+with `ResultCache.reload`.
+
+The cache is bounded in bytes, with one of two eviction policies:
+
+- 'lru' evicts the least recently used results.
+- 'tinylfu' (W-TinyLFU) admits new results to a small LRU window.
+  A result evicted from the window only displaces the least recently
+  used results of the main LRU region if it has been requested more
+  often than they have, as estimated by a count-min sketch of recent
+  request frequencies. One-off requests, such as a crawl over many
+  users, then cannot flush the results of heavy users.
+"""
+
+import collections
+import hashlib
+import threading
+
+import numpy as np
+
+from binge import instrumentation
+
+
+# Approximate bytes taken by the key, the result tuple
+# and the array headers of every entry.
+ENTRY_OVERHEAD = 512
+
+POLICIES = ('lru', 'tinylfu')
+
+
+def _filter_signature(exclude):
+
+    if exclude is None:
+        return None
+
+    exclude = np.unique(np.asarray(exclude, dtype=np.int64))
+
+    return hashlib.blake2b(exclude.tobytes(), digest_size=16).digest()
+
+
+def _entry_bytes(result):
+
+    return ENTRY_OVERHEAD + sum(array.nbytes for array in result)
+
+
+class _FrequencySketch:
+    """
+    Count-min sketch of saturating 8-bit counters. All counters are
+    halved every `sample_size` increments, so that estimates reflect
+    recent frequencies.
+    """
+
+    _SEEDS = (0x9e3779b97f4a7c15, 0xc2b2ae3d27d4eb4f,
+              0x165667b19e3779f9, 0x27d4eb2f165667c5)
+
+    def __init__(self, width, sample_size=None):
+
+        # A power of two, so that indices are masked hashes.
+        self._width = 1 << max(int(width) - 1, 1).bit_length()
+        self._mask = self._width - 1
+        self._rows = [bytearray(self._width) for _ in self._SEEDS]
+
+        self._sample_size = sample_size or 10 * self._width
+        self._additions = 0
+
+    @property
+    def nbytes(self):
+
+        return len(self._rows) * self._width
+
+    def _indices(self, key):
+
+        hashed = hash(key) & 0xffffffffffffffff
+
+        return [((hashed * seed) >> 32) & self._mask for seed in self._SEEDS]
+
+    def increment(self, key):
+
+        for row, index in zip(self._rows, self._indices(key)):
+            if row[index] < 255:
+                row[index] += 1
+
+        self._additions += 1
+
+        if self._additions >= self._sample_size:
+            for row in self._rows:
+                counters = np.frombuffer(row, dtype=np.uint8)
+                counters >>= 1
+
+            self._additions //= 2
+
+    def estimate(self, key):
+
+        return min(row[index] for row, index
+                   in zip(self._rows, self._indices(key)))
+
+
+class ResultCache:
+    """
+    Cache the results of a scorer's `top_k`.
+
+    Returned arrays are shared between requests and read-only.
+
+    Parameters
+    ----------
+
+    scorer: Scorer, XNORScorer or PQScorer
+    max_bytes: int, optional
+        Bound on the bytes of cached results, counting
+        `ENTRY_OVERHEAD` bytes per result.
+    policy: str, optional
+        Eviction policy: 'lru' or 'tinylfu'.
+    window_fraction: float, optional
+        Fraction of `max_bytes` given to the admission
+        window of the 'tinylfu' policy.
+    """
+
+    def __init__(self,
+                 scorer,
+                 max_bytes=2 ** 26,
+                 policy='tinylfu',
+                 window_fraction=0.01):
+
+        if policy not in POLICIES:
+            raise ValueError('Policy must be one of {}, got {}'
+                             .format(POLICIES, policy))
+
+        self.max_bytes = max_bytes
+        self.policy = policy
+
+        if policy == 'tinylfu':
+            self._window_max_bytes = int(max_bytes * window_fraction)
+            # Counters are halved after ten requests per result
+            # the cache can hold, and are wide enough to keep
+            # collisions rare in small caches.
+            capacity = max(max_bytes // ENTRY_OVERHEAD, 1)
+            self._sketch = _FrequencySketch(max(capacity, 256),
+                                            sample_size=10 * capacity)
+        else:
+            self._window_max_bytes = 0
+            self._sketch = None
+
+        self._main_max_bytes = max_bytes - self._window_max_bytes
+
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+
+        self._scorer = scorer
+        self._clear()
+
+    def _clear(self):
+
+        self._window = collections.OrderedDict()
+        self._main = collections.OrderedDict()
+        self._window_bytes = 0
+        self._main_bytes = 0
+
+        self._version = getattr(self._scorer, 'version', 0)
+        # Changes whenever the cache is cleared, so that
+        # results computed before are not inserted.
+        self._generation = getattr(self, '_generation', 0) + 1
+
+    @property
+    def scorer(self):
+
+        return self._scorer
+
+    def reload(self, scorer):
+        """
+        Serve from a new scorer, dropping all cached results.
+        """
+
+        with self._lock:
+            self._scorer = scorer
+            self._clear()
+
+    def clear(self):
+
+        with self._lock:
+            self._clear()
+
+    def __len__(self):
+
+        return len(self._window) + len(self._main)
+
+    @property
+    def nbytes(self):
+        """
+        Bytes of cached results, and of the frequency
+        sketch of the 'tinylfu' policy.
+        """
+
+        return (self._window_bytes + self._main_bytes +
+                (self._sketch.nbytes if self._sketch is not None else 0))
+
+    @property
+    def hit_rate(self):
+
+        requests = self.hits + self.misses
+
+        return self.hits / requests if requests else 0.0
+
+    def stats(self):
+
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hit_rate,
+                'evictions': self.evictions,
+                'rejections': self.rejections,
+                'entries': len(self),
+                'bytes': self.nbytes}
+
+    def _lookup(self, key):
+
+        for region in (self._main, self._window):
+            result = region.get(key)
+
+            if result is not None:
+                region.move_to_end(key)
+                return result
+
+        return None
+
+    def _evict_main(self, num_bytes):
+        """
+        Evict least recently used results of the main region
+        until `num_bytes` more fit.
+        """
+
+        while (self._main and
+               self._main_bytes + num_bytes > self._main_max_bytes):
+            _, result = self._main.popitem(last=False)
+            self._main_bytes -= _entry_bytes(result)
+            self.evictions += 1
+
+    def _admit(self, key, result, num_bytes):
+        """
+        Insert into the main region if the candidate is requested
+        more often than every result it would displace.
+        """
+
+        frequency = self._sketch.estimate(key)
+        space = self._main_max_bytes - self._main_bytes
+
+        for victim_key, victim in self._main.items():
+            if space >= num_bytes:
+                break
+
+            if self._sketch.estimate(victim_key) >= frequency:
+                self.rejections += 1
+                return
+
+            space += _entry_bytes(victim)
+
+        self._evict_main(num_bytes)
+        self._main[key] = result
+        self._main_bytes += num_bytes
+
+    def _insert(self, key, result):
+
+        num_bytes = _entry_bytes(result)
+
+        if num_bytes > self._main_max_bytes:
+            return
+
+        if self._sketch is None:
+            self._evict_main(num_bytes)
+            self._main[key] = result
+            self._main_bytes += num_bytes
+            return
+
+        self._window[key] = result
+        self._window_bytes += num_bytes
+
+        while self._window_bytes > self._window_max_bytes:
+            candidate_key, candidate = self._window.popitem(last=False)
+            candidate_bytes = _entry_bytes(candidate)
+            self._window_bytes -= candidate_bytes
+
+            self._admit(candidate_key, candidate, candidate_bytes)
+
+    def top_k(self, user_id, k, exclude=None, prune=False):
+        """
+        Return the `k` highest-scoring items for a user, as
+        the scorer's `top_k` does, from the cache if possible.
+        """
+
+        record = instrumentation.recorder('result_cache.top_k')
+
+        key = (int(user_id), int(k), _filter_signature(exclude))
+
+        with self._lock:
+            if getattr(self._scorer, 'version', 0) != self._version:
+                self._clear()
+
+            if self._sketch is not None:
+                self._sketch.increment(key)
+
+            result = self._lookup(key)
+
+            if result is not None:
+                self.hits += 1
+                record('hit')
+                record.finish()
+                return result
+
+            self.misses += 1
+            scorer = self._scorer
+            generation = self._generation
+
+        record('miss')
+
+        result = scorer.top_k(user_id, k, exclude=exclude, prune=prune)
+
+        for array in result:
+            array.flags.writeable = False
+
+        record('score')
+
+        with self._lock:
+            if (generation == self._generation and
+                    getattr(scorer, 'version', 0) == self._version and
+                    self._lookup(key) is None):
+                self._insert(key, result)
+
+        record('insert')
+        record.finish()
+
+        return result
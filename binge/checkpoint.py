@@ -0,0 +1,128 @@
+"""
+Resumable training checkpoints.
+
+A checkpoint holds everything needed to continue a `fit` run exactly where
+it left off: network weights, optimizer moments, the number of completed
+epochs, and the numpy and torch random number generator states.
+"""
+
+import copy
+import os
+import queue
+import threading
+
+import torch
+
+
+def _pack_random_state(state):
+
+    # Store the numpy generator state as tensors and plain
+    # Python values so that the checkpoint loads without
+    # unpickling arbitrary objects.
+    name, keys, position, has_gauss, cached_gaussian = state
+
+    return (name, torch.from_numpy(keys.astype('int64')),
+            int(position), int(has_gauss), float(cached_gaussian))
+
+
+def _unpack_random_state(state):
+
+    name, keys, position, has_gauss, cached_gaussian = state
+
+    return (name, keys.numpy().astype('uint32'),
+            position, has_gauss, cached_gaussian)
+
+
+def snapshot(model, optimizer, epoch):
+    """
+    Copy the training state of a `FactorizationModel`, so that
+    it can be serialized while training continues.
+    """
+
+    return {
+        'epoch': epoch,
+        'net': {name: value.clone()
+                for name, value in model._net.state_dict().items()},
+        'optimizer': copy.deepcopy(optimizer.state_dict()),
+        'random_state': _pack_random_state(model._random_state.get_state()),
+        'torch_random_state': torch.get_rng_state(),
+    }
+
+
+def restore(model, optimizer, state):
+    """
+    Restore the training state of a `FactorizationModel`
+    and return the number of completed epochs.
+    """
+
+    model._net.load_state_dict(state['net'])
+    optimizer.load_state_dict(state['optimizer'])
+    model._random_state.set_state(_unpack_random_state(state['random_state']))
+    torch.set_rng_state(state['torch_random_state'])
+
+    return state['epoch']
+
+
+def save(state, path):
+    """
+    Atomically write a checkpoint to `path`.
+    """
+
+    temporary_path = '{}.tmp'.format(path)
+
+    torch.save(state, temporary_path)
+    os.replace(temporary_path, path)
+
+
+def load(path):
+
+    return torch.load(path)
+
+
+class CheckpointWriter:
+    """
+    Write checkpoints on a background thread so that serialization
+    and disk writes do not block the training loop.
+
+    At most one checkpoint is pending at a time: if training produces
+    checkpoints faster than they can be written, `write` blocks until
+    the previous one is on disk.
+    """
+
+    def __init__(self, path):
+
+        self._path = path
+        self._queue = queue.Queue(maxsize=1)
+        self._error = None
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+
+        while True:
+            state = self._queue.get()
+
+            if state is None:
+                return
+
+            try:
+                save(state, self._path)
+            except Exception as e:
+                self._error = e
+
+    def _raise_error(self):
+
+        if self._error is not None:
+            raise self._error
+
+    def write(self, state):
+
+        self._raise_error()
+        self._queue.put(state)
+
+    def close(self):
+
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
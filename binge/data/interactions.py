@@ -0,0 +1,382 @@
+"""
+Chunked loading of large interaction logs.
+
+Interactions are streamed from delimited text or fixed-width binary
+record files one chunk at a time. Raw user and item ids are mapped to
+dense indices through `IdMapping`, an open-addressing hash table held
+in numpy arrays, so that no per-interaction Python objects are created.
+"""
+
+import os
+
+import numpy as np
+
+import scipy.sparse as sp
+
+
+COLUMNS = ('user', 'item', 'rating', 'timestamp')
+
+USER_MAPPING_FILENAME = 'users.npy'
+ITEM_MAPPING_FILENAME = 'items.npy'
+
+# Fibonacci hashing multiplier: 2 ** 64 divided by the golden ratio.
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+class IdMapping:
+    """
+    Map arbitrary int64 ids to dense indices, numbered in order
+    of first appearance.
+
+    Ids are stored in a linear-probing hash table of int64 keys and
+    int32 values, kept at most half full. Lookups and insertions are
+    vectorized over chunks of ids: every probe step is a single array
+    operation over all ids still being placed.
+
+    Parameters
+    ----------
+
+    raw_ids: np.int64 array, optional
+        Ids to insert, in dense index order.
+    """
+
+    def __init__(self, raw_ids=None):
+
+        self._initialize_table(2 ** 10)
+        self._raw_ids = np.empty(2 ** 10, dtype=np.int64)
+        self._size = 0
+
+        if raw_ids is not None:
+            self.map(raw_ids)
+
+    def __len__(self):
+
+        return self._size
+
+    @property
+    def nbytes(self):
+
+        return (self._keys.nbytes +
+                self._values.nbytes +
+                self._raw_ids.nbytes)
+
+    @property
+    def raw_ids(self):
+        """
+        The raw id of every dense index.
+        """
+
+        return self._raw_ids[:self._size]
+
+    def _initialize_table(self, capacity):
+
+        self._keys = np.zeros(capacity, dtype=np.int64)
+        self._values = np.full(capacity, -1, dtype=np.int32)
+        self._shift = np.uint64(64 - int(np.log2(capacity)))
+
+    def _slots(self, keys):
+
+        return ((keys.view(np.uint64) * _HASH_MULTIPLIER)
+                >> self._shift).astype(np.int64)
+
+    def _lookup(self, keys):
+
+        mask = len(self._keys) - 1
+
+        values = np.full(len(keys), -1, dtype=np.int32)
+        slots = self._slots(keys)
+        pending = np.arange(len(keys))
+
+        while len(pending):
+            slot_values = self._values[slots[pending]]
+            found = ((slot_values >= 0) &
+                     (self._keys[slots[pending]] == keys[pending]))
+
+            values[pending[found]] = slot_values[found]
+
+            # Keep probing while the slot is taken by another key.
+            pending = pending[~found & (slot_values >= 0)]
+            slots[pending] = (slots[pending] + 1) & mask
+
+        return values
+
+    def _insert(self, keys, values):
+        """
+        Insert distinct keys that are not yet in the table.
+        """
+
+        mask = len(self._keys) - 1
+
+        slots = self._slots(keys)
+        pending = np.arange(len(keys))
+
+        while len(pending):
+            is_free = self._values[slots[pending]] < 0
+
+            # Of several keys probing the same free slot, the first wins.
+            candidates = pending[is_free]
+            _, first = np.unique(slots[candidates], return_index=True)
+            placed = candidates[first]
+
+            self._keys[slots[placed]] = keys[placed]
+            self._values[slots[placed]] = values[placed]
+
+            is_placed = np.zeros(len(keys), dtype=bool)
+            is_placed[placed] = True
+
+            pending = pending[~is_placed[pending]]
+            slots[pending] = (slots[pending] + 1) & mask
+
+    def _reserve(self, size):
+
+        if size > len(self._raw_ids):
+            raw_ids = np.empty(max(size, 2 * len(self._raw_ids)),
+                               dtype=np.int64)
+            raw_ids[:self._size] = self.raw_ids
+            self._raw_ids = raw_ids
+
+        if 2 * size > len(self._keys):
+            capacity = len(self._keys)
+
+            while 2 * size > capacity:
+                capacity *= 2
+
+            self._initialize_table(capacity)
+            self._insert(self.raw_ids,
+                         np.arange(self._size, dtype=np.int32))
+
+    def map(self, raw_ids, insert=True):
+        """
+        Return the dense indices of `raw_ids`.
+
+        Unknown ids are added to the mapping if `insert` is true,
+        and mapped to -1 otherwise.
+        """
+
+        raw_ids = np.ascontiguousarray(raw_ids, dtype=np.int64)
+
+        unique_ids, first_indices, inverse = np.unique(raw_ids,
+                                                       return_index=True,
+                                                       return_inverse=True)
+        values = self._lookup(unique_ids)
+
+        if insert:
+            new = np.flatnonzero(values < 0)
+            new = new[np.argsort(first_indices[new])]
+
+            self._reserve(self._size + len(new))
+
+            values[new] = np.arange(self._size, self._size + len(new))
+            self._raw_ids[self._size:self._size + len(new)] = unique_ids[new]
+            self._size += len(new)
+
+            self._insert(unique_ids[new], values[new])
+
+        return values[inverse]
+
+    def save(self, path):
+
+        np.save(path, self.raw_ids)
+
+    @classmethod
+    def load(cls, path):
+
+        return cls(np.load(path))
+
+
+def _read_text_chunks(path, chunk_size, skip_header):
+
+    remainder = b''
+
+    with open(path, 'rb') as datafile:
+
+        if skip_header:
+            datafile.readline()
+
+        while True:
+            data = datafile.read(chunk_size)
+
+            if not data:
+                break
+
+            data = remainder + data
+            end = data.rfind(b'\n') + 1
+
+            remainder = data[end:]
+
+            if end:
+                yield data[:end]
+
+    if remainder.strip():
+        yield remainder
+
+
+def _iter_text(path, columns, separator, chunk_size, skip_header):
+
+    for data in _read_text_chunks(path, chunk_size, skip_header):
+        values = np.fromstring(data.replace(separator, b' '),
+                               dtype=np.float64, sep=' ')
+
+        if len(values) % len(columns):
+            raise ValueError('Malformed interactions file {}: expected '
+                             '{} fields per line'.format(path, len(columns)))
+
+        values = values.reshape(-1, len(columns))
+
+        yield {name: values[:, i] for i, name in enumerate(columns)
+               if name is not None}
+
+
+def _iter_binary(path, dtype, chunk_size):
+
+    if path.endswith('.npy'):
+        records = np.load(path, mmap_mode='r')
+    else:
+        records = np.memmap(path, dtype=dtype, mode='r')
+
+    chunk_length = max(chunk_size // records.dtype.itemsize, 1)
+
+    for start in range(0, len(records), chunk_length):
+        chunk = records[start:start + chunk_length]
+
+        yield {name: np.asarray(chunk[name])
+               for name in COLUMNS if name in records.dtype.names}
+
+
+def _split_indices(length, timestamps, split, validation_percentage,
+                   test_percentage, random_state):
+    """
+    Return the indices of the train, test and validation interactions.
+    """
+
+    if split == 'random':
+        order = random_state.permutation(length)
+    elif split == 'timestamp':
+        if timestamps is None:
+            raise ValueError('A timestamp split requires a '
+                             'timestamp column.')
+        # Latest interactions go to the test set.
+        order = np.argsort(-timestamps, kind='stable')
+    else:
+        raise ValueError('Unknown split: {}'.format(split))
+
+    test_index = int(test_percentage * length)
+    validation_index = int((test_percentage +
+                            validation_percentage) * length)
+
+    return (order[validation_index:],
+            order[:test_index],
+            order[test_index:validation_index])
+
+
+def load_interactions(path,
+                      columns=('user', 'item', 'rating', 'timestamp'),
+                      separator=b',',
+                      skip_header=False,
+                      dtype=None,
+                      chunk_size=2 ** 26,
+                      mapping_dir=None,
+                      split='random',
+                      validation_percentage=0.1,
+                      test_percentage=0.1,
+                      random_seed=None):
+    """
+    Load an interaction log too large to parse line by line, and split
+    it into train, test and validation sets.
+
+    The file is read `chunk_size` bytes at a time. Raw ids are mapped to
+    dense indices in order of first appearance. If `mapping_dir` holds
+    mappings saved by a previous load they are extended, so that ids keep
+    their indices across loads; the updated mappings are saved there.
+
+    Parameters
+    ----------
+
+    path: string
+        Delimited text file, or binary file of fixed-width records
+        if `dtype` is given or `path` is a structured `.npy` array.
+    columns: sequence of strings, optional
+        For text files, the name of every field: 'user', 'item',
+        'rating', 'timestamp', or None for fields to ignore. Fields
+        must be numeric, and ids integers below 2 ** 53. Binary records
+        are read from the fields with these names.
+    separator: bytes, optional
+        Field delimiter of text files. Whitespace always separates fields.
+    skip_header: bool, optional
+        Whether the first line of a text file is a header.
+    dtype: np.dtype, optional
+        Structured record dtype of a binary file.
+    chunk_size: int, optional
+        Number of bytes read at a time.
+    mapping_dir: string, optional
+        Directory the id mappings are loaded from and saved to.
+    split: string, optional
+        'random' for a random split, or 'timestamp' to put the latest
+        interactions in the test set and the ones before them in the
+        validation set.
+    validation_percentage: float, optional
+    test_percentage: float, optional
+    random_seed: int, optional
+
+    Returns
+    -------
+
+    (train, test, validation): tuple of np.float32 coo_matrix
+        Of shape [n_users, n_items]. Ratings default to 1
+        in the absence of a rating column.
+    (user_mapping, item_mapping): tuple of IdMapping
+        Maps from raw ids to row and column indices.
+    """
+
+    random_state = np.random.RandomState(random_seed)
+
+    if mapping_dir is not None and os.path.isfile(
+            os.path.join(mapping_dir, USER_MAPPING_FILENAME)):
+        user_mapping = IdMapping.load(
+            os.path.join(mapping_dir, USER_MAPPING_FILENAME))
+        item_mapping = IdMapping.load(
+            os.path.join(mapping_dir, ITEM_MAPPING_FILENAME))
+    else:
+        user_mapping = IdMapping()
+        item_mapping = IdMapping()
+
+    if dtype is not None or path.endswith('.npy'):
+        chunks = _iter_binary(path, dtype, chunk_size)
+    else:
+        chunks = _iter_text(path, columns, separator, chunk_size,
+                            skip_header)
+
+    user_ids, item_ids, ratings, timestamps = [], [], [], []
+
+    for chunk in chunks:
+        user_ids.append(user_mapping.map(chunk['user']))
+        item_ids.append(item_mapping.map(chunk['item']))
+        ratings.append(chunk.get('rating', np.ones(len(chunk['user'])))
+                       .astype(np.float32))
+
+        if 'timestamp' in chunk:
+            timestamps.append(chunk['timestamp'].astype(np.int64))
+
+    user_ids = np.concatenate(user_ids)
+    item_ids = np.concatenate(item_ids)
+    ratings = np.concatenate(ratings)
+    timestamps = np.concatenate(timestamps) if timestamps else None
+
+    if mapping_dir is not None:
+        if not os.path.isdir(mapping_dir):
+            os.makedirs(mapping_dir)
+
+        user_mapping.save(os.path.join(mapping_dir, USER_MAPPING_FILENAME))
+        item_mapping.save(os.path.join(mapping_dir, ITEM_MAPPING_FILENAME))
+
+    shape = (len(user_mapping), len(item_mapping))
+
+    splits = tuple(
+        sp.coo_matrix((ratings[indices],
+                       (user_ids[indices], item_ids[indices])),
+                      shape=shape)
+        for indices in _split_indices(len(user_ids), timestamps, split,
+                                      validation_percentage,
+                                      test_percentage, random_state))
+
+    return splits, (user_mapping, item_mapping)
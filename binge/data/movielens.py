@@ -1,4 +1,4 @@
-import array
+import os
 import zipfile
 
 import numpy as np
@@ -14,53 +14,96 @@ URL_100K = ('https://github.com/maciejkula/'
 URL_1M = ('http://files.grouplens.org/datasets/movielens/ml-1m.zip')
 
 
+# Bump when the parsed format changes, to invalidate existing caches.
+PARSED_VERSION = 1
+
+
 def _read_raw_data_100k(path):
     """
-    Return the raw lines of the train and test files.
+    Return the raw bytes of the ratings file.
     """
 
     with zipfile.ZipFile(path) as datafile:
-        return datafile.read('ml-100k/u.data').decode().split('\n')
+        return datafile.read('ml-100k/u.data')
 
 
 def _read_raw_data_1M(path):
 
     with zipfile.ZipFile(path) as datafile:
-        return datafile.read('ml-1m/ratings.dat').decode().split('\n')
+        return datafile.read('ml-1m/ratings.dat')
+
+
+def _parse(data, separator=b'\t', num_fields=4):
+    """
+    Parse the raw bytes of a ratings file into an integer array
+    of shape [n_lines, num_fields], without splitting it into
+    Python strings.
+    """
+
+    # numpy's C text parser treats any whitespace as a separator.
+    values = np.fromstring(data.replace(separator, b' '),
+                           dtype=np.int64, sep=' ')
+
+    if len(values) % num_fields:
+        raise ValueError('Malformed ratings file: {} fields is not '
+                         'a multiple of {}'.format(len(values), num_fields))
+
+    return values.reshape(-1, num_fields)
+
+
+def _remap(ids):
+    """
+    Map raw ids to dense indices, numbered in order of first appearance.
+    """
+
+    _, first_indices, inverse = np.unique(ids,
+                                          return_index=True,
+                                          return_inverse=True)
+
+    dense_ids = np.empty(len(first_indices), dtype=np.int32)
+    dense_ids[np.argsort(first_indices)] = np.arange(len(first_indices))
+
+    return dense_ids[inverse]
+
+
+def _load_data(data, separator=b'\t'):
 
+    fields = _parse(data, separator)
 
-def _parse(data, separator='\t'):
+    return (_remap(fields[:, 0]),
+            _remap(fields[:, 1]),
+            fields[:, 3].astype(np.int32))
 
-    for line in data:
 
-        if not line:
-            continue
+def _cache_path(zip_path):
 
-        uid, iid, rating, timestamp = [x for x in line.split(separator)]
+    return '{}.parsed-v{}.npy'.format(os.path.splitext(zip_path)[0],
+                                      PARSED_VERSION)
 
-        yield int(uid), int(iid), float(rating), int(timestamp)
 
+def _load_cached(zip_path, read_raw_data, separator=b'\t'):
+    """
+    Return (user ids, item ids, timestamps), parsing the zip only if
+    there is no up-to-date parsed cache next to it. The cache is
+    memory-mapped.
+    """
+
+    cache_path = _cache_path(zip_path)
 
-def _load_data(data, separator='\t'):
+    if not (os.path.isfile(cache_path) and
+            os.path.getmtime(cache_path) >= os.path.getmtime(zip_path)):
 
-    user_dict = {}
-    item_dict = {}
+        parsed = np.column_stack(_load_data(read_raw_data(zip_path),
+                                            separator))
 
-    uids = array.array('i')
-    iids = array.array('i')
-    timestamps = array.array('i')
+        temporary_path = '{}.tmp.npy'.format(cache_path)
+        np.save(temporary_path, parsed)
+        os.replace(temporary_path, cache_path)
 
-    for uid, iid, rating, timestamp in _parse(data, separator):
-        uids.append(user_dict.setdefault(uid,
-                                         len(user_dict)))
-        iids.append(item_dict.setdefault(iid,
-                                         len(item_dict)))
-        timestamps.append(timestamp)
+    parsed = np.load(cache_path, mmap_mode='r')
+
+    return parsed[:, 0], parsed[:, 1], parsed[:, 2]
 
-    return (np.array(uids),
-            np.array(iids),
-            np.array(timestamps))
-        
 
 def fetch_movielens_100k(data_home=None, download_if_missing=True, random_seed=None):
     """
@@ -102,10 +145,7 @@ def fetch_movielens_100k(data_home=None, download_if_missing=True, random_seed=N
                                 'movielens.zip',
                                 download_if_missing)
 
-    # Load raw data
-    raw = _read_raw_data_100k(zip_path)
-
-    uids, iids, timestamps = _load_data(raw)
+    uids, iids, timestamps = _load_cached(zip_path, _read_raw_data_100k)
 
     num_users = uids.max() + 1
     num_items = iids.max() + 1
@@ -168,10 +208,7 @@ def fetch_movielens_1M(data_home=None, download_if_missing=True, random_seed=Non
                                 'movielens.zip',
                                 download_if_missing)
 
-    # Load raw data
-    raw = _read_raw_data_1M(zip_path)
-
-    uids, iids, timestamps = _load_data(raw, '::')
+    uids, iids, timestamps = _load_cached(zip_path, _read_raw_data_1M, b'::')
 
     num_users = uids.max() + 1
     num_items = iids.max() + 1
@@ -0,0 +1,196 @@
+import json
+import os
+
+import numpy as np
+
+
+METADATA_FILENAME = 'shards.json'
+
+
+def _column_path(path, shard_num, column):
+
+    return os.path.join(path, '{:05d}.{}.npy'.format(shard_num, column))
+
+
+class ShardWriter:
+    """
+    Write interactions to a directory of memory-mappable
+    columnar shards, one chunk at a time.
+
+    Parameters
+    ----------
+
+    path: string
+        Directory the shards should be written to.
+    shard_size: int, optional
+        Maximum number of interactions per shard.
+    """
+
+    def __init__(self, path, shard_size=2 ** 22):
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self._path = path
+        self._shard_size = shard_size
+
+        self._lengths = []
+        self._num_users = 0
+        self._num_items = 0
+
+    def _write_shard(self, user_ids, item_ids, ratings):
+
+        shard_num = len(self._lengths)
+
+        np.save(_column_path(self._path, shard_num, 'users'),
+                user_ids.astype(np.int32))
+        np.save(_column_path(self._path, shard_num, 'items'),
+                item_ids.astype(np.int32))
+        np.save(_column_path(self._path, shard_num, 'ratings'),
+                ratings.astype(np.float32))
+
+        self._lengths.append(len(user_ids))
+
+    def write(self, user_ids, item_ids, ratings):
+        """
+        Append a chunk of interactions, splitting it into
+        as many shards as necessary.
+        """
+
+        if not len(user_ids):
+            return
+
+        self._num_users = max(self._num_users, int(user_ids.max()) + 1)
+        self._num_items = max(self._num_items, int(item_ids.max()) + 1)
+
+        for i in range(0, len(user_ids), self._shard_size):
+            self._write_shard(user_ids[i:i + self._shard_size],
+                              item_ids[i:i + self._shard_size],
+                              ratings[i:i + self._shard_size])
+
+    def close(self, num_users=None, num_items=None):
+        """
+        Write the shard metadata and return the resulting
+        `InteractionShards`.
+        """
+
+        metadata = {'num_users': max(num_users or 0, self._num_users),
+                    'num_items': max(num_items or 0, self._num_items),
+                    'lengths': self._lengths}
+
+        with open(os.path.join(self._path, METADATA_FILENAME), 'w') as fle:
+            json.dump(metadata, fle)
+
+        return InteractionShards(self._path)
+
+
+def write_shards(path, interactions, shard_size=2 ** 22):
+    """
+    Write a coo_matrix of interactions to memory-mapped shards.
+    """
+
+    writer = ShardWriter(path, shard_size=shard_size)
+    writer.write(interactions.row, interactions.col, interactions.data)
+
+    return writer.close(*interactions.shape)
+
+
+class InteractionShards:
+    """
+    A streaming interaction source backed by memory-mapped
+    columnar shards of user ids, item ids, and ratings.
+
+    Iterating over the shards in shuffled order keeps peak memory
+    bounded by `buffer_size` regardless of the size of the dataset.
+
+    Parameters
+    ----------
+
+    path: string
+        Directory written by `ShardWriter` or `write_shards`.
+    buffer_size: int, optional
+        Number of interactions held in the shuffle buffer.
+    """
+
+    def __init__(self, path, buffer_size=2 ** 22):
+
+        with open(os.path.join(path, METADATA_FILENAME), 'r') as fle:
+            metadata = json.load(fle)
+
+        self._path = path
+        self._lengths = metadata['lengths']
+        self._buffer_size = buffer_size
+
+        self.shape = (metadata['num_users'], metadata['num_items'])
+
+    def __len__(self):
+
+        return sum(self._lengths)
+
+    def shard(self, shard_num):
+        """
+        Return memory-mapped (user_ids, item_ids, ratings) arrays
+        of a single shard.
+        """
+
+        return tuple(np.load(_column_path(self._path, shard_num, column),
+                             mmap_mode='r')
+                     for column in ('users', 'items', 'ratings'))
+
+    def _shuffled_buffer(self, buffer, random_state):
+
+        users, items, ratings = (np.concatenate(x) for x in zip(*buffer))
+
+        shuffle_indices = np.arange(len(users))
+        random_state.shuffle(shuffle_indices)
+
+        return (users[shuffle_indices].astype(np.int64),
+                items[shuffle_indices].astype(np.int64),
+                ratings[shuffle_indices].astype(np.float32))
+
+    def iter_shuffled(self, random_state):
+        """
+        Block-shuffle the interactions: visit shards in random
+        order, accumulate them into a buffer of at most `buffer_size`
+        interactions, and yield each buffer in shuffled order.
+        """
+
+        buffer = []
+        buffered = 0
+
+        for shard_num in random_state.permutation(len(self._lengths)):
+
+            users, items, ratings = self.shard(shard_num)
+
+            start = 0
+
+            while start < len(users):
+                stop = start + self._buffer_size - buffered
+
+                buffer.append((users[start:stop],
+                               items[start:stop],
+                               ratings[start:stop]))
+                buffered += len(buffer[-1][0])
+                start = stop
+
+                if buffered == self._buffer_size:
+                    yield self._shuffled_buffer(buffer, random_state)
+                    buffer = []
+                    buffered = 0
+
+        if buffer:
+            yield self._shuffled_buffer(buffer, random_state)
+
+    def tocoo(self):
+        """
+        Materialize the interactions as a coo_matrix.
+        """
+
+        import scipy.sparse as sp
+
+        users, items, ratings = (
+            np.concatenate(x) for x in
+            zip(*(self.shard(i) for i in range(len(self._lengths))))
+        )
+
+        return sp.coo_matrix((ratings, (users, items)), shape=self.shape)
@@ -0,0 +1,173 @@
+"""
+Synthetic interaction data with power-law user activity and item
+popularity, and latent structure planted from ground-truth factors.
+"""
+
+import numpy as np
+
+import scipy.sparse as sp
+
+from binge.data.shards import ShardWriter
+
+
+def _sample_zipf(permutation, exponent, size, random_state):
+    """
+    Sample elements whose probabilities follow a power law in their
+    rank, `permutation` mapping ranks to element ids.
+
+    Ranks are drawn by inverting the CDF of the continuous power law
+    x ** -exponent on [1, n + 1], which takes constant time per sample
+    and closely approximates the discrete Zipf law.
+    """
+
+    num_elements = len(permutation)
+    uniform = random_state.random_sample(size)
+
+    if exponent == 1.0:
+        ranks = (num_elements + 1) ** uniform
+    else:
+        power = 1.0 - exponent
+        ranks = (1.0 + uniform * ((num_elements + 1) ** power - 1.0)
+                 ) ** (1.0 / power)
+
+    ranks = np.minimum(ranks.astype(np.int64) - 1, num_elements - 1)
+
+    return permutation[ranks]
+
+
+class PowerLawGenerator:
+    """
+    Generate implicit-feedback interactions in which the number of
+    interactions per user and per item follows a Zipf law.
+
+    Every user and item is given a ground-truth latent vector. An
+    interaction is drawn by sampling a user by activity, sampling
+    `num_candidates` items by popularity, and choosing among them
+    with probability proportional to exp(affinity / temperature),
+    where affinity is the dot product of the latent vectors. Items
+    are therefore drawn with probability roughly proportional to
+    popularity * exp(affinity / temperature).
+
+    Interactions are generated in chunks with vectorized operations,
+    so that datasets of 10^8 interactions can be written to shards
+    in bounded memory. The same (user, item) pair may be drawn
+    more than once.
+
+    Parameters
+    ----------
+
+    num_users: int
+    num_items: int
+    latent_dim: int, optional
+        Dimensionality of the ground-truth factors.
+    user_exponent: float, optional
+        Zipf exponent of user activity.
+    item_exponent: float, optional
+        Zipf exponent of item popularity.
+    num_candidates: int, optional
+        Number of popularity-sampled items each interaction is chosen
+        from. More candidates give stronger latent structure.
+    temperature: float, optional
+        Lower temperatures make choices follow the factors more closely.
+    random_seed: int, optional
+    """
+
+    def __init__(self,
+                 num_users,
+                 num_items,
+                 latent_dim=16,
+                 user_exponent=1.0,
+                 item_exponent=1.0,
+                 num_candidates=32,
+                 temperature=0.5,
+                 random_seed=None):
+
+        self._num_users = num_users
+        self._num_items = num_items
+        self._num_candidates = num_candidates
+        self._temperature = temperature
+
+        self._random_state = np.random.RandomState(random_seed)
+
+        self._user_exponent = user_exponent
+        self._item_exponent = item_exponent
+
+        # Popularity is unrelated to id.
+        self._user_ranks = self._random_state.permutation(num_users)
+        self._item_ranks = self._random_state.permutation(num_items)
+
+        # Scaled so that affinities have unit variance.
+        scale = latent_dim ** -0.25
+
+        self.user_factors = (self._random_state
+                             .normal(0, scale, (num_users, latent_dim))
+                             .astype(np.float32))
+        self.item_factors = (self._random_state
+                             .normal(0, scale, (num_items, latent_dim))
+                             .astype(np.float32))
+
+    @property
+    def shape(self):
+
+        return (self._num_users, self._num_items)
+
+    def _generate_chunk(self, size):
+
+        random_state = self._random_state
+
+        user_ids = _sample_zipf(self._user_ranks, self._user_exponent,
+                                size, random_state)
+        candidates = _sample_zipf(self._item_ranks, self._item_exponent,
+                                  (size, self._num_candidates), random_state)
+
+        affinities = np.matmul(self.item_factors[candidates],
+                               self.user_factors[user_ids][:, :, np.newaxis]
+                               )[:, :, 0]
+
+        # Gumbel-max trick: a softmax sample over every row of candidates.
+        choices = np.argmax(affinities / self._temperature +
+                            random_state.gumbel(size=affinities.shape),
+                            axis=1)
+
+        return (user_ids.astype(np.int32),
+                candidates[np.arange(size), choices].astype(np.int32),
+                np.ones(size, dtype=np.float32))
+
+    def iter_chunks(self, num_interactions, chunk_size=2 ** 16):
+        """
+        Yield (user_ids, item_ids, ratings) arrays of at most
+        `chunk_size` interactions.
+        """
+
+        for start in range(0, num_interactions, chunk_size):
+            yield self._generate_chunk(min(chunk_size,
+                                           num_interactions - start))
+
+    def generate(self, num_interactions, chunk_size=2 ** 16):
+        """
+        Generate interactions as a np.float32 coo_matrix.
+        """
+
+        user_ids, item_ids, ratings = (
+            np.concatenate(x) for x in
+            zip(*self.iter_chunks(num_interactions, chunk_size)))
+
+        return sp.coo_matrix((ratings, (user_ids, item_ids)),
+                             shape=self.shape)
+
+    def write_shards(self, path, num_interactions, chunk_size=2 ** 16,
+                     shard_size=2 ** 22):
+        """
+        Stream interactions to memory-mapped shards, returning
+        the resulting `InteractionShards`.
+        """
+
+        writer = ShardWriter(path, shard_size=shard_size)
+
+        # Every write starts a new shard: generate a shard at a time.
+        for start in range(0, num_interactions, shard_size):
+            shard = (np.concatenate(x) for x in zip(*self.iter_chunks(
+                min(shard_size, num_interactions - start), chunk_size)))
+            writer.write(*shard)
+
+        return writer.close(*self.shape)
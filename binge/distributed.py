@@ -0,0 +1,230 @@
+"""
+Data-parallel CPU training of `FactorizationModel` across local processes.
+
+Every process holds a full replica of the model and trains on its own
+slice of each epoch's shuffled interactions. After every backward pass
+gradients are averaged across processes with an all-reduce, so that all
+replicas apply identical updates and stay in sync.
+
+Models with sparse embeddings cannot be fitted: their optimizer does
+not support sparse gradients.
+"""
+
+import multiprocessing
+import os
+import queue as queue_module
+import socket
+import time
+
+import numpy as np
+
+import torch
+import torch.distributed as dist
+
+
+def _all_reduce_gradients(net, world_size):
+
+    for param in net.parameters():
+
+        if param.grad is None:
+            continue
+
+        dist.all_reduce(param.grad.data)
+        param.grad.data /= world_size
+
+
+def _free_port():
+
+    # The port is released before the workers bind it,
+    # which is good enough for a localhost rendezvous.
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+
+        return sock.getsockname()[1]
+
+
+def _rank_slice(chunks, rank, world_size):
+
+    # Every process must take the same number of optimizer
+    # steps, so the remainder of each chunk is dropped.
+    for users, items, ratings in chunks:
+
+        shard_size = len(users) // world_size
+        start, stop = rank * shard_size, (rank + 1) * shard_size
+
+        yield (users[start:stop],
+               items[start:stop],
+               ratings[start:stop])
+
+
+def _worker(rank, world_size, model, interactions, seed,
+            master_port, queue, verbose):
+
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(master_port)
+
+    torch.set_num_threads(1)
+
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+
+    for param in model._net.parameters():
+        dist.broadcast(param.data, 0)
+
+    # The shuffle is shared so that ranks train on disjoint
+    # slices, while negative sampling differs between ranks.
+    shuffle_state = np.random.RandomState(seed)
+    model._random_state = np.random.RandomState(seed + 1 + rank)
+
+    optimizer = model._get_optimizer()
+    loss_fnc = model._get_loss_function()
+
+    batch_size = max(model._batch_size // world_size, 1)
+    gradient_hook = lambda net: _all_reduce_gradients(net, world_size)
+
+    for epoch_num in range(model._n_iter):
+
+        chunks = _rank_slice(model._epoch_chunks(interactions, shuffle_state),
+                             rank,
+                             world_size)
+        epoch_loss = model._fit_epoch(chunks,
+                                      optimizer,
+                                      loss_fnc,
+                                      batch_size=batch_size,
+                                      gradient_hook=gradient_hook)
+
+        if verbose and rank == 0:
+            print('Epoch {}: loss {}'.format(epoch_num, epoch_loss))
+
+    queue.put((rank, {name: value.cpu().numpy()
+                      for name, value in model._net.state_dict().items()}))
+
+    dist.destroy_process_group()
+
+
+def fit_distributed(model, interactions, num_processes,
+                    master_port=None, verbose=False):
+    """
+    Fit a `FactorizationModel` using `num_processes` local processes
+    that communicate through `torch.distributed` with the gloo backend.
+
+    The global minibatch size is the same as in single-process `fit`:
+    each process trains on `batch_size // num_processes` interactions
+    per step.
+
+    Arguments
+    ---------
+
+    model: FactorizationModel
+        The (CPU) model to fit. It is fitted in place.
+    interactions: np.float32 coo_matrix or InteractionShards
+        The training interactions.
+    num_processes: int
+        Number of data-parallel processes.
+    master_port: int, optional
+        Localhost port used for the process group rendezvous.
+        By default, a free port is picked.
+    verbose: bool, optional
+        Whether to print epoch loss statistics.
+
+    Returns
+    -------
+
+    state_dicts: list of dicts
+        The final parameters of every replica, in rank order.
+    """
+
+    assert not model._use_cuda, 'Distributed fitting is CPU-only'
+
+    if model._sparse:
+        raise ValueError('Distributed fitting does not support sparse '
+                         'embeddings: the optimizer (Adam) does not '
+                         'support sparse gradients.')
+
+    if master_port is None:
+        master_port = _free_port()
+
+    model._initialize(interactions)
+    seed = model._random_state.randint(np.iinfo(np.int32).max - num_processes)
+
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+
+    processes = [context.Process(target=_worker,
+                                 args=(rank, num_processes, model,
+                                       interactions, seed, master_port,
+                                       queue, verbose))
+                 for rank in range(num_processes)]
+
+    for process in processes:
+        process.start()
+
+    state_dicts = {}
+
+    while len(state_dicts) < num_processes:
+        try:
+            rank, state_dict = queue.get(timeout=1.0)
+            state_dicts[rank] = state_dict
+        except queue_module.Empty:
+            for process in processes:
+                if process.exitcode:
+                    for other in processes:
+                        other.terminate()
+                    raise Exception('Training process exited with code {}'
+                                    .format(process.exitcode))
+
+    for process in processes:
+        process.join()
+
+    state_dicts = [state_dicts[rank] for rank in range(num_processes)]
+
+    model._net.load_state_dict({name: torch.from_numpy(value)
+                                for name, value in state_dicts[0].items()})
+
+    return state_dicts
+
+
+def scaling_efficiency(model_factory, interactions, num_processes,
+                       master_port=None):
+    """
+    Compare the wall-clock time of distributed and single-process `fit`.
+
+    Arguments
+    ---------
+
+    model_factory: callable
+        Returns a fresh, unfitted `FactorizationModel`.
+    interactions: np.float32 coo_matrix or InteractionShards
+        The training interactions.
+    num_processes: int
+        Number of data-parallel processes.
+    master_port: int, optional
+        See `fit_distributed`.
+
+    Returns
+    -------
+
+    (single_duration, distributed_duration, efficiency): tuple
+        Durations in seconds, and the parallel efficiency:
+        the speedup over single-process training divided
+        by the number of processes.
+    """
+
+    # Distributed workers run single-threaded, so the baseline does too.
+    num_threads = torch.get_num_threads()
+    torch.set_num_threads(1)
+
+    try:
+        start = time.perf_counter()
+        model_factory().fit(interactions)
+        single_duration = time.perf_counter() - start
+    finally:
+        torch.set_num_threads(num_threads)
+
+    start = time.perf_counter()
+    fit_distributed(model_factory(), interactions, num_processes,
+                    master_port=master_port)
+    distributed_duration = time.perf_counter() - start
+
+    efficiency = single_duration / (distributed_duration * num_processes)
+
+    return single_duration, distributed_duration, efficiency
@@ -1,57 +1,773 @@
+import collections
+import functools
+import multiprocessing
+
+from multiprocessing.shared_memory import SharedMemory
+
 import numpy as np
 
-import scipy.stats as st
+import scipy.sparse as sp
+
+
+FLOAT_MAX = np.finfo(np.float32).max
 
-from sklearn.metrics import roc_auc_score
+# Bound on the number of score comparisons held in memory at once.
+COMPARISON_CHUNK_SIZE = 2 ** 24
 
 
-def mrr_score(model, test, train=None):
+def sample_users(test, num_users, random_state):
+    """
+    Return a copy of the test matrix restricted to a random
+    sample of at most `num_users` users with test interactions.
+    """
+
+    test = test.tocsr()
+
+    user_ids = np.flatnonzero(test.getnnz(axis=1))
+
+    if len(user_ids) > num_users:
+        user_ids = random_state.choice(user_ids, num_users, replace=False)
+
+    test = test.tocoo()
+    keep = np.isin(test.row, user_ids)
+
+    return sp.coo_matrix((test.data[keep],
+                          (test.row[keep], test.col[keep])),
+                         shape=test.shape).tocsr()
+
+
+def _predict_block(model, user_ids):
+    """
+    Scores of all items for a block of users, as an array of shape
+    [len(user_ids), n_items]. Models that can score a block of users
+    as one matrix product expose `predict_block`; for others the
+    per-user predictions are stacked.
+    """
+
+    if hasattr(model, 'predict_block'):
+        return model.predict_block(user_ids)
+
+    return np.vstack([model.predict(int(user_id)) for user_id in user_ids])
+
+
+def _blocks(test, train, block_size):
+    """
+    Yield (user_ids, test_block, train_block) for consecutive
+    blocks of users with at least one test interaction.
+    """
 
     test = test.tocsr()
 
     if train is not None:
         train = train.tocsr()
 
+    user_ids = np.flatnonzero(test.getnnz(axis=1))
+
+    for i in range(0, len(user_ids), block_size):
+        block_user_ids = user_ids[i:i + block_size]
+
+        yield (block_user_ids,
+               test[block_user_ids],
+               train[block_user_ids] if train is not None else None)
+
+
+def _row_indices(block):
+
+    return np.repeat(np.arange(block.shape[0], dtype=np.int64),
+                     np.diff(block.indptr))
+
+
+def _set_scores(scores, block, value):
+
+    if block is not None:
+        scores[_row_indices(block), block.indices] = value
+
+
+def _count_higher(scores, rows, items):
+    """
+    For every (row, item) pair, count the items in that row of `scores`
+    that score strictly higher than, and exactly as high as, the item.
+    This is a linear pass per pair rather than a full sort.
+    """
+
+    targets = scores[rows, items]
+
+    higher = np.empty(len(rows), dtype=np.int64)
+    equal = np.empty(len(rows), dtype=np.int64)
+
+    chunk_size = max(COMPARISON_CHUNK_SIZE // scores.shape[1], 1)
+
+    for i in range(0, len(rows), chunk_size):
+        row_scores = scores[rows[i:i + chunk_size]]
+        target_scores = targets[i:i + chunk_size, np.newaxis]
+
+        higher[i:i + chunk_size] = (row_scores > target_scores).sum(axis=1)
+        equal[i:i + chunk_size] = (row_scores == target_scores).sum(axis=1)
+
+    return higher, equal
+
+
+def _per_row_mean(values, rows, num_rows):
+
+    return (np.bincount(rows, weights=values, minlength=num_rows) /
+            np.bincount(rows, minlength=num_rows))
+
+
+def _block_ranks(model, user_ids, test_block, train_block, excluded_last):
+    """
+    Descending ranks (1 for the highest score, ties averaged) of every
+    test interaction in the block, and the block row of each.
+
+    Training items are ranked below all other items if `excluded_last`
+    is set, and above all other items otherwise. Models exposing
+    `rank_of`, such as the native scorers, compute ranks in-kernel;
+    for other models the scores of all items are compared in numpy.
+    """
+
+    rows = _row_indices(test_block)
+
+    if hasattr(model, 'rank_of'):
+        return rows, _native_ranks(model, user_ids, test_block,
+                                   train_block, excluded_last)
+
+    scores = _predict_block(model, user_ids)
+    _set_scores(scores, train_block,
+                -FLOAT_MAX if excluded_last else FLOAT_MAX)
+
+    higher, equal = _count_higher(scores, rows, test_block.indices)
+
+    # Average rank among tied items (including the item itself).
+    return rows, higher + (equal + 1) / 2.0
+
+
+def _native_ranks(model, user_ids, test_block, train_block, excluded_last):
+
+    num_items = test_block.shape[1]
+    ranks = []
+
+    for row, user_id in enumerate(user_ids):
+
+        targets = test_block.indices[test_block.indptr[row]:
+                                     test_block.indptr[row + 1]]
+
+        if train_block is not None:
+            excluded = np.unique(
+                train_block.indices[train_block.indptr[row]:
+                                    train_block.indptr[row + 1]])
+        else:
+            excluded = np.array([], dtype=np.int32)
+
+        user_ranks = model.rank_of(int(user_id), targets, excluded)
+
+        if not excluded_last:
+            # Moving the excluded items from the bottom to the top of
+            # the ranking shifts the other items down by their number,
+            # and the excluded items up by the number of the others.
+            is_excluded = np.isin(targets, excluded)
+            user_ranks = np.where(is_excluded,
+                                  user_ranks - (num_items - len(excluded)),
+                                  user_ranks + len(excluded))
+
+        ranks.append(user_ranks)
+
+    return np.concatenate(ranks)
+
+
+def _mrr_score(model, test, train, block_size):
+
     mrrs = []
 
-    for user_id, row in enumerate(test):
+    for user_ids, test_block, train_block in _blocks(test, train, block_size):
+
+        rows, ranks = _block_ranks(model, user_ids, test_block, train_block,
+                                   excluded_last=True)
+
+        mrrs.append(_per_row_mean(1.0 / ranks, rows, len(user_ids)))
+
+    return np.concatenate(mrrs) if mrrs else np.array([])
+
+
+def _auc_score(model, test, train, block_size):
+
+    aucs = []
+
+    for user_ids, test_block, train_block in _blocks(test, train, block_size):
+
+        rows, ranks = _block_ranks(model, user_ids, test_block, train_block,
+                                   excluded_last=False)
+
+        num_items = test_block.shape[1]
+
+        # Ascending rank, averaged over ties.
+        ranks = num_items + 1 - ranks
+
+        num_positives = np.diff(test_block.indptr)
+        num_negatives = num_items - num_positives
+
+        # The Mann-Whitney U statistic of the positive items' ranks.
+        rank_sums = np.bincount(rows, weights=ranks, minlength=len(user_ids))
+
+        aucs.append((rank_sums - num_positives * (num_positives + 1) / 2.0) /
+                    (num_positives * num_negatives))
+
+    return np.concatenate(aucs) if aucs else np.array([])
+
+
+def _row_range(matrix, start, stop):
+    """
+    Return a copy of a CSR matrix with only rows [start, stop)
+    kept, preserving its shape and therefore its user ids.
+    """
+
+    indptr = matrix.indptr
+    nnz = indptr[stop] - indptr[start]
+
+    return sp.csr_matrix(
+        (matrix.data[indptr[start]:indptr[stop]],
+         matrix.indices[indptr[start]:indptr[stop]],
+         np.concatenate([np.zeros(start, dtype=indptr.dtype),
+                         indptr[start:stop + 1] - indptr[start],
+                         np.repeat(nnz, matrix.shape[0] - stop)])
+         .astype(indptr.dtype)),
+        shape=matrix.shape)
+
+
+def _shard_boundaries(test, num_shards):
+
+    # Split users into contiguous ranges holding roughly
+    # equal numbers of test users.
+    user_ids = np.flatnonzero(test.getnnz(axis=1))
+    splits = np.array_split(user_ids, num_shards)
+
+    return [(split[0], split[-1] + 1) for split in splits if len(split)]
+
+
+def _share_arrays(arrays):
 
-        if not len(row.indices):
-            continue
+    blocks = []
+    descriptors = {}
 
-        predictions = -model.predict(user_id)
+    for name, array in arrays.items():
+        block = SharedMemory(create=True, size=max(array.nbytes, 1))
+        shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+        shared[...] = array
 
-        if train is not None:
-            predictions[train[user_id].indices] = np.finfo(np.float32).max
+        blocks.append(block)
+        descriptors[name] = (block.name, array.shape, array.dtype.str)
 
-        mrr = (1.0 / st.rankdata(predictions)[row.indices]).mean()
+    return blocks, descriptors
 
-        mrrs.append(mrr)
 
-    return np.array(mrrs)
+# Per-process state of evaluation workers.
+_worker_model = None
+_worker_blocks = None
 
 
-def auc_score(model, test, train=None):
+def _initialize_worker(scorer_class, descriptors, model):
+
+    global _worker_model, _worker_blocks
+
+    if scorer_class is None:
+        _worker_model = model
+        return
+
+    _worker_blocks = {name: SharedMemory(name=block_name)
+                      for name, (block_name, _, _) in descriptors.items()}
+
+    _worker_model = scorer_class._from_state(
+        {name: np.ndarray(shape, dtype=dtype,
+                          buffer=_worker_blocks[name].buf)
+         for name, (_, shape, dtype) in descriptors.items()})
+
+
+def _evaluate_shard(args):
+
+    metric, test, train, block_size = args
+
+    return metric(_worker_model, test, train, block_size)
+
+
+def _scoring_model(model):
+    """
+    Fitted models are evaluated through their native scorer, whatever
+    the number of jobs, so that results do not depend on `n_jobs`.
+    """
+
+    return model.get_scorer() if hasattr(model, 'get_scorer') else model
+
+
+def _evaluate_parallel(metric, model, test, train, block_size, n_jobs):
+    """
+    Evaluate `metric` over shards of users in a pool of `n_jobs`
+    processes. Native scorers are attached to by the workers through
+    shared memory; any other model is pickled into the workers.
+    """
 
     test = test.tocsr()
 
     if train is not None:
         train = train.tocsr()
 
-    aucs = []
+    blocks = []
+
+    if hasattr(model, '_state'):
+        blocks, descriptors = _share_arrays(model._state())
+        initargs = (type(model), descriptors, None)
+    else:
+        initargs = (None, None, model)
+
+    shards = [(metric,
+               _row_range(test, start, stop),
+               _row_range(train, start, stop) if train is not None else None,
+               block_size)
+              for start, stop in _shard_boundaries(test, 4 * n_jobs)]
+
+    try:
+        context = multiprocessing.get_context('spawn')
+
+        with context.Pool(n_jobs,
+                          initializer=_initialize_worker,
+                          initargs=initargs) as pool:
+            results = pool.map(_evaluate_shard, shards)
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    return _concatenate(results)
+
+
+def _concatenate(results):
+
+    if results and isinstance(results[0], dict):
+        return {name: _concatenate([result[name] for result in results])
+                for name in results[0]}
+
+    return np.concatenate(results) if results else np.array([])
+
+
+def mrr_score(model, test, train=None, block_size=256, n_jobs=1):
+    """
+    Compute the mean reciprocal rank of the test items of every user
+    with at least one test interaction. Items in `train` are ranked last.
+
+    `model` may be a fitted model or any scorer: anything with a
+    `predict(user_id)` method returning the scores of all items.
+    Fitted models are evaluated through their native scorer (see
+    `get_scorer`), and native scorers (`Scorer`, `XNORScorer`) rank
+    test items in-kernel, exactly as served.
 
-    for user_id, row in enumerate(test):
+    Users are scored in blocks of `block_size`. Ties are given their
+    average rank.
+
+    If `n_jobs` is greater than 1, users are split into shards that are
+    evaluated in a pool of worker processes, which attach to native
+    scorers via shared memory. Results do not depend on `n_jobs`.
+
+    Returns
+    -------
+
+    mrrs: np.array of shape [n_test_users,]
+        In increasing order of user id.
+    """
+
+    model = _scoring_model(model)
+
+    if n_jobs > 1:
+        return _evaluate_parallel(_mrr_score, model, test, train,
+                                  block_size, n_jobs)
+
+    return _mrr_score(model, test, train, block_size)
+
+
+def auc_score(model, test, train=None, block_size=256, n_jobs=1):
+    """
+    Compute the ROC AUC of every user with at least one test interaction,
+    treating test items as positives and all other items as negatives.
+    Items in `train` are given the highest possible score.
+
+    Users are scored in blocks of `block_size`; AUC is computed from the
+    ranks of the positive items. See `mrr_score` for `n_jobs`.
+
+    Returns
+    -------
+
+    aucs: np.array of shape [n_test_users,]
+        In increasing order of user id.
+    """
+
+    model = _scoring_model(model)
+
+    if n_jobs > 1:
+        return _evaluate_parallel(_auc_score, model, test, train,
+                                  block_size, n_jobs)
+
+    return _auc_score(model, test, train, block_size)
+
+
+METRICS = ('mrr', 'auc', 'filtered_auc',
+           'precision', 'recall', 'ndcg')
+
+
+def _dense_rows(block):
+
+    dense = np.zeros(block.shape, dtype=bool)
+    dense[_row_indices(block), block.indices] = True
+
+    return dense
+
+
+def _count_higher_within_rows(values, rows):
+    """
+    For every element, count the elements of the same row
+    with strictly higher and exactly equal values.
+    """
+
+    if not len(values):
+        return (np.zeros(0, dtype=np.int64),) * 2
+
+    # Encode (row, value) pairs as integers that sort by row first.
+    _, value_ranks = np.unique(values, return_inverse=True)
+    num_values = value_ranks.max() + 1
+
+    keys = rows * num_values + value_ranks
+    sorted_keys = np.sort(keys)
+
+    row_ends = np.searchsorted(sorted_keys, (rows + 1) * num_values)
+    first_equal = np.searchsorted(sorted_keys, keys, side='left')
+    first_higher = np.searchsorted(sorted_keys, keys, side='right')
+
+    return row_ends - first_higher, first_higher - first_equal
+
+
+def _evaluate(model, test, train, block_size, metrics, k):
+
+    results = {name: [] for name in metrics}
+
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+
+    for user_ids, test_block, train_block in _blocks(test, train, block_size):
+
+        scores = _predict_block(model, user_ids)
+        _set_scores(scores, train_block, -FLOAT_MAX)
+
+        num_users, num_items = scores.shape
+        rows = _row_indices(test_block)
+        num_test = np.diff(test_block.indptr)
+
+        higher, equal = _count_higher(scores, rows, test_block.indices)
+        ranks = higher + (equal + 1) / 2.0
+
+        if 'mrr' in metrics:
+            results['mrr'].append(_per_row_mean(1.0 / ranks, rows, num_users))
+
+        if set(metrics) & {'auc', 'filtered_auc'}:
+            if train_block is not None:
+                in_train = _dense_rows(train_block)[rows, test_block.indices]
+                num_train = np.diff(train_block.indptr)
+            else:
+                in_train = np.zeros(len(rows), dtype=bool)
+                num_train = np.zeros(num_users, dtype=np.int64)
+
+        if 'auc' in metrics:
+            # As in auc_score, training items score highest, tied with
+            # each other, rather than lowest as they do in `scores`.
+            auc_higher = np.where(in_train, 0, higher + num_train[rows])
+            auc_equal = np.where(in_train, num_train[rows], equal)
+
+            # Ascending rank, averaged over ties.
+            ascending = num_items + 1 - (auc_higher + (auc_equal + 1) / 2.0)
+            num_negatives = num_items - num_test
+
+            # Users with every item in the test set have no AUC.
+            with np.errstate(divide='ignore', invalid='ignore'):
+                results['auc'].append(
+                    (np.bincount(rows, weights=ascending, minlength=num_users)
+                     - num_test * (num_test + 1) / 2.0)
+                    / (num_test * num_negatives))
+
+        if 'filtered_auc' in metrics:
+            # Training items take part in neither side of the
+            # comparison: negatives are the items in neither set.
+            positive_higher, positive_equal = _count_higher_within_rows(
+                np.where(in_train, -np.inf, scores[rows, test_block.indices]),
+                rows)
+
+            num_positives = np.bincount(rows, weights=~in_train,
+                                        minlength=num_users)
+            num_negatives = num_items - num_train - num_positives
+
+            negatives_higher = higher - positive_higher
+            negatives_equal = equal - positive_equal
+
+            pair_aucs = ((num_negatives[rows] - negatives_higher
+                          - 0.5 * negatives_equal)
+                         / np.maximum(num_negatives[rows], 1))
+            pair_aucs[in_train] = 0.0
+
+            # Users left without positives or negatives have no AUC.
+            defined = (num_positives > 0) & (num_negatives > 0)
+
+            results['filtered_auc'].append(np.where(
+                defined,
+                np.bincount(rows, weights=pair_aucs, minlength=num_users)
+                / np.maximum(num_positives, 1),
+                np.nan))
+
+        if set(metrics) & {'precision', 'recall', 'ndcg'}:
+            top_k = np.argpartition(-scores, min(k, num_items) - 1,
+                                    axis=1)[:, :k]
+            top_k_scores = np.take_along_axis(scores, top_k, axis=1)
+            top_k = np.take_along_axis(top_k,
+                                       np.argsort(-top_k_scores, axis=1,
+                                                  kind='stable'),
+                                       axis=1)
+
+            hits = np.take_along_axis(_dense_rows(test_block), top_k, axis=1)
+            num_hits = hits.sum(axis=1)
+
+            if 'precision' in metrics:
+                results['precision'].append(num_hits / float(k))
+            if 'recall' in metrics:
+                results['recall'].append(num_hits / num_test)
+            if 'ndcg' in metrics:
+                ideal = np.cumsum(discounts)[np.minimum(num_test, k) - 1]
+                results['ndcg'].append(
+                    (hits * discounts[:hits.shape[1]]).sum(axis=1) / ideal)
+
+    return {name: _concatenate(values) for name, values in results.items()}
+
+
+def evaluate(model, test, train=None, metrics=METRICS, k=10,
+             block_size=256, n_jobs=1):
+    """
+    Compute several metrics in a single pass: every user's scores are
+    computed once, and all metrics are derived from them.
+
+    Metrics match those of `mrr_score` and `auc_score` under the same
+    name: for MRR, items in `train` are ranked below all other items,
+    and for AUC they are given the highest possible score. They are
+    never recommended in the top k.
+
+    Arguments
+    ---------
+
+    model: fitted model or scorer
+        See `mrr_score`.
+    test: coo_matrix of shape [n_users, n_items]
+    train: coo_matrix of shape [n_users, n_items], optional
+    metrics: sequence of strings, optional
+        Any of 'mrr', 'auc', 'filtered_auc', 'precision'
+        (precision@k), 'recall' (recall@k) and 'ndcg' (NDCG@k).
+        'filtered_auc' is the AUC with items in `train` counted
+        neither as positives nor as negatives.
+    k: int, optional
+        Cutoff for the top-k metrics.
+    block_size: int, optional
+        Number of users scored at a time.
+    n_jobs: int, optional
+        Number of worker processes; see `mrr_score`.
+
+    Returns
+    -------
+
+    results: dict of metric name to np.array of shape [n_test_users,]
+        Per-user metric values, in increasing order of user id. The
+        AUC of users without negatives, and the filtered AUC of users
+        whose test items are all in `train`, are NaN.
+    """
+
+    unknown = set(metrics) - set(METRICS)
+
+    if unknown:
+        raise ValueError('Unknown metrics: {}'.format(sorted(unknown)))
+
+    metric = functools.partial(_evaluate, metrics=tuple(metrics), k=k)
+    model = _scoring_model(model)
+
+    if n_jobs > 1:
+        return _evaluate_parallel(metric, model, test, train,
+                                  block_size, n_jobs)
+
+    return metric(model, test, train, block_size)
+
+
+Estimate = collections.namedtuple('Estimate', ['value', 'lower', 'upper'])
+
+
+def _stratified_sample(activity, num_users, num_strata, random_state):
+    """
+    Split users into `num_strata` activity quantiles and draw from each
+    stratum in proportion to its size.
+
+    Returns (sampled, shares): a list holding, for every non-empty
+    stratum, the sorted positions within `activity` of its sampled
+    users, and an array of the share of all users in every stratum.
+    """
+
+    edges = np.unique(np.quantile(activity, np.linspace(0, 1,
+                                                        num_strata + 1)))
+    strata = np.searchsorted(edges[1:-1], activity, side='right')
+
+    sampled = []
+    shares = []
+
+    for stratum in np.unique(strata):
+        members = np.flatnonzero(strata == stratum)
+        size = max(int(round(num_users * len(members) / len(activity))), 1)
+
+        if size < len(members):
+            members = np.sort(random_state.choice(members, size,
+                                                  replace=False))
+
+        sampled.append(members)
+        shares.append(np.mean(strata == stratum))
+
+    return sampled, np.array(shares)
+
+
+def _sampled_ranks(model, user_id, test_items, train_items, negatives,
+                   num_items):
+    """
+    Estimate the full-catalog ranks of a user's test items from their
+    ranks among a sample of candidate items.
+    """
+
+    candidates = negatives[~np.isin(negatives, train_items)]
+
+    scores = model.predict(int(user_id),
+                           np.concatenate([test_items, candidates])
+                           .astype(np.int32))
+    test_scores, candidate_scores = (scores[:len(test_items)],
+                                     scores[len(test_items):])
+
+    higher = (candidate_scores > test_scores[:, np.newaxis]).sum(axis=1)
+    equal = (candidate_scores == test_scores[:, np.newaxis]).sum(axis=1)
+
+    # A test item does not compete with itself.
+    is_candidate = np.isin(test_items, candidates)
+    equal -= is_candidate
+
+    num_sampled = len(candidates) - is_candidate
+    num_competitors = num_items - len(train_items) - 1
+
+    # Every sampled competitor stands in for
+    # num_competitors / num_sampled items of the catalog.
+    scale = num_competitors / np.maximum(num_sampled, 1)
+
+    return 1.0 + (higher + 0.5 * equal) * scale
+
+
+def _bootstrap(values, shares, num_bootstrap, confidence, random_state):
+
+    estimate = sum(share * stratum_values.mean()
+                   for share, stratum_values in zip(shares, values))
+
+    replicates = np.zeros(num_bootstrap)
+
+    # Resample users within each stratum, keeping stratum weights fixed.
+    for share, stratum_values in zip(shares, values):
+        indices = random_state.randint(0, len(stratum_values),
+                                       (num_bootstrap, len(stratum_values)))
+        replicates += share * stratum_values[indices].mean(axis=1)
+
+    alpha = (1.0 - confidence) / 2.0
+    lower, upper = np.quantile(replicates, [alpha, 1.0 - alpha])
+
+    return Estimate(estimate, lower, upper)
+
+
+def sampled_evaluate(model, test, train=None, num_negatives=100,
+                     num_users=1000, num_strata=5, k=10,
+                     num_bootstrap=1000, confidence=0.95,
+                     random_seed=None):
+    """
+    Estimate full-catalog MRR and recall@k by ranking every test item
+    against a fixed sample of items rather than the whole catalog.
+
+    A single seeded sample of `num_negatives` items is drawn and shared
+    by all users, so that repeated evaluations are comparable. A test
+    item's rank among the sampled items (other than training items,
+    which are ranked last) is rescaled to the catalog size:
+    r = 1 + (r_s - 1) * n_competitors / n_sampled. Users are subsampled
+    in proportion to the size of their activity stratum.
+
+    The confidence intervals come from a stratified bootstrap over
+    users and account for user sampling only. The bias of the rank
+    rescaling shrinks as `num_negatives` grows: with `num_negatives`
+    at least the number of items the ranks are exact, and the estimates
+    match `mrr_score` over the sampled users.
+
+    Arguments
+    ---------
+
+    model: fitted model or scorer
+        Anything with a `predict(user_id, item_ids)` method.
+    test: coo_matrix of shape [n_users, n_items]
+    train: coo_matrix of shape [n_users, n_items], optional
+    num_negatives: int, optional
+        Number of sampled items every test item is ranked against.
+        Runtime is linear in it.
+    num_users: int, optional
+        Approximate number of users to evaluate. Runtime is linear in it,
+        and the confidence intervals shrink with its square root.
+    num_strata: int, optional
+        Number of activity quantiles users are stratified by. Activity
+        is the number of training interactions, or of test interactions
+        if `train` is not given.
+    k: int, optional
+        Cutoff for recall@k.
+    num_bootstrap: int, optional
+        Number of bootstrap replicates.
+    confidence: float, optional
+        Coverage of the confidence intervals.
+    random_seed: int, optional
+
+    Returns
+    -------
+
+    estimates: dict of metric name to Estimate
+        Estimates for 'mrr' and 'recall', as (value, lower, upper) tuples.
+    """
+
+    random_state = np.random.RandomState(random_seed)
+
+    test = test.tocsr()
+    train = train.tocsr() if train is not None else None
+
+    num_items = test.shape[1]
+
+    negatives = random_state.choice(num_items,
+                                    min(num_negatives, num_items),
+                                    replace=False)
+
+    user_ids = np.flatnonzero(test.getnnz(axis=1))
+    activity = (train if train is not None else test).getnnz(axis=1)[user_ids]
+
+    strata, shares = _stratified_sample(activity, num_users,
+                                        num_strata, random_state)
+
+    mrrs = []
+    recalls = []
 
-        if not len(row.indices):
-            continue
+    for members in strata:
+        stratum_mrrs = np.empty(len(members))
+        stratum_recalls = np.empty(len(members))
 
-        predictions = model.predict(user_id)
+        for i, user_id in enumerate(user_ids[members]):
+            train_items = (train[user_id].indices if train is not None
+                           else np.array([], dtype=np.int32))
 
-        if train is not None:
-            predictions[train[user_id].indices] = np.finfo(np.float32).max
+            ranks = _sampled_ranks(model, user_id, test[user_id].indices,
+                                   train_items, negatives, num_items)
 
-        auc = roc_auc_score(np.squeeze(np.array(row.todense())), predictions)
+            stratum_mrrs[i] = (1.0 / ranks).mean()
+            stratum_recalls[i] = (ranks <= k).mean()
 
-        aucs.append(auc)
+        mrrs.append(stratum_mrrs)
+        recalls.append(stratum_recalls)
 
-    return np.array(aucs)
+    return {'mrr': _bootstrap(mrrs, shares, num_bootstrap,
+                              confidence, random_state),
+            'recall': _bootstrap(recalls, shares, num_bootstrap,
+                                 confidence, random_state)}
@@ -0,0 +1,365 @@
+"""
+Opt-in instrumentation of the scoring hot path.
+
+When enabled, every instrumented call records, per phase (such as
+aligning inputs, preparing arguments, or running the kernel), the
+number of calls, a latency histogram with power-of-two nanosecond
+buckets, and the number of bytes the phase touched. Optionally, Linux
+`perf_event` hardware counters (cycles, last-level cache misses and
+data TLB misses) are read at every phase boundary.
+
+Instrumented code asks for a recorder and marks the end of each phase:
+
+    record = instrumentation.recorder('scorer.predict')
+    ...
+    record('align', nbytes)
+    ...
+    record('kernel', lambda: count_bytes(...))
+
+Byte counts that take work to compute are passed as callables, which
+are only called while recording. When instrumentation is disabled,
+`recorder` returns a shared no-op recorder, so the cost is a few
+attribute lookups and empty calls.
+
+Collected statistics are exported with `snapshot` (as a dict)
+or `prometheus` (in the Prometheus text exposition format).
+"""
+
+import ctypes
+import os
+import platform
+import threading
+import time
+
+
+NUM_BUCKETS = 64
+
+# perf_event_open(2) constants.
+_PERF_TYPE_HARDWARE = 0
+_PERF_TYPE_HW_CACHE = 3
+_PERF_COUNT_HW_CPU_CYCLES = 0
+_PERF_COUNT_HW_CACHE_MISSES = 3
+# Data TLB (3) read (0 << 8) misses (1 << 16).
+_PERF_COUNT_HW_CACHE_DTLB_READ_MISSES = 3 | (0 << 8) | (1 << 16)
+_PERF_EXCLUDE_KERNEL = 1 << 5
+_PERF_EXCLUDE_HV = 1 << 6
+_PERF_ATTR_SIZE = 128
+
+_SYSCALL_NUMBERS = {'x86_64': 298, 'aarch64': 241}
+
+PERF_EVENTS = (('cycles', _PERF_TYPE_HARDWARE, _PERF_COUNT_HW_CPU_CYCLES),
+               ('llc_misses', _PERF_TYPE_HARDWARE,
+                _PERF_COUNT_HW_CACHE_MISSES),
+               ('dtlb_misses', _PERF_TYPE_HW_CACHE,
+                _PERF_COUNT_HW_CACHE_DTLB_READ_MISSES))
+
+
+class _PerfEventAttr(ctypes.Structure):
+
+    _fields_ = [('type', ctypes.c_uint32),
+                ('size', ctypes.c_uint32),
+                ('config', ctypes.c_uint64),
+                ('sample_period', ctypes.c_uint64),
+                ('sample_type', ctypes.c_uint64),
+                ('read_format', ctypes.c_uint64),
+                ('flags', ctypes.c_uint64),
+                ('padding', ctypes.c_uint8 * (_PERF_ATTR_SIZE - 48))]
+
+
+def _open_perf_event(event_type, config):
+
+    syscall_number = _SYSCALL_NUMBERS.get(platform.machine())
+
+    if syscall_number is None:
+        raise OSError('perf_event is not supported on {}'
+                      .format(platform.machine()))
+
+    attr = _PerfEventAttr(type=event_type,
+                          size=_PERF_ATTR_SIZE,
+                          config=config,
+                          flags=_PERF_EXCLUDE_KERNEL | _PERF_EXCLUDE_HV)
+
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.syscall.restype = ctypes.c_long
+
+    # Count for the calling thread only (pid 0 without `inherit`), on
+    # any CPU: phases run on other threads are not counted.
+    fd = libc.syscall(syscall_number, ctypes.byref(attr),
+                      0, -1, -1, ctypes.c_ulong(0))
+
+    if fd < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, 'perf_event_open failed: {}'
+                      .format(os.strerror(errno)))
+
+    return fd
+
+
+class _PerfCounters:
+
+    def __init__(self):
+
+        self._fds = []
+
+        try:
+            for _, event_type, config in PERF_EVENTS:
+                self._fds.append(_open_perf_event(event_type, config))
+        except OSError:
+            self.close()
+            raise
+
+    def read(self):
+
+        return [int.from_bytes(os.read(fd, 8), 'little')
+                for fd in self._fds]
+
+    def close(self):
+
+        for fd in self._fds:
+            os.close(fd)
+
+        self._fds = []
+
+
+class _PhaseStats:
+
+    __slots__ = ('count', 'nanoseconds', 'bytes', 'histogram', 'events')
+
+    def __init__(self):
+
+        self.count = 0
+        self.nanoseconds = 0
+        self.bytes = 0
+        self.histogram = [0] * NUM_BUCKETS
+        self.events = [0] * len(PERF_EVENTS)
+
+    def add(self, nanoseconds, nbytes, events):
+
+        self.count += 1
+        self.nanoseconds += nanoseconds
+        self.bytes += nbytes
+        self.histogram[min(nanoseconds.bit_length(), NUM_BUCKETS - 1)] += 1
+
+        if events is not None:
+            for i, value in enumerate(events):
+                self.events[i] += value
+
+
+class _Registry:
+
+    def __init__(self):
+
+        self.enabled = False
+        self.perf_counters = None
+
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def commit(self, operation, phases):
+
+        with self._lock:
+            for phase, nanoseconds, nbytes, events in phases:
+                key = (operation, phase)
+
+                if key not in self._stats:
+                    self._stats[key] = _PhaseStats()
+
+                self._stats[key].add(nanoseconds, nbytes, events)
+
+    def items(self):
+
+        with self._lock:
+            return sorted(self._stats.items())
+
+    def reset(self):
+
+        with self._lock:
+            self._stats = {}
+
+
+_registry = _Registry()
+
+
+class _Recorder:
+
+    __slots__ = ('_operation', '_phases', '_last', '_last_events')
+
+    def __init__(self, operation):
+
+        self._operation = operation
+        self._phases = []
+        self._last_events = (_registry.perf_counters.read()
+                             if _registry.perf_counters is not None
+                             else None)
+        self._last = time.perf_counter_ns()
+
+    def __call__(self, phase, nbytes=0):
+
+        now = time.perf_counter_ns()
+
+        if callable(nbytes):
+            nbytes = nbytes()
+
+        events = None
+
+        if self._last_events is not None:
+            current = _registry.perf_counters.read()
+            events = [x - y for (x, y) in zip(current, self._last_events)]
+            self._last_events = current
+
+        self._phases.append((phase, now - self._last, nbytes, events))
+        self._last = time.perf_counter_ns()
+
+    def finish(self):
+
+        _registry.commit(self._operation, self._phases)
+
+
+class _NullRecorder:
+
+    __slots__ = ()
+
+    def __call__(self, phase, nbytes=0):
+
+        pass
+
+    def finish(self):
+
+        pass
+
+
+_NULL_RECORDER = _NullRecorder()
+
+
+def recorder(operation):
+    """
+    Return a recorder for one call of `operation`. Call it with the
+    name and bytes touched at the end of every phase, and call its
+    `finish` method once the operation completes. The bytes may be
+    given as a callable returning them, called only when recording.
+    """
+
+    if not _registry.enabled:
+        return _NULL_RECORDER
+
+    return _Recorder(operation)
+
+
+def is_enabled():
+
+    return _registry.enabled
+
+
+def enable(perf_events=False):
+    """
+    Start recording. If `perf_events` is true, also read hardware
+    cycle, last-level cache miss and data TLB miss counters; this
+    raises OSError if perf events are unavailable, as in many
+    containers or with a restrictive `kernel.perf_event_paranoid`.
+    """
+
+    if perf_events and _registry.perf_counters is None:
+        _registry.perf_counters = _PerfCounters()
+    elif not perf_events and _registry.perf_counters is not None:
+        _registry.perf_counters.close()
+        _registry.perf_counters = None
+
+    _registry.enabled = True
+
+
+def disable():
+
+    _registry.enabled = False
+
+    if _registry.perf_counters is not None:
+        _registry.perf_counters.close()
+        _registry.perf_counters = None
+
+
+def reset():
+
+    _registry.reset()
+
+
+def _bucket_bound(bucket):
+
+    # Bucket i holds durations below 2 ** i nanoseconds.
+    return 2 ** bucket * 1e-9
+
+
+def snapshot():
+    """
+    Return the recorded statistics as a dict of operation
+    to phase to statistics.
+
+    Histograms map the upper bound of every non-empty
+    bucket, in seconds, to the number of calls in it.
+    """
+
+    stats = {}
+
+    for (operation, phase), phase_stats in _registry.items():
+        data = {'count': phase_stats.count,
+                'seconds': phase_stats.nanoseconds * 1e-9,
+                'bytes': phase_stats.bytes,
+                'histogram': {_bucket_bound(i): count for i, count
+                              in enumerate(phase_stats.histogram)
+                              if count}}
+
+        if _registry.perf_counters is not None:
+            data.update((name, value) for ((name, _, _), value)
+                        in zip(PERF_EVENTS, phase_stats.events))
+
+        stats.setdefault(operation, {})[phase] = data
+
+    return stats
+
+
+def prometheus(prefix='binge'):
+    """
+    Return the recorded statistics in the Prometheus
+    text exposition format.
+    """
+
+    lines = ['# TYPE {}_phase_seconds histogram'.format(prefix)]
+    counters = []
+
+    for (operation, phase), phase_stats in _registry.items():
+        labels = 'operation="{}",phase="{}"'.format(operation, phase)
+
+        last_bucket = max(i for i, count in
+                          enumerate(phase_stats.histogram) if count)
+        cumulative = 0
+
+        for i in range(last_bucket + 1):
+            cumulative += phase_stats.histogram[i]
+            lines.append('{}_phase_seconds_bucket{{{},le="{:g}"}} {}'
+                         .format(prefix, labels, _bucket_bound(i),
+                                 cumulative))
+
+        lines.append('{}_phase_seconds_bucket{{{},le="+Inf"}} {}'
+                     .format(prefix, labels, phase_stats.count))
+        lines.append('{}_phase_seconds_sum{{{}}} {:g}'
+                     .format(prefix, labels, phase_stats.nanoseconds * 1e-9))
+        lines.append('{}_phase_seconds_count{{{}}} {}'
+                     .format(prefix, labels, phase_stats.count))
+
+        counters.append(('bytes', labels, phase_stats.bytes))
+
+        if _registry.perf_counters is not None:
+            counters.extend((name, labels, value) for ((name, _, _), value)
+                            in zip(PERF_EVENTS, phase_stats.events))
+
+    for name in ['bytes'] + [name for name, _, _ in PERF_EVENTS]:
+        values = [(labels, value) for (counter, labels, value) in counters
+                  if counter == name]
+
+        if not values:
+            continue
+
+        lines.append('# TYPE {}_phase_{}_total counter'.format(prefix, name))
+        lines.extend('{}_phase_{}_total{{{}}} {}'.format(prefix, name,
+                                                         labels, value)
+                     for labels, value in values)
+
+    return '\n'.join(lines) + '\n'
@@ -1,5 +1,6 @@
 import numpy as np
 
+import torch
 import torch.nn as nn
 
 
@@ -17,3 +18,98 @@ class ZeroEmbedding(nn.Embedding):
         self.weight.data.zero_()
         if self.padding_idx is not None:
             self.weight.data[self.padding_idx].fill_(0)
+
+
+class QREmbedding(nn.Module):
+    """
+    Quotient-remainder compositional embedding.
+
+    Row `i` is the elementwise product of row `i // num_buckets` of a
+    quotient table and row `i % num_buckets` of a remainder table. This
+    needs `num_embeddings / num_buckets + num_buckets` rows instead of
+    `num_embeddings` while still giving every id a unique representation.
+    """
+
+    def __init__(self, num_embeddings, embedding_dim,
+                 num_buckets=None, sparse=False):
+
+        super().__init__()
+
+        if num_buckets is None:
+            num_buckets = int(np.ceil(np.sqrt(num_embeddings)))
+
+        self.num_embeddings = num_embeddings
+        self.embedding_dim = embedding_dim
+        self.num_buckets = num_buckets
+
+        self.quotient = nn.Embedding(
+            int(np.ceil(num_embeddings / num_buckets)),
+            embedding_dim,
+            sparse=sparse)
+        self.remainder = nn.Embedding(num_buckets, embedding_dim,
+                                      sparse=sparse)
+
+        self.reset_parameters()
+
+    def reset_parameters(self):
+        # The product of the two rows has standard deviation
+        # 1 / sqrt(embedding_dim), as in ScaledEmbedding.
+        scale = 1.0 / np.power(self.embedding_dim, 0.25)
+        self.quotient.weight.data.normal_(0, scale)
+        self.remainder.weight.data.normal_(0, scale)
+
+    def forward(self, ids):
+
+        return (self.quotient(ids // self.num_buckets) *
+                self.remainder(ids % self.num_buckets))
+
+
+class HashEmbedding(nn.Module):
+    """
+    Multi-hash embedding: row `i` is the sum of `num_hashes` rows of a
+    shared table of `num_buckets` rows, each selected by an independent
+    universal hash of `i`. Ids colliding under one hash are unlikely
+    to collide under all of them.
+    """
+
+    PRIME = 2 ** 31 - 1
+
+    def __init__(self, num_embeddings, embedding_dim,
+                 num_buckets=None, num_hashes=2, sparse=False,
+                 random_seed=42):
+
+        super().__init__()
+
+        if num_buckets is None:
+            num_buckets = int(np.ceil(np.sqrt(num_embeddings))) * num_hashes
+
+        self.num_embeddings = num_embeddings
+        self.embedding_dim = embedding_dim
+        self.num_buckets = num_buckets
+        self.num_hashes = num_hashes
+
+        self.table = nn.Embedding(num_buckets, embedding_dim, sparse=sparse)
+
+        random_state = np.random.RandomState(random_seed)
+        self.register_buffer(
+            'hash_parameters',
+            torch.from_numpy(random_state.randint(1, self.PRIME,
+                                                  (num_hashes, 2))))
+
+        self.reset_parameters()
+
+    def reset_parameters(self):
+        self.table.weight.data.normal_(
+            0, 1.0 / np.sqrt(self.embedding_dim * self.num_hashes))
+
+    def forward(self, ids):
+
+        embedding = None
+
+        for multiplier, offset in self.hash_parameters:
+            buckets = (ids * int(multiplier) + int(offset)) % self.PRIME
+            row = self.table(buckets % self.num_buckets)
+
+            embedding = row if embedding is None else embedding + row
+
+        return embedding
@@ -0,0 +1,205 @@
+"""
+Placement of large read-only arrays in memory.
+
+Scorers scan their item arrays on every query. Backed by 4 KB pages,
+a scan of a large catalog misses the TLB every few rows; on
+multi-socket hosts, the pages also live on whichever NUMA node first
+touched them, so threads on the other nodes read them across the
+interconnect.
+
+`place` copies an array into a private anonymous memory mapping that
+is aligned to, and advised to be backed by, transparent huge pages
+(`madvise(MADV_HUGEPAGE)`). The mapping can also be bound to the
+memory of one NUMA node, or interleaved across all nodes, through
+libnuma loaded with ctypes. `pin_to_node` restricts the calling
+thread to the CPUs of a node, so that it runs next to its arrays.
+
+Huge pages require Linux with transparent huge pages in `always` or
+`madvise` mode, and NUMA placement requires libnuma; OSError is
+raised when they are unavailable.
+"""
+
+import ctypes
+import ctypes.util
+import glob
+import mmap
+import os
+import re
+
+import numpy as np
+
+
+HUGE_PAGE_SIZE = 2 ** 21
+
+_NODE_PATH = '/sys/devices/system/node'
+
+_LIBNUMA = None
+
+
+def _parse_cpu_list(text):
+
+    cpus = []
+
+    for part in text.strip().split(','):
+        if not part:
+            continue
+
+        first, _, last = part.partition('-')
+        cpus.extend(range(int(first), int(last or first) + 1))
+
+    return cpus
+
+
+def numa_nodes():
+    """
+    Return a dict of the ids of the NUMA nodes that have CPUs to the
+    lists of their CPUs. Without NUMA information, all CPUs are
+    reported as node 0.
+    """
+
+    nodes = {}
+
+    for path in glob.glob(os.path.join(_NODE_PATH, 'node[0-9]*')):
+        with open(os.path.join(path, 'cpulist')) as cpulist:
+            cpus = _parse_cpu_list(cpulist.read())
+
+        if cpus:
+            nodes[int(re.search(r'\d+$', path).group())] = cpus
+
+    if not nodes:
+        nodes[0] = list(range(os.cpu_count()))
+
+    return dict(sorted(nodes.items()))
+
+
+def pin_to_node(node):
+    """
+    Restrict the calling thread to the CPUs of `node`.
+    """
+
+    os.sched_setaffinity(0, numa_nodes()[node])
+
+
+def _get_libnuma():
+
+    global _LIBNUMA
+
+    if _LIBNUMA is None:
+        path = ctypes.util.find_library('numa')
+
+        if path is None:
+            raise OSError('NUMA placement requires libnuma')
+
+        libnuma = ctypes.CDLL(path, use_errno=True)
+
+        if libnuma.numa_available() < 0:
+            raise OSError('NUMA is not supported by this system')
+
+        libnuma.numa_tonode_memory.argtypes = [ctypes.c_void_p,
+                                               ctypes.c_size_t,
+                                               ctypes.c_int]
+        libnuma.numa_tonode_memory.restype = None
+        libnuma.numa_interleave_memory.argtypes = [ctypes.c_void_p,
+                                                   ctypes.c_size_t,
+                                                   ctypes.c_void_p]
+        libnuma.numa_interleave_memory.restype = None
+
+        _LIBNUMA = libnuma
+
+    return _LIBNUMA
+
+
+def allocate(shape, dtype, huge_pages=True, node=None, interleave=False):
+    """
+    Allocate an uninitialized array in its own anonymous memory mapping.
+
+    Parameters
+    ----------
+
+    shape: tuple of ints
+    dtype: np.dtype
+    huge_pages: bool, optional
+        Align the array to a huge page boundary and ask
+        for it to be backed by transparent huge pages.
+    node: int, optional
+        Bind the array's memory to this NUMA node.
+    interleave: bool, optional
+        Interleave the array's pages across all NUMA nodes.
+
+    Memory policies only apply to pages faulted in after they are
+    set, so the array should be filled by the thread that will read
+    it most, or through `place`.
+    """
+
+    if node is not None and interleave:
+        raise ValueError('An array cannot be both bound to '
+                         'a node and interleaved.')
+
+    if huge_pages and not hasattr(mmap, 'MADV_HUGEPAGE'):
+        raise OSError('Transparent huge pages are not '
+                      'supported on this platform')
+
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+
+    page_size = HUGE_PAGE_SIZE if huge_pages else mmap.PAGESIZE
+    size = max(-(-nbytes // page_size), 1) * page_size
+
+    # Mappings are only page-aligned: over-allocate by
+    # one huge page to start the array on a boundary.
+    buf = mmap.mmap(-1, size + page_size - mmap.PAGESIZE,
+                    flags=mmap.MAP_PRIVATE)
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    offset = -raw.ctypes.data % page_size
+
+    if huge_pages:
+        buf.madvise(mmap.MADV_HUGEPAGE, offset, size)
+
+    if node is not None:
+        _get_libnuma().numa_tonode_memory(raw.ctypes.data + offset,
+                                          size, node)
+    elif interleave:
+        libnuma = _get_libnuma()
+        all_nodes = ctypes.c_void_p.in_dll(libnuma, 'numa_all_nodes_ptr')
+        libnuma.numa_interleave_memory(raw.ctypes.data + offset,
+                                       size, all_nodes)
+
+    return raw[offset:offset + nbytes].view(dtype).reshape(shape)
+
+
+def place(array, huge_pages=True, node=None, interleave=False):
+    """
+    Return a copy of `array` allocated by `allocate`.
+    """
+
+    placed = allocate(array.shape, array.dtype, huge_pages=huge_pages,
+                      node=node, interleave=interleave)
+    np.copyto(placed, array)
+
+    return placed
+
+
+def huge_page_bytes(array):
+    """
+    Return the number of bytes of the memory mapping holding `array`
+    that are currently backed by transparent huge pages, from
+    /proc/self/smaps.
+    """
+
+    address = array.ctypes.data
+    in_mapping = False
+
+    with open('/proc/self/smaps') as smaps:
+        for line in smaps:
+            fields = line.split()
+
+            if not fields:
+                continue
+
+            if '-' in fields[0] and not fields[0].endswith(':'):
+                start, end = (int(x, 16) for x in fields[0].split('-'))
+                in_mapping = start <= address < end
+            elif in_mapping and fields[0] == 'AnonHugePages:':
+                return int(fields[1]) * 1024
+
+    return 0
@@ -9,8 +9,13 @@ import torch.optim as optim
 
 from torch.autograd import Variable, Function
 
-from binge.layers import ScaledEmbedding, ZeroEmbedding
-from binge.native import align, get_lib
+from binge import checkpoint as checkpoint_utils
+from binge.data.shards import InteractionShards
+from binge.evaluation import mrr_score, sample_users
+from binge.layers import (HashEmbedding, QREmbedding,
+                          ScaledEmbedding, ZeroEmbedding)
+from binge.serving import (HashVectors, QRVectors, Scorer, XNORScorer,
+                           binarize_array)
 
 
 def _gpu(tensor, gpu=False):
@@ -35,16 +40,6 @@ def _minibatch(tensor, batch_size):
         yield tensor[i:i + batch_size]
 
 
-def binarize_array(array):
-
-    assert array.shape[1] % 8 == 0
-
-    array = (np.sign(array) > 0.0).astype(np.bool)
-    array = np.packbits(array, axis=1)
-
-    return array
-
-
 class BinaryDot(Function):
 
     def forward(self, x, y):
@@ -90,6 +85,81 @@ def binary_dot(x, y):
     return BinaryDot()(x, y)
 
 
+def residual_binarize(x, num_bits):
+    """
+    Approximate every row of `x` by the sum of `num_bits` scaled sign
+    vectors, each binarizing the residual left by the ones before it.
+    """
+
+    residual = x
+    approximation = None
+
+    for _ in range(num_bits):
+        plane = (residual.sign() *
+                 residual.abs().mean(1).view(-1, 1).expand_as(residual))
+
+        residual = residual - plane
+        approximation = (plane if approximation is None
+                         else approximation + plane)
+
+    return approximation
+
+
+class ResidualBinaryDot(Function):
+    """
+    Dot product of the `num_bits` residual binarizations
+    of two batches of vectors.
+
+    Gradients are passed straight through the binarization,
+    and cancelled where inputs exceed 1 in absolute value.
+    """
+
+    @staticmethod
+    def forward(ctx, x, y, num_bits):
+
+        x_approximation = residual_binarize(x, num_bits)
+        y_approximation = residual_binarize(y, num_bits)
+
+        ctx.save_for_backward(x, y, x_approximation, y_approximation)
+
+        return (x_approximation * y_approximation).sum(1)
+
+    @staticmethod
+    def backward(ctx, grad_output):
+
+        x, y, x_approximation, y_approximation = ctx.saved_tensors
+
+        grad_output = grad_output.view(-1, 1).expand_as(x)
+
+        dx_dsign = (x.abs() <= 1.0).float()
+        dy_dsign = (y.abs() <= 1.0).float()
+
+        return (grad_output * y_approximation * dx_dsign,
+                grad_output * x_approximation * dy_dsign,
+                None)
+
+
+def residual_binary_dot(x, y, num_bits):
+
+    return ResidualBinaryDot.apply(x, y, num_bits)
+
+
+def _embedding(num_embeddings, embedding_dim, compact_embeddings,
+               num_buckets, sparse):
+
+    if compact_embeddings is None:
+        return ScaledEmbedding(num_embeddings, embedding_dim, sparse=sparse)
+    elif compact_embeddings == 'qr':
+        return QREmbedding(num_embeddings, embedding_dim,
+                           num_buckets=num_buckets, sparse=sparse)
+    elif compact_embeddings == 'hash':
+        return HashEmbedding(num_embeddings, embedding_dim,
+                             num_buckets=num_buckets, sparse=sparse)
+    else:
+        raise ValueError('Unknown compact embedding type: {}'
+                         .format(compact_embeddings))
+
+
 class BilinearNet(nn.Module):
 
     def __init__(self,
@@ -97,18 +167,24 @@ class BilinearNet(nn.Module):
                  num_items,
                  embedding_dim,
                  xnor=False,
-                 sparse=False):
+                 xnor_bits=1,
+                 sparse=False,
+                 compact_embeddings=None,
+                 num_buckets=None):
 
         super().__init__()
 
         self.xnor = xnor
+        self.xnor_bits = xnor_bits
 
         self.embedding_dim = embedding_dim
 
-        self.user_embeddings = ScaledEmbedding(num_users, embedding_dim,
-                                               sparse=sparse)
-        self.item_embeddings = ScaledEmbedding(num_items, embedding_dim,
-                                               sparse=sparse)
+        self.user_embeddings = _embedding(num_users, embedding_dim,
+                                          compact_embeddings, num_buckets,
+                                          sparse)
+        self.item_embeddings = _embedding(num_items, embedding_dim,
+                                          compact_embeddings, num_buckets,
+                                          sparse)
         self.user_biases = ZeroEmbedding(num_users, 1, sparse=sparse)
         self.item_biases = ZeroEmbedding(num_items, 1, sparse=sparse)
 
@@ -123,13 +199,41 @@ class BilinearNet(nn.Module):
         user_bias = self.user_biases(user_ids).view(-1, 1)
         item_bias = self.item_biases(item_ids).view(-1, 1)
 
-        if self.xnor:
+        if self.xnor and self.xnor_bits > 1:
+            dot = residual_binary_dot(user_embedding, item_embedding,
+                                      self.xnor_bits)
+        elif self.xnor:
             dot = binary_dot(user_embedding, item_embedding)
         else:
             dot = (user_embedding * item_embedding).sum(1)
 
         return dot + user_bias + item_bias
 
+    def predict_block(self, user_ids, item_ids):
+        """
+        Score every item in `item_ids` for every user in `user_ids`
+        as a single matrix product.
+        """
+
+        user_embedding = self.user_embeddings(user_ids).view(-1, self.embedding_dim)
+        item_embedding = self.item_embeddings(item_ids).view(-1, self.embedding_dim)
+
+        if self.xnor and self.xnor_bits > 1:
+            dot = residual_binarize(user_embedding, self.xnor_bits).mm(
+                residual_binarize(item_embedding, self.xnor_bits).t())
+        elif self.xnor:
+            dot = user_embedding.sign().mm(item_embedding.sign().t())
+            dot = (dot *
+                   user_embedding.abs().mean(1).view(-1, 1).expand_as(dot) *
+                   item_embedding.abs().mean(1).view(1, -1).expand_as(dot))
+        else:
+            dot = user_embedding.mm(item_embedding.t())
+
+        user_bias = self.user_biases(user_ids).view(-1, 1).expand_as(dot)
+        item_bias = self.item_biases(item_ids).view(1, -1).expand_as(dot)
+
+        return dot + user_bias + item_bias
+
 
 class FactorizationModel(object):
     """
@@ -147,11 +251,18 @@ class FactorizationModel(object):
     Performance notes: neural network toolkits do not perform well on sparse tasks
     like recommendations. To achieve acceptable speed, either use the `sparse` option
     on a CPU or use CUDA with very big minibatches (1024+).
+
+    Memory notes: for very large numbers of users or items, set
+    `compact_embeddings` to 'qr' (quotient-remainder) or 'hash'
+    (multi-hash) to replace the full embedding tables with much
+    smaller compositional ones of `num_buckets` rows. Biases are
+    always stored in full.
     """
 
     def __init__(self,
                  loss='pointwise',
                  xnor=False,
+                 xnor_bits=1,
                  embedding_dim=64,
                  n_iter=3,
                  batch_size=64,
@@ -159,11 +270,14 @@ class FactorizationModel(object):
                  learning_rate=1e-3,
                  use_cuda=False,
                  sparse=False,
+                 compact_embeddings=None,
+                 num_buckets=None,
                  random_seed=None):
 
         assert loss in ('pointwise',
                         'bpr',
                         'adaptive')
+        assert compact_embeddings in (None, 'qr', 'hash')
 
         self._loss = loss
         self._embedding_dim = embedding_dim
@@ -174,6 +288,9 @@ class FactorizationModel(object):
         self._use_cuda = use_cuda
         self._sparse = sparse
         self._xnor = xnor
+        self._xnor_bits = xnor_bits
+        self._compact_embeddings = compact_embeddings
+        self._num_buckets = num_buckets
         self._random_state = np.random.RandomState(random_seed)
 
         self._num_users = None
@@ -189,7 +306,10 @@ class FactorizationModel(object):
                 'l2': self._l2,
                 'learning_rate': self._learning_rate,
                 'use_cuda': self._use_cuda,
-                'xnor': self._xnor}
+                'xnor': self._xnor,
+                'xnor_bits': self._xnor_bits,
+                'compact_embeddings': self._compact_embeddings,
+                'num_buckets': self._num_buckets}
 
     def _pointwise_loss(self, users, items, ratings):
 
@@ -239,32 +359,33 @@ class FactorizationModel(object):
                                       positive_prediction
                                       + 1.0, 0.0))
 
-    def _shuffle(self, interactions):
+    def _shuffle(self, interactions, random_state=None):
+
+        if random_state is None:
+            random_state = self._random_state
 
         users = interactions.row
         items = interactions.col
         ratings = interactions.data
 
         shuffle_indices = np.arange(len(users))
-        self._random_state.shuffle(shuffle_indices)
+        random_state.shuffle(shuffle_indices)
 
         return (users[shuffle_indices].astype(np.int64),
                 items[shuffle_indices].astype(np.int64),
                 ratings[shuffle_indices].astype(np.float32))
 
-    def fit(self, interactions, verbose=False):
-        """
-        Fit the model.
+    def _epoch_chunks(self, interactions, random_state=None):
 
-        Arguments
-        ---------
+        if random_state is None:
+            random_state = self._random_state
 
-        interactions: np.float32 coo_matrix of shape [n_users, n_items]
-             the matrix containing
-             user-item interactions.
-        verbose: Bool, optional
-             Whether to print epoch loss statistics.
-        """
+        if isinstance(interactions, InteractionShards):
+            return interactions.iter_shuffled(random_state)
+        else:
+            return [self._shuffle(interactions, random_state)]
+
+    def _initialize(self, interactions):
 
         self._num_users, self._num_items = interactions.shape
 
@@ -273,24 +394,37 @@ class FactorizationModel(object):
                         self._num_items,
                         self._embedding_dim,
                         xnor=self._xnor,
-                        sparse=self._sparse),
+                        xnor_bits=self._xnor_bits,
+                        sparse=self._sparse,
+                        compact_embeddings=self._compact_embeddings,
+                        num_buckets=self._num_buckets),
             self._use_cuda
         )
 
-        optimizer = optim.Adam(self._net.parameters(),
-                               lr=self._learning_rate,
-                               weight_decay=self._l2)
+    def _get_optimizer(self):
+
+        return optim.Adam(self._net.parameters(),
+                          lr=self._learning_rate,
+                          weight_decay=self._l2)
+
+    def _get_loss_function(self):
 
         if self._loss == 'pointwise':
-            loss_fnc = self._pointwise_loss
+            return self._pointwise_loss
         elif self._loss == 'bpr':
-            loss_fnc = self._bpr_loss
+            return self._bpr_loss
         else:
-            loss_fnc = self._adaptive_loss
+            return self._adaptive_loss
+
+    def _fit_epoch(self, chunks, optimizer, loss_fnc,
+                   batch_size=None, gradient_hook=None):
 
-        for epoch_num in range(self._n_iter):
+        if batch_size is None:
+            batch_size = self._batch_size
 
-            users, items, ratings = self._shuffle(interactions)
+        epoch_loss = 0.0
+
+        for users, items, ratings in chunks:
 
             user_ids_tensor = _gpu(torch.from_numpy(users),
                                    self._use_cuda)
@@ -299,16 +433,14 @@ class FactorizationModel(object):
             ratings_tensor = _gpu(torch.from_numpy(ratings),
                                   self._use_cuda)
 
-            epoch_loss = 0.0
-
             for (batch_user,
                  batch_item,
                  batch_ratings) in zip(_minibatch(user_ids_tensor,
-                                                  self._batch_size),
+                                                  batch_size),
                                        _minibatch(item_ids_tensor,
-                                                  self._batch_size),
+                                                  batch_size),
                                        _minibatch(ratings_tensor,
-                                                  self._batch_size)):
+                                                  batch_size)):
 
                 user_var = Variable(batch_user)
                 item_var = Variable(batch_item)
@@ -317,14 +449,93 @@ class FactorizationModel(object):
                 optimizer.zero_grad()
 
                 loss = loss_fnc(user_var, item_var, ratings_var)
-                epoch_loss += loss.data[0]
+                epoch_loss += loss.item()
 
                 loss.backward()
-                # return loss
+
+                if gradient_hook is not None:
+                    gradient_hook(self._net)
+
                 optimizer.step()
 
-            if verbose:
-                print('Epoch {}: loss {}'.format(epoch_num, epoch_loss))
+        return epoch_loss
+
+    def fit(self, interactions, verbose=False,
+            checkpoint=None, checkpoint_every=1, resume_from=None,
+            early_stopping=None):
+        """
+        Fit the model.
+
+        Arguments
+        ---------
+
+        interactions: np.float32 coo_matrix of shape [n_users, n_items]
+             or InteractionShards
+             the matrix containing user-item interactions, or a
+             streaming source of on-disk interaction shards.
+             Shards are block-shuffled and streamed through
+             a bounded buffer, so memory use does not grow
+             with the number of interactions.
+        verbose: Bool, optional
+             Whether to print epoch loss statistics.
+        checkpoint: path, optional
+             If given, the training state is written to this file
+             every `checkpoint_every` epochs and after the last one.
+             Checkpoints are written on a background thread.
+        checkpoint_every: int, optional
+             Number of epochs between checkpoints.
+        resume_from: path, optional
+             Checkpoint to resume training from. Training continues
+             from the first incomplete epoch and produces the same
+             result as an uninterrupted run.
+        early_stopping: EarlyStopping, optional
+             If given, training stops once the sampled validation
+             MRR has not improved for `patience` epochs, and the
+             weights of the best epoch are restored.
+        """
+
+        self._initialize(interactions)
+
+        optimizer = self._get_optimizer()
+        loss_fnc = self._get_loss_function()
+
+        start_epoch = 0
+
+        if resume_from is not None:
+            start_epoch = checkpoint_utils.restore(
+                self, optimizer, checkpoint_utils.load(resume_from))
+
+        writer = None
+
+        if checkpoint is not None:
+            writer = checkpoint_utils.CheckpointWriter(checkpoint)
+
+        try:
+            for epoch_num in range(start_epoch, self._n_iter):
+
+                epoch_loss = self._fit_epoch(self._epoch_chunks(interactions),
+                                             optimizer,
+                                             loss_fnc)
+
+                if verbose:
+                    print('Epoch {}: loss {}'.format(epoch_num, epoch_loss))
+
+                if writer is not None and (
+                        (epoch_num + 1) % checkpoint_every == 0 or
+                        epoch_num + 1 == self._n_iter):
+                    writer.write(checkpoint_utils.snapshot(self,
+                                                           optimizer,
+                                                           epoch_num + 1))
+
+                if (early_stopping is not None and
+                        early_stopping.update(self, epoch_num)):
+                    break
+        finally:
+            if writer is not None:
+                writer.close()
+
+        if early_stopping is not None:
+            early_stopping.restore(self)
 
     def predict(self, user_ids, item_ids=None):
         """
@@ -360,129 +571,151 @@ class FactorizationModel(object):
 
         return _cpu(out.data).numpy().flatten()
 
-    def get_scorer(self):
-
-        get_param = lambda l: _cpu([x for x in l.parameters()][0]).data.numpy().squeeze()
-
-        if self._xnor:
-            return XNORScorer(get_param(self._net.user_embeddings),
-                              get_param(self._net.user_biases),
-                              get_param(self._net.item_embeddings),
-                              get_param(self._net.item_biases))
-        else:
-            return Scorer(get_param(self._net.user_embeddings),
-                          get_param(self._net.user_biases),
-                          get_param(self._net.item_embeddings),
-                          get_param(self._net.item_biases))
-
+    def predict_block(self, user_ids):
+        """
+        Compute the scores of all items for a block of users.
 
-class Scorer:
+        Arguments
+        ---------
 
-    def __init__(self,
-                 user_vectors,
-                 user_biases,
-                 item_vectors,
-                 item_biases):
+        user_ids: np.int32 array of shape [n_users,]
 
-        self._user_vectors = align(user_vectors)
-        self._user_biases = align(user_biases)
-        self._item_vectors = align(item_vectors)
-        self._item_biases = align(item_biases)
+        Returns
+        -------
 
-        self._lib = get_lib()
+        scores: np.float32 array of shape [n_users, n_items]
+        """
 
-    def _parameters(self):
+        user_ids = torch.from_numpy(np.asarray(user_ids).astype(np.int64))
+        item_ids = torch.from_numpy(np.arange(self._num_items, dtype=np.int64))
 
-        return (self._user_vectors,
-                self._item_vectors,
-                self._user_biases,
-                self._item_biases)
+        user_var = Variable(_gpu(user_ids, self._use_cuda))
+        item_var = Variable(_gpu(item_ids, self._use_cuda))
 
-    def predict(self, user_id, item_ids=None):
+        out = self._net.predict_block(user_var, item_var)
 
-        if item_ids is None:
-            item_ids = slice(0, None, None)
+        return _cpu(out.data).numpy()
 
-        return self._lib.predict_float_256(
-            align(self._user_vectors[user_id]),
-            self._item_vectors[item_ids],
-            self._user_biases[user_id],
-            self._item_biases[item_ids])
+    def get_scorer(self):
+        """
+        Return a native scorer for the fitted model.
 
-    def _predict_bench(self, user_id, out):
+        Compact item embeddings are materialized in full, since every
+        prediction scans all items. Compact user embeddings are composed
+        lazily, one user at a time, by the float scorer; the XNOR scorer
+        materializes them to binarize them up front.
+        """
 
-        return self._lib.predict_float_256(
-            align(self._user_vectors[user_id]),
-            self._item_vectors,
-            self._user_biases[user_id],
-            self._item_biases,
-            out)
+        get_param = lambda l: _cpu([x for x in l.parameters()][0]).data.numpy().squeeze()
 
-    def memory(self):
+        if self._xnor:
+            return XNORScorer(_get_vectors(self._net.user_embeddings),
+                              get_param(self._net.user_biases),
+                              _get_vectors(self._net.item_embeddings),
+                              get_param(self._net.item_biases),
+                              bits=self._xnor_bits)
+        else:
+            return Scorer(_get_vectors(self._net.user_embeddings, lazy=True),
+                          get_param(self._net.user_biases),
+                          _get_vectors(self._net.item_embeddings),
+                          get_param(self._net.item_biases))
 
-        get_size = lambda x: x.itemsize * x.size
 
-        return sum(get_size(x) for x in self._parameters())
+def _numpy(parameter):
 
+    return _cpu(parameter).data.numpy()
 
-class XNORScorer:
 
-    def __init__(self,
-                 user_vectors,
-                 user_biases,
-                 item_vectors,
-                 item_biases):
+def _get_vectors(layer, lazy=False):
 
-        assert item_vectors.shape[1] >= 32
+    if isinstance(layer, QREmbedding):
+        vectors = QRVectors(_numpy(layer.quotient.weight),
+                            _numpy(layer.remainder.weight),
+                            layer.num_embeddings)
+    elif isinstance(layer, HashEmbedding):
+        vectors = HashVectors(_numpy(layer.table.weight),
+                              _numpy(layer.hash_parameters),
+                              layer.num_embeddings,
+                              layer.PRIME)
+    else:
+        return _numpy(layer.weight)
 
-        self._user_norms = align(np.abs(user_vectors).mean(axis=1))
-        self._item_norms = align(np.abs(item_vectors).mean(axis=1))
+    if lazy:
+        return vectors
+    else:
+        return vectors.materialize()
 
-        self._user_vectors = align(binarize_array(user_vectors))
-        self._user_biases = align(user_biases)
-        self._item_vectors = align(binarize_array(item_vectors))
-        self._item_biases = align(item_biases)
 
-        self._lib = get_lib()
+class EarlyStopping:
+    """
+    Early stopping on a cheap, sampled validation MRR.
+
+    After every epoch the model's native scorer is evaluated on the
+    test interactions of a fixed random sample of `num_users` users.
+    Fitting stops once the score has not improved for `patience`
+    epochs, and the weights from the best epoch are restored.
+
+    Parameters
+    ----------
+
+    test: coo_matrix of shape [n_users, n_items]
+        Held-out interactions to evaluate on.
+    train: coo_matrix of shape [n_users, n_items], optional
+        Interactions to exclude from the rankings.
+    patience: int, optional
+        Number of epochs without improvement before stopping.
+    num_users: int, optional
+        Number of users to evaluate on.
+    random_seed: int, optional
+        Seed for the user sample.
+
+    Attributes
+    ----------
+
+    best_epoch: int
+        Number of epochs trained when the best score was reached.
+    best_score: float
+        The best sampled validation MRR.
+    scores: list of floats
+        Sampled validation MRR after every epoch.
+    """
 
-    def _parameters(self):
+    def __init__(self, test, train=None, patience=3, num_users=1000,
+                 random_seed=None):
 
-        return (self._user_norms,
-                self._item_norms,
-                self._user_vectors,
-                self._item_vectors,
-                self._user_biases,
-                self._item_biases)
+        self._test = sample_users(test, num_users,
+                                  np.random.RandomState(random_seed))
+        self._train = train.tocsr() if train is not None else None
+        self._patience = patience
 
-    def predict(self, user_id, item_ids=None):
+        self._best_state = None
 
-        if item_ids is None:
-            item_ids = slice(0, None, None)
+        self.best_epoch = 0
+        self.best_score = -np.inf
+        self.scores = []
 
-        return self._lib.predict_xnor_256(
-            align(self._user_vectors[user_id]),
-            self._item_vectors[item_ids],
-            self._user_biases[user_id],
-            self._item_biases[item_ids],
-            self._user_norms[user_id],
-            self._item_norms[item_ids])
+    def update(self, model, epoch_num):
+        """
+        Score the model after `epoch_num` and return True
+        if fitting should stop.
+        """
 
-    def _predict_bench(self, user_id, out):
+        score = mrr_score(model.get_scorer(), self._test, self._train).mean()
+        self.scores.append(score)
 
-        return self._lib.predict_xnor_256(
-            align(self._user_vectors[user_id]),
-            self._item_vectors,
-            self._user_biases[user_id],
-            self._item_biases,
-            self._user_norms[user_id],
-            self._item_norms,
-            out)
+        if score > self.best_score:
+            self.best_score = score
+            self.best_epoch = epoch_num + 1
+            self._best_state = {name: value.clone()
+                                for name, value
+                                in model._net.state_dict().items()}
 
-    def memory(self):
+        return epoch_num + 1 - self.best_epoch >= self._patience
 
-        get_size = lambda x: x.itemsize * x.size
+    def restore(self, model):
 
-        return sum(get_size(x) for x in self._parameters())
+        if self._best_state is not None:
+            model._net.load_state_dict(self._best_state)
 
 
 class PopularityModel:
@@ -503,3 +736,7 @@ class PopularityModel:
             return self._popularity[item_ids]
         else:
             return self._popularity
+
+    def predict_block(self, user_ids):
+
+        return np.tile(self._popularity, (len(user_ids), 1))
@@ -1,10 +1,7 @@
-import glob
-import os
-
-from cffi import FFI
-
 import numpy as np
 
+from binge import instrumentation, tuning
+
 
 def align(array, alignment=32):
 
@@ -21,21 +18,65 @@ def align(array, alignment=32):
     return aligned
 
 
-def _assert_aligned(array, alignment=32):
+def _touched_bytes(*arrays):
 
-    assert not array.ctypes.data % alignment
+    return sum(array.nbytes for array in arrays)
 
 
 class Extension:
 
-    def __init__(self, lib):
+    def __init__(self, ffi, lib):
 
+        self._ffi = ffi
         self._lib = lib
-        self._ffi = FFI()
 
-    def _cast(self, x):
+    def _cast(self, x, ctype='float[]'):
+
+        # Wraps the array's buffer without copying it, and keeps
+        # the array alive for as long as the cdata is.
+        return self._ffi.from_buffer(ctype, x)
+
+    def _cast_aligned(self, x, ctype='float[]', alignment=32):
+
+        # Checking the cdata pointer is much cheaper than `x.ctypes`.
+        buf = self._ffi.from_buffer(ctype, x)
+        assert not int(self._ffi.cast('uintptr_t', buf)) % alignment
+
+        return buf
+
+    def _rank_buffers(self, target_ids, excluded_ids):
+
+        target_ids = np.ascontiguousarray(target_ids, dtype=np.int32)
+        excluded_ids = np.ascontiguousarray(np.sort(excluded_ids),
+                                            dtype=np.int32)
 
-        return self._ffi.cast('float *', x.ctypes.data)
+        num_targets = len(target_ids)
+
+        return (target_ids,
+                excluded_ids,
+                np.empty(num_targets, dtype=np.float32),
+                np.empty(3 * (num_targets + 1), dtype=np.int64),
+                np.empty(num_targets, dtype=np.int64),
+                np.empty(num_targets, dtype=np.int64))
+
+    def _float_variant(self, user_vector, item_vectors, user_bias,
+                       item_biases):
+        """
+        Return the variant of the float kernel selected for the shape
+        of `item_vectors`, selecting it (and tuning it, if enabled)
+        with a full scan if no call has selected one yet.
+        """
+
+        num_items, latent_dim = item_vectors.shape
+
+        variant = tuning.selected_float_variant(num_items, latent_dim)
+
+        if variant is None:
+            self.predict_float_256(user_vector, item_vectors,
+                                   user_bias, item_biases)
+            variant = tuning.selected_float_variant(num_items, latent_dim)
+
+        return variant
 
     def predict_float_256(self,
                           user_vector,
@@ -44,24 +85,30 @@ class Extension:
                           item_biases,
                           out=None):
 
-        _assert_aligned(item_vectors)
-        _assert_aligned(user_vector)
+        record = instrumentation.recorder('native.predict_float_256')
 
         cast = self._cast
+        cast_aligned = self._cast_aligned
 
         if out is None:
-            out = np.zeros_like(item_biases)
+            out = np.empty_like(item_biases)
 
         num_items, latent_dim = item_vectors.shape
 
-        self._lib.predict_float_256(
-            cast(user_vector),
-            cast(item_vectors),
-            user_bias,
-            cast(item_biases),
-            cast(out),
-            num_items,
-            latent_dim)
+        args = (cast_aligned(user_vector),
+                cast_aligned(item_vectors),
+                user_bias,
+                cast(item_biases),
+                cast(out),
+                num_items,
+                latent_dim)
+        variant = tuning.float_variant(self, args)
+        record('prepare')
+
+        self._lib.predict_float_variant(variant, *args)
+        record('kernel', lambda: _touched_bytes(
+            user_vector, item_vectors, item_biases, out))
+        record.finish()
 
         return out
 
@@ -74,72 +121,345 @@ class Extension:
                          item_norms,
                          out=None):
 
-        _assert_aligned(item_vectors)
-        _assert_aligned(user_vector)
+        record = instrumentation.recorder('native.predict_xnor_256')
 
         cast = self._cast
+        cast_aligned = self._cast_aligned
 
         if out is None:
-            out = np.zeros_like(item_biases)
+            out = np.empty_like(item_biases)
 
         num_items, latent_dim = item_vectors.shape
 
         # Express latent dimension in term of floats
         latent_dim = latent_dim // (4 // item_vectors.itemsize)
 
-        self._lib.predict_xnor_256(
-            cast(user_vector),
-            cast(item_vectors),
-            user_bias,
-            cast(item_biases),
-            user_norm,
-            cast(item_norms),
-            cast(out),
-            num_items,
-            latent_dim)
+        args = (cast_aligned(user_vector, 'int32_t[]'),
+                cast_aligned(item_vectors, 'int32_t[]'),
+                user_bias,
+                cast(item_biases),
+                user_norm,
+                cast(item_norms),
+                cast(out),
+                num_items,
+                latent_dim)
+        record('prepare')
+
+        self._lib.predict_xnor_256(*args)
+        record('kernel', lambda: _touched_bytes(
+            user_vector, item_vectors, item_biases, item_norms, out))
+        record.finish()
 
         return out
 
+    def rank_float_256(self,
+                       user_vector,
+                       item_vectors,
+                       user_bias,
+                       item_biases,
+                       target_ids,
+                       excluded_ids):
+        """
+        For every target item, count the non-excluded items that
+        score strictly higher and exactly as high, in a single pass
+        over the catalog.
 
-def _build_module():
-
-    ffibuilder = FFI()
-    ffibuilder.set_source("_native", None)
-    ffibuilder.cdef("""
-    void predict_float_256(float* user_vector,
-                       float* item_vectors,
-                       float user_bias,
-                       float* item_biases,
-                       float* out,
-                       intptr_t num_items,
-                       intptr_t latent_dim);
-    void predict_xnor_256(int32_t* user_vector,
-                      int32_t* item_vectors,
-                      float user_bias,
-                      float* item_biases,
-                      float user_norm,
-                      float* item_norm,
-                      float* out,
-                      intptr_t num_items,
-                      intptr_t latent_dim);
-    """)
-
-    ffibuilder.compile(verbose=False)
+        Returns (target_scores, higher, equal).
+        """
 
+        record = instrumentation.recorder('native.rank_float_256')
 
-def get_lib():
+        cast = self._cast
+        cast_aligned = self._cast_aligned
+
+        (target_ids, excluded_ids,
+         target_scores, workspace,
+         higher, equal) = self._rank_buffers(target_ids, excluded_ids)
+
+        num_items, latent_dim = item_vectors.shape
+
+        args = (cast_aligned(user_vector),
+                cast_aligned(item_vectors),
+                user_bias,
+                cast(item_biases),
+                cast(target_ids, 'int32_t[]'),
+                len(target_ids),
+                cast(excluded_ids, 'int32_t[]'),
+                len(excluded_ids),
+                cast(target_scores),
+                cast(workspace, 'int64_t[]'),
+                cast(higher, 'int64_t[]'),
+                cast(equal, 'int64_t[]'),
+                num_items,
+                latent_dim,
+                # Scored with the variant that full scans use.
+                self._float_variant(user_vector, item_vectors,
+                                    user_bias, item_biases))
+        record('prepare')
+
+        self._lib.rank_float_256(*args)
+        record('kernel', lambda: _touched_bytes(
+            user_vector, item_vectors, item_biases, excluded_ids))
+        record.finish()
+
+        return target_scores, higher, equal
+
+    def rank_xnor_256(self,
+                      user_vector,
+                      item_vectors,
+                      user_bias,
+                      item_biases,
+                      user_norm,
+                      item_norms,
+                      target_ids,
+                      excluded_ids):
+
+        record = instrumentation.recorder('native.rank_xnor_256')
+
+        cast = self._cast
+        cast_aligned = self._cast_aligned
+
+        (target_ids, excluded_ids,
+         target_scores, workspace,
+         higher, equal) = self._rank_buffers(target_ids, excluded_ids)
+
+        num_items, latent_dim = item_vectors.shape
+
+        # Express latent dimension in term of floats
+        latent_dim = latent_dim // (4 // item_vectors.itemsize)
+
+        args = (cast_aligned(user_vector, 'int32_t[]'),
+                cast_aligned(item_vectors, 'int32_t[]'),
+                user_bias,
+                cast(item_biases),
+                user_norm,
+                cast(item_norms),
+                cast(target_ids, 'int32_t[]'),
+                len(target_ids),
+                cast(excluded_ids, 'int32_t[]'),
+                len(excluded_ids),
+                cast(target_scores),
+                cast(workspace, 'int64_t[]'),
+                cast(higher, 'int64_t[]'),
+                cast(equal, 'int64_t[]'),
+                num_items,
+                latent_dim)
+        record('prepare')
+
+        self._lib.rank_xnor_256(*args)
+        record('kernel', lambda: _touched_bytes(
+            user_vector, item_vectors, item_biases, item_norms, excluded_ids))
+        record.finish()
+
+        return target_scores, higher, equal
+
+    def predict_pq8(self,
+                    lut,
+                    codes,
+                    user_bias,
+                    out=None):
+
+        record = instrumentation.recorder('native.predict_pq8')
+
+        cast = self._cast
+
+        num_items, num_subspaces = codes.shape
+
+        if out is None:
+            out = np.empty(num_items, dtype=np.float32)
 
-    from binge._native import ffi
+        args = (cast(lut),
+                cast(codes, 'uint8_t[]'),
+                user_bias,
+                cast(out),
+                num_items,
+                num_subspaces)
+        record('prepare')
+
+        self._lib.predict_pq8(*args)
+        record('kernel', lambda: _touched_bytes(lut, codes, out))
+        record.finish()
+
+        return out
+
+    def predict_pq4(self,
+                    lut,
+                    codes,
+                    scale,
+                    offset,
+                    num_items,
+                    out=None):
+        """
+        Score `num_items` items from 4-bit codes packed in blocks
+        of 32 items, with a quantized [n_subspaces, 16] np.uint8
+        lookup table.
+        """
+
+        record = instrumentation.recorder('native.predict_pq4')
+
+        cast = self._cast
+
+        num_subspaces = lut.shape[0]
+
+        assert num_subspaces % 2 == 0
+        assert codes.shape[1:] == (num_subspaces, 16)
+        assert num_items <= 32 * codes.shape[0]
+
+        if out is None:
+            out = np.empty(num_items, dtype=np.float32)
+
+        args = (cast(lut, 'uint8_t[]'),
+                cast(codes, 'uint8_t[]'),
+                scale,
+                offset,
+                cast(out),
+                num_items,
+                num_subspaces)
+        record('prepare')
+
+        self._lib.predict_pq4(*args)
+        record('kernel', lambda: _touched_bytes(lut, codes, out))
+        record.finish()
+
+        return out
+
+    def predict_xnor_residual(self,
+                              user_planes,
+                              item_planes,
+                              user_bias,
+                              item_biases,
+                              user_scales,
+                              item_scales,
+                              out=None):
+        """
+        Score items from [n_bits, n_bytes] user and [n_items, n_bits,
+        n_bytes] item sign planes, with [n_bits] user and [n_items,
+        n_bits] item scales.
+        """
+
+        record = instrumentation.recorder('native.predict_xnor_residual')
+
+        cast = self._cast
+
+        if out is None:
+            out = np.empty_like(item_biases)
+
+        num_items, num_bits, latent_dim = item_planes.shape
+
+        assert user_planes.shape == (num_bits, latent_dim)
+
+        # Express latent dimension in term of floats
+        latent_dim = latent_dim // (4 // item_planes.itemsize)
+
+        args = (cast(user_planes, 'int32_t[]'),
+                cast(user_scales),
+                cast(item_planes, 'int32_t[]'),
+                cast(item_scales),
+                user_bias,
+                cast(item_biases),
+                cast(out),
+                num_items,
+                latent_dim,
+                num_bits)
+        record('prepare')
+
+        self._lib.predict_xnor_residual(*args)
+        record('kernel', lambda: _touched_bytes(
+            user_planes, item_planes, item_scales, item_biases, out))
+        record.finish()
+
+        return out
+
+    def top_k_float_256(self,
+                        user_vector,
+                        item_vectors,
+                        user_bias,
+                        item_biases,
+                        order,
+                        block_norms,
+                        block_biases,
+                        block_size,
+                        user_norm,
+                        k,
+                        excluded_ids):
+        """
+        Exact top-k, visiting items in `order` and stopping once the
+        norm bounds of the remaining blocks fall below the k-th score.
+
+        Returns (item_ids, scores, num_scored), with the top
+        items in no particular order.
+        """
+
+        record = instrumentation.recorder('native.top_k_float_256')
+
+        cast = self._cast
+        cast_aligned = self._cast_aligned
+
+        excluded_ids = np.ascontiguousarray(np.sort(excluded_ids),
+                                            dtype=np.int32)
+
+        top_ids = np.empty(k, dtype=np.int32)
+        top_scores = np.empty(k, dtype=np.float32)
+        num_scored = np.zeros(1, dtype=np.int64)
+
+        num_items, latent_dim = item_vectors.shape
+
+        workspace = align(np.empty(block_size * (latent_dim + 2),
+                                   dtype=np.float32))
+        workspace_ids = np.empty(block_size, dtype=np.int32)
+
+        args = (cast_aligned(user_vector),
+                cast_aligned(item_vectors),
+                user_bias,
+                cast(item_biases),
+                cast(order, 'int32_t[]'),
+                cast(block_norms),
+                cast(block_biases),
+                block_size,
+                user_norm,
+                cast(excluded_ids, 'int32_t[]'),
+                len(excluded_ids),
+                k,
+                cast(top_ids, 'int32_t[]'),
+                cast(top_scores),
+                cast(num_scored, 'int64_t[]'),
+                cast_aligned(workspace),
+                cast(workspace_ids, 'int32_t[]'),
+                num_items,
+                latent_dim,
+                # Scored with the variant that full scans use.
+                self._float_variant(user_vector, item_vectors,
+                                    user_bias, item_biases))
+        record('prepare')
+
+        size = self._lib.top_k_float_256(*args)
+
+        # Only the scored rows are read, in blocks of the visit order.
+        row_bytes = item_vectors.itemsize * latent_dim + 4
+        record('kernel', int(num_scored[0]) * row_bytes)
+        record.finish()
+
+        return top_ids[:size], top_scores[:size], int(num_scored[0])
+
+
+_EXTENSION = None
+
+
+def get_lib():
+    """
+    Return the process-wide handle to the compiled kernels,
+    importing the extension module on first use.
+    """
 
-    path = os.path.join(
-        os.path.dirname(os.path.realpath(__file__)),
-        'libpredict*.so')
+    global _EXTENSION
 
-    libs = glob.glob(path)
+    if _EXTENSION is None:
+        try:
+            from binge._native import ffi, lib
+        except ImportError:
+            raise Exception('Compiled extension not found: build it with '
+                            '`python setup.py build_ext --inplace`')
 
-    if not libs:
-        raise Exception('Compiled extension not found under {}'.format(path))
-    if len(libs) > 1:
-        raise Exception('More than one version of extension found: {}'.format(libs))
+        _EXTENSION = Extension(ffi, lib)
 
-    return Extension(ffi.dlopen(libs[0]))
+    return _EXTENSION
@@ -1,5 +1,9 @@
+#include <float.h>
+#include <math.h>
 #include <stdio.h>
 #include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
 #include <x86intrin.h>
 #include "libpopcnt.h"
 
@@ -69,6 +73,11 @@ static inline uint64_t popcnt_no_cpuid(const void* data, uint64_t size, int cpui
 }
 
 
+/*
+ * Not inlined, so that top_k_float_256 computes
+ * bit-identical scores by calling it on copied rows.
+ */
+__attribute__((noinline))
 void predict_float_256(float* user_vector,
                        float* item_vectors,
                        float user_bias,
@@ -115,6 +124,270 @@ void predict_float_256(float* user_vector,
 }
 
 
+/*
+ * Tuned variants of predict_float_256.
+ *
+ * A variant scores `unroll` items at a time, sharing the loads of
+ * the user vector between them, accumulates every dot product in
+ * `accumulators` independent registers, and prefetches the rows
+ * `prefetch` items ahead. Which combination is fastest depends on
+ * the latent dimension, the catalog size and the CPU; binge.tuning
+ * times them and persists the winners.
+ *
+ * Every variant computes an item's score with the same operations
+ * wherever the item is, so that rank_float_256 and top_k_float_256
+ * can score targets, chunks and copied rows with the variant used
+ * for a full scan.
+ */
+#define MAX_ACCUMULATORS 4
+#define MAX_UNROLL 4
+
+/*
+ * Not inlined: inlined into unrolled loops, the reduction may be
+ * reassociated differently for every position in the unrolled block,
+ * and scores would then depend on where an item is.
+ */
+__attribute__((noinline))
+static float finish_score(__m256* acc,
+                   const int accumulators,
+                   float bias,
+                   float* item_vector,
+                   float* user_vector,
+                   intptr_t j,
+                   intptr_t latent_dim) {
+
+    __m256 sum = acc[0];
+
+    for (int a = 1; a < accumulators; a++) {
+        sum = _mm256_add_ps(sum, acc[a]);
+    }
+
+    __m128 half = _mm_add_ps(_mm256_castps256_ps128(sum),
+                             _mm256_extractf128_ps(sum, 1));
+    half = _mm_add_ps(half, _mm_movehl_ps(half, half));
+    half = _mm_add_ss(half, _mm_movehdup_ps(half));
+
+    float score = bias + _mm_cvtss_f32(half);
+
+    // Remainder
+    for (; j < latent_dim; j++) {
+        score += item_vector[j] * user_vector[j];
+    }
+
+    return score;
+}
+
+
+static inline __attribute__((always_inline))
+void score_rows(float* user_vector,
+                float* rows,
+                float user_bias,
+                float* biases,
+                float* out,
+                intptr_t latent_dim,
+                const int accumulators,
+                const int unroll) {
+
+    __m256 acc[MAX_UNROLL][MAX_ACCUMULATORS];
+    __m256 y;
+
+    intptr_t j;
+
+    for (int u = 0; u < unroll; u++) {
+        for (int a = 0; a < accumulators; a++) {
+            acc[u][a] = _mm256_setzero_ps();
+        }
+    }
+
+    for (j = 0; j + 8 * accumulators <= latent_dim; j += 8 * accumulators) {
+        for (int a = 0; a < accumulators; a++) {
+            y = _mm256_load_ps(user_vector + j + 8 * a);
+
+            for (int u = 0; u < unroll; u++) {
+                acc[u][a] = _mm256_fmadd_ps(
+                    _mm256_load_ps(rows + u * latent_dim + j + 8 * a),
+                    y, acc[u][a]);
+            }
+        }
+    }
+
+    for (; j + 8 <= latent_dim; j += 8) {
+        y = _mm256_load_ps(user_vector + j);
+
+        for (int u = 0; u < unroll; u++) {
+            acc[u][0] = _mm256_fmadd_ps(
+                _mm256_load_ps(rows + u * latent_dim + j), y, acc[u][0]);
+        }
+    }
+
+    for (int u = 0; u < unroll; u++) {
+        out[u] = finish_score(acc[u], accumulators, biases[u] + user_bias,
+                              rows + u * latent_dim, user_vector,
+                              j, latent_dim);
+    }
+}
+
+
+static inline __attribute__((always_inline))
+void predict_float_tuned(float* user_vector,
+                         float* item_vectors,
+                         float user_bias,
+                         float* item_biases,
+                         float* out,
+                         intptr_t num_items,
+                         intptr_t latent_dim,
+                         const int accumulators,
+                         const int unroll,
+                         const int prefetch) {
+
+    intptr_t i;
+
+    for (i = 0; i + unroll <= num_items; i += unroll) {
+
+        if (prefetch && i + prefetch + unroll <= num_items) {
+            char* ahead = (char*) (item_vectors + (i + prefetch) * latent_dim);
+
+            for (intptr_t offset = 0;
+                 offset < unroll * latent_dim * (intptr_t) sizeof(float);
+                 offset += 64) {
+                _mm_prefetch(ahead + offset, _MM_HINT_T0);
+            }
+        }
+
+        score_rows(user_vector, item_vectors + i * latent_dim, user_bias,
+                   item_biases + i, out + i, latent_dim,
+                   accumulators, unroll);
+    }
+
+    for (; i < num_items; i++) {
+        score_rows(user_vector, item_vectors + i * latent_dim, user_bias,
+                   item_biases + i, out + i, latent_dim,
+                   accumulators, 1);
+    }
+}
+
+
+// (accumulators, unroll, prefetch) of the tuned variants.
+#define FLOAT_VARIANTS(X)                                               \
+    X(1, 1, 8) X(1, 1, 32)                                              \
+    X(1, 2, 0) X(1, 2, 8) X(1, 2, 32)                                   \
+    X(1, 4, 0) X(1, 4, 8) X(1, 4, 32)                                   \
+    X(2, 1, 0) X(2, 1, 8) X(2, 1, 32)                                   \
+    X(2, 2, 0) X(2, 2, 8) X(2, 2, 32)                                   \
+    X(2, 4, 0) X(2, 4, 8) X(2, 4, 32)                                   \
+    X(4, 1, 0) X(4, 1, 8) X(4, 1, 32)                                   \
+    X(4, 2, 0) X(4, 2, 8) X(4, 2, 32)                                   \
+    X(4, 4, 0) X(4, 4, 8) X(4, 4, 32)
+
+#define DEFINE_FLOAT_VARIANT(accumulators, unroll, prefetch)            \
+    __attribute__((noinline))                                           \
+    static void predict_float_a##accumulators##_u##unroll##_p##prefetch( \
+        float* user_vector, float* item_vectors, float user_bias,       \
+        float* item_biases, float* out, intptr_t num_items,             \
+        intptr_t latent_dim) {                                          \
+        predict_float_tuned(user_vector, item_vectors, user_bias,       \
+                            item_biases, out, num_items, latent_dim,    \
+                            accumulators, unroll, prefetch);            \
+    }
+
+#define FLOAT_VARIANT_ENTRY(accumulators, unroll, prefetch)             \
+    {predict_float_a##accumulators##_u##unroll##_p##prefetch,           \
+     {accumulators, unroll, prefetch}},
+
+FLOAT_VARIANTS(DEFINE_FLOAT_VARIANT)
+
+typedef void (*predict_float_fn)(float*, float*, float, float*,
+                                 float*, intptr_t, intptr_t);
+
+// Variant 0 is the reference kernel.
+static const struct {
+    predict_float_fn predict;
+    intptr_t config[3];
+} float_variants[] = {
+    {predict_float_256, {1, 1, 0}},
+    FLOAT_VARIANTS(FLOAT_VARIANT_ENTRY)
+};
+
+
+intptr_t num_float_variants(void) {
+
+    return sizeof(float_variants) / sizeof(float_variants[0]);
+}
+
+
+/*
+ * Write the (accumulators, unroll, prefetch) of a variant to config.
+ */
+void float_variant_config(intptr_t variant, intptr_t* config) {
+
+    memcpy(config, float_variants[variant].config, 3 * sizeof(intptr_t));
+}
+
+
+void predict_float_variant(intptr_t variant,
+                           float* user_vector,
+                           float* item_vectors,
+                           float user_bias,
+                           float* item_biases,
+                           float* out,
+                           intptr_t num_items,
+                           intptr_t latent_dim) {
+
+    float_variants[variant].predict(user_vector, item_vectors, user_bias,
+                                    item_biases, out, num_items, latent_dim);
+}
+
+
+/*
+ * Score of a single item from binary vectors, with latent_dim
+ * expressed in 32-bit words.
+ *
+ * Not inlined, so that every caller computes bit-identical
+ * scores for the same item (which rank_xnor_256 relies on).
+ */
+__attribute__((noinline))
+static float score_xnor_256(int32_t* user_vector,
+                            int32_t* item_vector,
+                            float user_bias,
+                            float item_bias,
+                            float user_norm,
+                            float item_norm,
+                            intptr_t latent_dim,
+                            int cpuid) {
+
+    float max_on_bits = latent_dim * 32;
+
+    __m256i x, y, xnor;
+    unsigned int on_bits = 0;
+    int32_t bits[8] = {0, 0, 0, 0, 0, 0, 0, 0};
+
+    __m256i allbits = _mm256_cmpeq_epi32(
+        _mm256_setzero_si256(),
+        _mm256_setzero_si256());
+
+    int j = 0;
+
+    for (; j + 8 <= latent_dim; j += 8) {
+
+        x = _mm256_load_si256((__m256i*) (item_vector + j));
+        y = _mm256_load_si256((__m256i*) (user_vector + j));
+
+        xnor = _mm256_xor_si256(_mm256_xor_si256(x, y), allbits);
+        _mm256_store_si256((__m256i*) bits, xnor);
+
+        on_bits += popcnt_no_cpuid((const void*) bits,
+                                   8 * sizeof(float), cpuid);
+    }
+
+    for (; j < latent_dim; j++) {
+        on_bits += __builtin_popcount(~(user_vector[j] ^ item_vector[j]));
+    }
+
+    return (on_bits - (max_on_bits - on_bits)) * user_norm * item_norm
+        + user_bias + item_bias;
+}
+
+
 void predict_xnor_256(int32_t* user_vector,
                       int32_t* item_vectors,
                       float user_bias,
@@ -176,3 +449,655 @@ void predict_xnor_256(int32_t* user_vector,
         out[i] = scalar_prediction + user_bias + item_biases[i];
     }
 }
+
+
+static int compare_floats(const void* a, const void* b) {
+
+    float x = *(const float*) a;
+    float y = *(const float*) b;
+
+    return (x > y) - (x < y);
+}
+
+
+/*
+ * Index of the first element of the sorted array that is >= value
+ * (or > value if strict is set).
+ */
+static intptr_t search_sorted(float* sorted, intptr_t size,
+                              float value, int strict) {
+
+    intptr_t lo = 0;
+    intptr_t hi = size;
+
+    while (lo < hi) {
+        intptr_t mid = lo + (hi - lo) / 2;
+
+        if (sorted[mid] < value || (strict && sorted[mid] == value)) {
+            lo = mid + 1;
+        } else {
+            hi = mid;
+        }
+    }
+
+    return lo;
+}
+
+
+/*
+ * Accumulate the ranks of target items given the score of one
+ * (non-excluded) catalog item.
+ *
+ * above[m] counts catalog items that score higher than exactly the
+ * first m sorted target scores; tied[m] counts items tied with the
+ * target score at sorted position m (its first occurrence).
+ */
+static inline void count_score(float score,
+                               float* sorted_scores,
+                               intptr_t num_targets,
+                               int64_t* above,
+                               int64_t* tied) {
+
+    intptr_t below = search_sorted(sorted_scores, num_targets, score, 0);
+
+    above[below] += 1;
+
+    if (below < num_targets && sorted_scores[below] == score) {
+        tied[below] += 1;
+    }
+}
+
+
+/*
+ * Turn the accumulated counts into, for every target item, the number
+ * of catalog items scoring strictly higher and exactly as high.
+ */
+static void finish_counts(float* target_scores,
+                          float* sorted_scores,
+                          intptr_t num_targets,
+                          int64_t* above,
+                          int64_t* tied,
+                          int64_t* higher,
+                          int64_t* equal) {
+
+    // Suffix sums: above[m] becomes the number of items
+    // scoring higher than at least the first m sorted targets.
+    for (intptr_t m = num_targets - 1; m >= 0; m--) {
+        above[m] += above[m + 1];
+    }
+
+    for (intptr_t t = 0; t < num_targets; t++) {
+        intptr_t first = search_sorted(sorted_scores, num_targets,
+                                       target_scores[t], 0);
+        intptr_t last = search_sorted(sorted_scores, num_targets,
+                                      target_scores[t], 1);
+
+        higher[t] = above[last];
+        equal[t] = tied[first];
+    }
+}
+
+
+/*
+ * Rank target items against the whole catalog in one streaming pass,
+ * without writing out the scores of the catalog items.
+ *
+ * For every target, counts the non-excluded catalog items that score
+ * strictly higher (higher) and exactly as high (equal, including the
+ * target itself unless it is excluded). excluded_ids must be sorted.
+ * target_scores is written out; workspace must hold
+ * 3 * (num_targets + 1) 64-bit values.
+ *
+ * Items are scored with the given variant of predict_float_256, so
+ * that scores, and therefore ties, are exactly those of a full scan
+ * with that variant.
+ */
+#define RANK_CHUNK 256
+
+void rank_float_256(float* user_vector,
+                    float* item_vectors,
+                    float user_bias,
+                    float* item_biases,
+                    int32_t* target_ids,
+                    intptr_t num_targets,
+                    int32_t* excluded_ids,
+                    intptr_t num_excluded,
+                    float* target_scores,
+                    int64_t* workspace,
+                    int64_t* higher,
+                    int64_t* equal,
+                    intptr_t num_items,
+                    intptr_t latent_dim,
+                    intptr_t variant) {
+
+    float* sorted_scores = (float*) workspace;
+    int64_t* above = workspace + num_targets + 1;
+    int64_t* tied = above + num_targets + 1;
+
+    predict_float_fn predict = float_variants[variant].predict;
+    float chunk_scores[RANK_CHUNK];
+
+    intptr_t next_excluded = 0;
+
+    memset(above, 0, 2 * (num_targets + 1) * sizeof(int64_t));
+
+    for (intptr_t t = 0; t < num_targets; t++) {
+        predict(user_vector,
+                item_vectors + target_ids[t] * latent_dim,
+                user_bias,
+                item_biases + target_ids[t],
+                target_scores + t,
+                1,
+                latent_dim);
+    }
+
+    memcpy(sorted_scores, target_scores, num_targets * sizeof(float));
+    qsort(sorted_scores, num_targets, sizeof(float), compare_floats);
+
+    for (intptr_t start = 0; start < num_items; start += RANK_CHUNK) {
+
+        intptr_t stop = start + RANK_CHUNK < num_items
+            ? start + RANK_CHUNK : num_items;
+
+        predict(user_vector,
+                item_vectors + start * latent_dim,
+                user_bias,
+                item_biases + start,
+                chunk_scores,
+                stop - start,
+                latent_dim);
+
+        for (intptr_t i = start; i < stop; i++) {
+
+            if (next_excluded < num_excluded
+                && excluded_ids[next_excluded] == i) {
+                next_excluded++;
+                continue;
+            }
+
+            count_score(chunk_scores[i - start], sorted_scores,
+                        num_targets, above, tied);
+        }
+    }
+
+    finish_counts(target_scores, sorted_scores, num_targets,
+                  above, tied, higher, equal);
+}
+
+
+/*
+ * As rank_float_256, for binary vectors scored as in predict_xnor_256.
+ */
+void rank_xnor_256(int32_t* user_vector,
+                   int32_t* item_vectors,
+                   float user_bias,
+                   float* item_biases,
+                   float user_norm,
+                   float* item_norms,
+                   int32_t* target_ids,
+                   intptr_t num_targets,
+                   int32_t* excluded_ids,
+                   intptr_t num_excluded,
+                   float* target_scores,
+                   int64_t* workspace,
+                   int64_t* higher,
+                   int64_t* equal,
+                   intptr_t num_items,
+                   intptr_t latent_dim) {
+
+    float* sorted_scores = (float*) workspace;
+    int64_t* above = workspace + num_targets + 1;
+    int64_t* tied = above + num_targets + 1;
+
+    int cpuid = _get_cpuid();
+
+    intptr_t next_excluded = 0;
+    float score;
+
+    memset(above, 0, 2 * (num_targets + 1) * sizeof(int64_t));
+
+    for (intptr_t t = 0; t < num_targets; t++) {
+        target_scores[t] = score_xnor_256(
+            user_vector,
+            item_vectors + target_ids[t] * latent_dim,
+            user_bias,
+            item_biases[target_ids[t]],
+            user_norm,
+            item_norms[target_ids[t]],
+            latent_dim,
+            cpuid);
+    }
+
+    memcpy(sorted_scores, target_scores, num_targets * sizeof(float));
+    qsort(sorted_scores, num_targets, sizeof(float), compare_floats);
+
+    for (intptr_t i = 0; i < num_items; i++) {
+
+        if (next_excluded < num_excluded && excluded_ids[next_excluded] == i) {
+            next_excluded++;
+            continue;
+        }
+
+        score = score_xnor_256(user_vector,
+                               item_vectors + i * latent_dim,
+                               user_bias,
+                               item_biases[i],
+                               user_norm,
+                               item_norms[i],
+                               latent_dim,
+                               cpuid);
+
+        count_score(score, sorted_scores, num_targets, above, tied);
+    }
+
+    finish_counts(target_scores, sorted_scores, num_targets,
+                  above, tied, higher, equal);
+}
+
+
+/*
+ * Score items encoded with 8-bit product quantization codes by
+ * asymmetric distance computation: every item's score is the sum,
+ * over subspaces, of the lookup table entry its code selects.
+ *
+ * lut holds 256 entries per subspace, codes num_subspaces bytes per item.
+ */
+void predict_pq8(float* lut,
+                 uint8_t* codes,
+                 float user_bias,
+                 float* out,
+                 intptr_t num_items,
+                 intptr_t num_subspaces) {
+
+    for (intptr_t i = 0; i < num_items; i++) {
+
+        uint8_t* item_codes = codes + i * num_subspaces;
+        float prediction = user_bias;
+
+        for (intptr_t m = 0; m < num_subspaces; m++) {
+            prediction += lut[m * 256 + item_codes[m]];
+        }
+
+        out[i] = prediction;
+    }
+}
+
+
+/*
+ * Score items encoded with 4-bit product quantization codes using
+ * in-register lookup tables (fast scan).
+ *
+ * lut holds 16 quantized 8-bit entries per subspace, so that the
+ * tables of two subspaces fill one AVX2 register and are looked up
+ * with pshufb, 32 items at a time. The number of subspaces must be
+ * even, and at most 256 so that sums fit in 16 bits.
+ *
+ * Codes are laid out in blocks of 32 items: for every subspace, 16
+ * bytes whose low nibbles are the codes of the block's first 16
+ * items, and high nibbles the codes of the last 16 items.
+ *
+ * Scores are sum * scale + offset.
+ */
+void predict_pq4(uint8_t* lut,
+                 uint8_t* codes,
+                 float scale,
+                 float offset,
+                 float* out,
+                 intptr_t num_items,
+                 intptr_t num_subspaces) {
+
+    const __m256i low_mask = _mm256_set1_epi8(0x0f);
+    const __m256 scales = _mm256_set1_ps(scale);
+    const __m256 offsets = _mm256_set1_ps(offset);
+
+    intptr_t num_blocks = (num_items + 31) / 32;
+
+    uint16_t sums[32] __attribute__((aligned(32)));
+    float predictions[32] __attribute__((aligned(32)));
+
+    for (intptr_t block = 0; block < num_blocks; block++) {
+
+        uint8_t* block_codes = codes + block * num_subspaces * 16;
+
+        __m256i first = _mm256_setzero_si256();
+        __m256i last = _mm256_setzero_si256();
+
+        for (intptr_t m = 0; m < num_subspaces; m += 2) {
+
+            __m256i table = _mm256_loadu_si256((__m256i*) (lut + m * 16));
+            __m256i packed = _mm256_loadu_si256(
+                (__m256i*) (block_codes + m * 16));
+
+            __m256i low = _mm256_shuffle_epi8(
+                table, _mm256_and_si256(packed, low_mask));
+            __m256i high = _mm256_shuffle_epi8(
+                table, _mm256_and_si256(_mm256_srli_epi16(packed, 4),
+                                        low_mask));
+
+            // Each lane holds one subspace's entries for 16 items.
+            first = _mm256_add_epi16(
+                first, _mm256_cvtepu8_epi16(_mm256_castsi256_si128(low)));
+            first = _mm256_add_epi16(
+                first, _mm256_cvtepu8_epi16(_mm256_extracti128_si256(low, 1)));
+            last = _mm256_add_epi16(
+                last, _mm256_cvtepu8_epi16(_mm256_castsi256_si128(high)));
+            last = _mm256_add_epi16(
+                last, _mm256_cvtepu8_epi16(_mm256_extracti128_si256(high, 1)));
+        }
+
+        _mm256_store_si256((__m256i*) sums, first);
+        _mm256_store_si256((__m256i*) (sums + 16), last);
+
+        for (int j = 0; j < 32; j += 8) {
+            __m256 values = _mm256_cvtepi32_ps(_mm256_cvtepu16_epi32(
+                _mm_load_si128((__m128i*) (sums + j))));
+            _mm256_store_ps(predictions + j,
+                            _mm256_add_ps(_mm256_mul_ps(values, scales),
+                                          offsets));
+        }
+
+        intptr_t block_size = num_items - block * 32;
+        block_size = block_size < 32 ? block_size : 32;
+
+        memcpy(out + block * 32, predictions, block_size * sizeof(float));
+    }
+}
+
+
+/*
+ * Number of equal bits in two planes of num_words 32-bit words,
+ * compared 64 bits at a time.
+ */
+static inline unsigned int plane_matches(const int32_t* x,
+                                         const int32_t* y,
+                                         intptr_t num_words) {
+
+    unsigned int on_bits = 0;
+    uint64_t a, b;
+    intptr_t j = 0;
+
+    for (; j + 2 <= num_words; j += 2) {
+        memcpy(&a, x + j, sizeof(uint64_t));
+        memcpy(&b, y + j, sizeof(uint64_t));
+        on_bits += __builtin_popcountll(~(a ^ b));
+    }
+
+    for (; j < num_words; j++) {
+        on_bits += __builtin_popcount(~((uint32_t) x[j] ^ (uint32_t) y[j]));
+    }
+
+    return on_bits;
+}
+
+
+/*
+ * Score items from residual binary codes, in which every vector is
+ * the sum of num_bits scaled sign planes.
+ *
+ * The dot product of two such vectors sums, over every pair of user
+ * and item planes, the XNOR-popcount product of the planes times their
+ * scales. The num_bits planes of an item are stored contiguously and
+ * read once, while the user's planes stay in cache.
+ *
+ * Planes have latent_dim 32-bit words; item_planes holds
+ * num_bits * latent_dim words and item_scales num_bits scales per item.
+ */
+void predict_xnor_residual(int32_t* user_planes,
+                           float* user_scales,
+                           int32_t* item_planes,
+                           float* item_scales,
+                           float user_bias,
+                           float* item_biases,
+                           float* out,
+                           intptr_t num_items,
+                           intptr_t latent_dim,
+                           intptr_t num_bits) {
+
+    float max_on_bits = latent_dim * 32;
+    float user_scale_sum = 0;
+
+    for (intptr_t a = 0; a < num_bits; a++) {
+        user_scale_sum += user_scales[a];
+    }
+
+    for (intptr_t i = 0; i < num_items; i++) {
+
+        int32_t* item_vector = item_planes + i * num_bits * latent_dim;
+        float* scales = item_scales + i * num_bits;
+
+        // Sum of scaled matching bits; the products of the planes are
+        // 2 * matches - max_on_bits, so the second term is factored out.
+        float matches = 0;
+        float item_scale_sum = 0;
+
+        for (intptr_t b = 0; b < num_bits; b++) {
+
+            int32_t* item_plane = item_vector + b * latent_dim;
+            float plane_matches_sum = 0;
+
+            for (intptr_t a = 0; a < num_bits; a++) {
+                plane_matches_sum += plane_matches(user_planes + a * latent_dim,
+                                                   item_plane,
+                                                   latent_dim)
+                    * user_scales[a];
+            }
+
+            matches += plane_matches_sum * scales[b];
+            item_scale_sum += scales[b];
+        }
+
+        out[i] = 2.0f * matches
+            - max_on_bits * user_scale_sum * item_scale_sum
+            + user_bias + item_biases[i];
+    }
+}
+
+
+/*
+ * Whether (score_a, id_a) ranks below (score_b, id_b): by descending
+ * score, with ties broken by ascending id.
+ */
+static inline int ranks_below(float score_a, int32_t id_a,
+                              float score_b, int32_t id_b) {
+
+    return score_a < score_b || (score_a == score_b && id_a > id_b);
+}
+
+
+/*
+ * Restore the heap property of a heap whose root is its lowest-ranked
+ * item, after replacing the item at position i.
+ */
+static void sift_down(float* scores, int32_t* ids, intptr_t size,
+                      intptr_t i) {
+
+    for (;;) {
+        intptr_t lowest = i;
+        intptr_t left = 2 * i + 1;
+        intptr_t right = left + 1;
+
+        if (left < size && ranks_below(scores[left], ids[left],
+                                       scores[lowest], ids[lowest])) {
+            lowest = left;
+        }
+        if (right < size && ranks_below(scores[right], ids[right],
+                                        scores[lowest], ids[lowest])) {
+            lowest = right;
+        }
+        if (lowest == i) {
+            return;
+        }
+
+        float score = scores[i];
+        int32_t id = ids[i];
+
+        scores[i] = scores[lowest];
+        ids[i] = ids[lowest];
+        scores[lowest] = score;
+        ids[lowest] = id;
+
+        i = lowest;
+    }
+}
+
+
+static void sift_up(float* scores, int32_t* ids, intptr_t i) {
+
+    while (i > 0) {
+        intptr_t parent = (i - 1) / 2;
+
+        if (!ranks_below(scores[i], ids[i], scores[parent], ids[parent])) {
+            return;
+        }
+
+        float score = scores[i];
+        int32_t id = ids[i];
+
+        scores[i] = scores[parent];
+        ids[i] = ids[parent];
+        scores[parent] = score;
+        ids[parent] = id;
+
+        i = parent;
+    }
+}
+
+
+static int is_excluded(int32_t id, int32_t* excluded_ids,
+                       intptr_t num_excluded) {
+
+    intptr_t low = 0;
+    intptr_t high = num_excluded;
+
+    while (low < high) {
+        intptr_t middle = (low + high) / 2;
+
+        if (excluded_ids[middle] < id) {
+            low = middle + 1;
+        } else {
+            high = middle;
+        }
+    }
+
+    return low < num_excluded && excluded_ids[low] == id;
+}
+
+
+/*
+ * Exact top-k with early termination.
+ *
+ * Items are visited in the order given by order, in blocks of
+ * block_size. For every block, block_norms and block_biases hold the
+ * largest item norm and bias of that block and all blocks after it,
+ * so that by Cauchy-Schwarz no remaining item can score above
+ *
+ *     user_norm * block_norms[b] + block_biases[b] + user_bias.
+ *
+ * The scan stops once this bound, widened by the worst-case rounding
+ * error of the dot product, falls strictly below the k-th best score.
+ *
+ * The rows of every block are copied into workspace and scored with
+ * the given variant of predict_float_256, so that scores, and therefore
+ * ties, are exactly those of a full scan with that variant. workspace
+ * must hold block_size * (latent_dim + 2) floats and be aligned as
+ * item_vectors is; workspace_ids must hold block_size ids.
+ *
+ * top_ids and top_scores receive the (unsorted) top items; returns
+ * their number, and writes the number of items scored to num_scored.
+ * excluded_ids must be sorted.
+ */
+intptr_t top_k_float_256(float* user_vector,
+                         float* item_vectors,
+                         float user_bias,
+                         float* item_biases,
+                         int32_t* order,
+                         float* block_norms,
+                         float* block_biases,
+                         intptr_t block_size,
+                         float user_norm,
+                         int32_t* excluded_ids,
+                         intptr_t num_excluded,
+                         intptr_t k,
+                         int32_t* top_ids,
+                         float* top_scores,
+                         int64_t* num_scored,
+                         float* workspace,
+                         int32_t* workspace_ids,
+                         intptr_t num_items,
+                         intptr_t latent_dim,
+                         intptr_t variant) {
+
+    float* rows = workspace;
+    float* row_biases = rows + block_size * latent_dim;
+    float* row_scores = row_biases + block_size;
+
+    intptr_t size = 0;
+    float tolerance = (latent_dim + 2) * FLT_EPSILON;
+
+    *num_scored = 0;
+
+    if (k <= 0) {
+        return 0;
+    }
+
+    for (intptr_t start = 0; start < num_items; start += block_size) {
+
+        intptr_t block = start / block_size;
+
+        if (size == k) {
+            float magnitude = user_norm * block_norms[block];
+            float bound = magnitude + block_biases[block] + user_bias;
+
+            bound += tolerance * (magnitude + fabsf(block_biases[block])
+                                  + fabsf(user_bias));
+
+            if (bound < top_scores[0]) {
+                break;
+            }
+        }
+
+        intptr_t stop = start + block_size < num_items
+            ? start + block_size : num_items;
+        intptr_t num_rows = 0;
+
+        for (intptr_t i = start; i < stop; i++) {
+
+            int32_t id = order[i];
+
+            if (num_excluded && is_excluded(id, excluded_ids, num_excluded)) {
+                continue;
+            }
+
+            memcpy(rows + num_rows * latent_dim,
+                   item_vectors + (intptr_t) id * latent_dim,
+                   latent_dim * sizeof(float));
+            row_biases[num_rows] = item_biases[id];
+            workspace_ids[num_rows] = id;
+            num_rows++;
+        }
+
+        float_variants[variant].predict(user_vector, rows, user_bias,
+                                        row_biases, row_scores, num_rows,
+                                        latent_dim);
+        *num_scored += num_rows;
+
+        for (intptr_t j = 0; j < num_rows; j++) {
+
+            float score = row_scores[j];
+            int32_t id = workspace_ids[j];
+
+            if (size < k) {
+                top_scores[size] = score;
+                top_ids[size] = id;
+                sift_up(top_scores, top_ids, size);
+                size++;
+            } else if (ranks_below(top_scores[0], top_ids[0], score, id)) {
+                top_scores[0] = score;
+                top_ids[0] = id;
+                sift_down(top_scores, top_ids, size, 0);
+            }
+        }
+    }
+
+    return size;
+}
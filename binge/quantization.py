@@ -0,0 +1,194 @@
+"""
+Product quantization of embedding vectors.
+
+Vectors are split into `num_subspaces` contiguous subvectors, and
+every subvector is replaced by the index of its nearest centroid in a
+per-subspace codebook learned with k-means. With 16 or 256 centroids,
+a subvector is stored in 4 or 8 bits.
+
+This module depends only on numpy, so that it can be used by
+the serving scorers.
+"""
+
+import numpy as np
+
+
+BLOCK_SIZE = 32
+
+
+def _nearest(vectors, centroids, chunk_size=2 ** 14):
+
+    nearest = np.empty(len(vectors), dtype=np.int64)
+
+    # Squared distances, up to the squared norms of the vectors.
+    centroid_norms = (centroids ** 2).sum(axis=1)
+
+    for start in range(0, len(vectors), chunk_size):
+        distances = np.dot(vectors[start:start + chunk_size], centroids.T)
+        distances *= -2
+        distances += centroid_norms
+        nearest[start:start + chunk_size] = distances.argmin(axis=1)
+
+    return nearest
+
+
+def _kmeans(vectors, num_centroids, num_iterations, random_state):
+
+    if len(vectors) <= num_centroids:
+        # Every vector is its own centroid; unused centroids repeat them.
+        centroids = vectors[np.arange(num_centroids) % len(vectors)]
+        return centroids.astype(np.float32)
+
+    centroids = vectors[random_state.choice(len(vectors), num_centroids,
+                                            replace=False)]
+
+    for _ in range(num_iterations):
+        assignments = _nearest(vectors, centroids)
+        counts = np.bincount(assignments, minlength=num_centroids)
+
+        sums = np.stack([np.bincount(assignments, weights=column,
+                                     minlength=num_centroids)
+                         for column in vectors.T], axis=1)
+
+        empty = counts == 0
+        centroids = (sums / np.maximum(counts, 1)[:, np.newaxis]
+                     ).astype(np.float32)
+
+        # Restart empty clusters at random vectors.
+        centroids[empty] = vectors[random_state.choice(len(vectors),
+                                                       empty.sum())]
+
+    return centroids.astype(np.float32)
+
+
+def pad_subspaces(vectors, num_subspaces):
+    """
+    Zero-pad vectors so that their dimension is a
+    multiple of `num_subspaces`.
+    """
+
+    dim = vectors.shape[1]
+    padded_dim = -(-dim // num_subspaces) * num_subspaces
+
+    if padded_dim == dim:
+        return vectors
+
+    return np.pad(vectors, ((0, 0), (0, padded_dim - dim)), 'constant')
+
+
+def train_codebooks(vectors,
+                    num_subspaces,
+                    num_centroids=256,
+                    num_iterations=10,
+                    sample_size=2 ** 16,
+                    random_state=None):
+    """
+    Learn product quantization codebooks with k-means.
+
+    Parameters
+    ----------
+
+    vectors: np.float32 array of shape [n_vectors, dim]
+    num_subspaces: int
+    num_centroids: int, optional
+        Centroids per subspace: at most 16 for 4-bit
+        codes, and at most 256 for 8-bit codes.
+    num_iterations: int, optional
+        Number of k-means iterations.
+    sample_size: int, optional
+        Codebooks are trained on a random sample of at
+        most this many vectors.
+    random_state: np.random.RandomState, optional
+
+    Returns
+    -------
+
+    codebooks: np.float32 array of shape
+               [num_subspaces, num_centroids, subspace_dim]
+        Vectors are zero-padded to num_subspaces * subspace_dim dimensions.
+    """
+
+    if random_state is None:
+        random_state = np.random.RandomState()
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+
+    if len(vectors) > sample_size:
+        vectors = vectors[random_state.choice(len(vectors), sample_size,
+                                              replace=False)]
+
+    subspaces = np.split(pad_subspaces(vectors, num_subspaces),
+                         num_subspaces, axis=1)
+
+    return np.stack([_kmeans(np.ascontiguousarray(subspace), num_centroids,
+                             num_iterations, random_state)
+                     for subspace in subspaces])
+
+
+def encode(vectors, codebooks, chunk_size=2 ** 14):
+    """
+    Return the [n_vectors, n_subspaces] np.uint8 codes of `vectors`.
+    """
+
+    num_subspaces = len(codebooks)
+    codes = np.empty((len(vectors), num_subspaces), dtype=np.uint8)
+
+    for start in range(0, len(vectors), chunk_size):
+        chunk = pad_subspaces(np.asarray(vectors[start:start + chunk_size],
+                                         dtype=np.float32),
+                              num_subspaces)
+
+        for m, subspace in enumerate(np.split(chunk, num_subspaces, axis=1)):
+            codes[start:start + chunk_size, m] = _nearest(subspace,
+                                                          codebooks[m])
+
+    return codes
+
+
+def decode(codes, codebooks):
+    """
+    Return the (padded) vectors that `codes` stand for.
+    """
+
+    return np.concatenate([codebooks[m][codes[:, m]]
+                           for m in range(len(codebooks))], axis=1)
+
+
+def pack_codes(codes):
+    """
+    Pack 4-bit codes into the block layout of the fast scan kernel.
+
+    Items are grouped in blocks of 32 and the number of subspaces is
+    padded to an even number. For every block and subspace, 16 bytes
+    hold the codes of the block's first 16 items in their low nibbles,
+    and of its last 16 items in their high nibbles.
+
+    Returns a np.uint8 array of shape [n_blocks, n_padded_subspaces, 16].
+    """
+
+    num_items, num_subspaces = codes.shape
+
+    num_blocks = -(-num_items // BLOCK_SIZE)
+    padded = np.zeros((num_blocks * BLOCK_SIZE,
+                       num_subspaces + num_subspaces % 2), dtype=np.uint8)
+    padded[:num_items, :num_subspaces] = codes
+
+    blocks = padded.reshape(num_blocks, BLOCK_SIZE, -1)
+    packed = blocks[:, :16] | (blocks[:, 16:] << 4)
+
+    return np.ascontiguousarray(packed.transpose(0, 2, 1))
+
+
+def unpack_codes(packed, item_ids):
+    """
+    Return the [n_items, n_padded_subspaces] 4-bit codes
+    of `item_ids` from codes packed by `pack_codes`.
+    """
+
+    item_ids = np.asarray(item_ids, dtype=np.int64)
+
+    within = item_ids % BLOCK_SIZE
+    packed_bytes = packed[item_ids // BLOCK_SIZE, :, within % 16]
+    shifts = np.where(within < 16, 0, 4).astype(np.uint8)
+
+    return (packed_bytes >> shifts[:, np.newaxis]) & 0x0f
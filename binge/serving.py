@@ -0,0 +1,961 @@
+"""
+Scoring with fitted representations.
+
+This module depends only on numpy and cffi, so that serving
+processes can import the scorers without loading torch.
+"""
+
+import concurrent.futures
+import copy
+import itertools
+
+import numpy as np
+
+from binge import instrumentation
+from binge.memory import numa_nodes, pin_to_node, place
+from binge.native import align, get_lib
+from binge.quantization import (encode, pack_codes, pad_subspaces,
+                                train_codebooks, unpack_codes)
+
+
+def binarize_array(array):
+
+    assert array.shape[1] % 8 == 0
+
+    array = (np.sign(array) > 0.0).astype(bool)
+    array = np.packbits(array, axis=1)
+
+    return array
+
+
+def binarize_residuals(array, num_bits):
+    """
+    Encode every row as the sum of `num_bits` scaled sign vectors,
+    each binarizing the residual left by the ones before it. The scale
+    of a plane is the mean absolute value of the residual it encodes,
+    which minimizes the squared error of the approximation.
+
+    With one bit, this gives the signs of `binarize_array`
+    and the row norms of `XNORScorer`.
+
+    The number of columns must be a multiple of 32, as the residual
+    kernel compares planes in whole 32-bit words.
+
+    Returns
+    -------
+
+    (planes, scales): tuple of arrays
+        np.uint8 sign planes of shape [n_rows, num_bits, n_columns / 8]
+        and np.float32 scales of shape [n_rows, num_bits].
+    """
+
+    assert array.shape[1] % 32 == 0
+
+    residual = np.array(array, dtype=np.float32)
+
+    planes = []
+    scales = []
+
+    for _ in range(num_bits):
+        scale = np.abs(residual).mean(axis=1, keepdims=True)
+        positive = residual > 0.0
+
+        planes.append(np.packbits(positive, axis=1))
+        scales.append(scale[:, 0])
+
+        residual -= np.where(positive, scale, -scale)
+
+    return np.stack(planes, axis=1), np.stack(scales, axis=1)
+
+
+def _ranks_from_scores(scores, target_item_ids, exclude):
+    """
+    Count, for every target, the non-excluded items scoring
+    higher and as high, as the native rank kernels do.
+    """
+
+    target_scores = scores[target_item_ids]
+
+    included = np.sort(np.delete(scores, exclude))
+    below = np.searchsorted(included, target_scores, side='left')
+    not_above = np.searchsorted(included, target_scores, side='right')
+
+    return (target_scores,
+            len(included) - not_above,
+            not_above - below)
+
+
+class _ComposedVectors:
+
+    def materialize(self, chunk_size=2 ** 16):
+
+        out = np.empty(self.shape, dtype=self.dtype)
+
+        for start in range(0, self.shape[0], chunk_size):
+            ids = np.arange(start, min(start + chunk_size, self.shape[0]))
+            out[ids] = self[ids]
+
+        return out
+
+
+class QRVectors(_ComposedVectors):
+    """
+    Lazily composed quotient-remainder embedding vectors.
+    """
+
+    def __init__(self, quotient, remainder, num_rows):
+
+        self._quotient = quotient
+        self._remainder = remainder
+
+        self.shape = (num_rows, quotient.shape[1])
+        self.dtype = quotient.dtype
+        self.nbytes = quotient.nbytes + remainder.nbytes
+
+    def __getitem__(self, idx):
+
+        num_buckets = len(self._remainder)
+
+        return self._quotient[idx // num_buckets] * self._remainder[idx % num_buckets]
+
+
+class HashVectors(_ComposedVectors):
+    """
+    Lazily composed multi-hash embedding vectors.
+    """
+
+    def __init__(self, table, hash_parameters, num_rows, prime):
+
+        self._table = table
+        self._hash_parameters = hash_parameters.astype(np.int64)
+        self._prime = prime
+
+        self.shape = (num_rows, table.shape[1])
+        self.dtype = table.dtype
+        self.nbytes = table.nbytes + hash_parameters.nbytes
+
+    def __getitem__(self, idx):
+
+        idx = np.asarray(idx, dtype=np.int64)
+
+        return sum(self._table[((idx * multiplier + offset) % self._prime)
+                               % len(self._table)]
+                   for multiplier, offset in self._hash_parameters)
+
+
+def _gathered_bytes(item_ids, user_vector, *item_arrays):
+    """
+    Bytes gathered for a call: the user's vector and, when
+    scoring a subset of items, copies of the item arrays.
+    """
+
+    gathered = user_vector.nbytes
+
+    if not isinstance(item_ids, slice):
+        gathered += sum(array.nbytes for array in item_arrays)
+
+    return gathered
+
+
+class _NativeScorer:
+
+    # Names of the arrays that fully describe a scorer, as
+    # stored in `_<name>` attributes.
+    _STATE = ()
+    # Names of the arrays scanned by every query.
+    _ITEM_STATE = ()
+
+    # Incremented whenever the scorer's items change,
+    # so that cached results can be invalidated.
+    version = 0
+
+    def _state(self):
+        """
+        Return the scorer's arrays by name. Lazily composed user
+        vectors are materialized.
+        """
+
+        state = {}
+
+        for name in self._STATE:
+            value = getattr(self, '_' + name)
+
+            if isinstance(value, _ComposedVectors):
+                value = value.materialize()
+
+            state[name] = value
+
+        return state
+
+    @classmethod
+    def _from_state(cls, state):
+        """
+        Build a scorer from the output of `_state` without
+        re-processing the arrays, which may live in shared memory.
+        """
+
+        scorer = cls.__new__(cls)
+
+        for name in cls._STATE:
+            setattr(scorer, '_' + name, align(state[name]))
+
+        scorer._lib = get_lib()
+
+        return scorer
+
+    @property
+    def num_items(self):
+
+        return len(self._item_biases)
+
+    def memory(self):
+
+        return sum(x.nbytes for x in self._parameters())
+
+    def place(self, huge_pages=True, node=None, interleave=False):
+        """
+        Return a copy of the scorer whose item arrays, scanned by every
+        query, are backed by transparent huge pages and optionally bound
+        to the memory of NUMA node `node` or interleaved across nodes
+        (see `binge.memory.allocate`). User arrays are shared.
+        """
+
+        scorer = copy.copy(self)
+
+        for name in self._ITEM_STATE:
+            setattr(scorer, '_' + name, place(getattr(self, '_' + name),
+                                              huge_pages=huge_pages,
+                                              node=node,
+                                              interleave=interleave))
+
+        return scorer
+
+    def rank_of(self, user_id, target_item_ids, exclude=None):
+        """
+        Compute the ranks of the target items among all items for a user,
+        in a single pass of the native kernel over the catalog.
+
+        Arguments
+        ---------
+
+        user_id: int
+        target_item_ids: np.int32 array of shape [n_targets,]
+        exclude: np.int32 array, optional
+             Items ranked below all others, such as training items.
+
+        Returns
+        -------
+
+        ranks: np.float64 array of shape [n_targets,]
+             1 for the highest-scoring item; tied items are
+             given their average rank.
+        """
+
+        record = instrumentation.recorder(self._RANK_OPERATION)
+
+        target_item_ids = np.asarray(target_item_ids, dtype=np.int32)
+
+        if exclude is None:
+            exclude = np.array([], dtype=np.int32)
+        else:
+            exclude = np.unique(exclude).astype(np.int32)
+
+        # The kernels index item arrays with these ids unchecked.
+        for name, item_ids in (('target', target_item_ids),
+                               ('excluded', exclude)):
+            if len(item_ids) and (item_ids.min() < 0 or
+                                  item_ids.max() >= self.num_items):
+                raise ValueError('{} item ids must be in [0, {})'
+                                 .format(name.capitalize(), self.num_items))
+
+        record('prepare')
+
+        _, higher, equal = self._rank(user_id, target_item_ids, exclude)
+        record('native')
+
+        ranks = higher + (equal + 1) / 2.0
+
+        # Excluded items are tied for the lowest ranks.
+        num_included = self.num_items - len(exclude)
+        ranks[np.isin(target_item_ids, exclude)] = (num_included +
+                                                    (len(exclude) + 1) / 2.0)
+
+        record('postprocess')
+        record.finish()
+
+        return ranks
+
+    def top_k(self, user_id, k, exclude=None):
+        """
+        Return the `k` highest-scoring items for a user.
+
+        Arguments
+        ---------
+
+        user_id: int
+        k: int
+        exclude: np.int32 array, optional
+             Items that must not be returned, such as training items.
+
+        Returns
+        -------
+
+        (item_ids, scores): tuple of arrays of shape [min(k, n_items),]
+             Ordered by descending score; ties are broken
+             by ascending item id.
+        """
+
+        scores = self.predict(user_id).copy()
+
+        if exclude is not None:
+            scores[exclude] = -np.inf
+
+        num_candidates = len(scores) - (0 if exclude is None
+                                        else len(np.unique(exclude)))
+        k = min(k, num_candidates)
+
+        if k <= 0:
+            return np.array([], dtype=np.int32), scores[:0]
+
+        # Partition, then widen to every item tied with the
+        # k-th score so that ties are broken deterministically.
+        threshold = np.partition(-scores, k - 1)[k - 1]
+        candidates = np.flatnonzero(-scores <= threshold)
+        candidates = candidates[np.lexsort((candidates,
+                                            -scores[candidates]))][:k]
+
+        return candidates.astype(np.int32), scores[candidates]
+
+
+# Items per block of the pruned top-k scan.
+PRUNING_BLOCK_SIZE = 256
+
+
+def _round_up(values):
+    """
+    Convert to np.float32, rounding up.
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    rounded = values.astype(np.float32)
+
+    return np.where(rounded < values,
+                    np.nextafter(rounded, np.float32(np.inf)),
+                    rounded).astype(np.float32)
+
+
+class _PruningIndex:
+    """
+    Items sorted by descending norm plus bias and split into blocks,
+    with the largest norm and bias of every block and all blocks after
+    it: upper bounds on what any remaining item can contribute to a
+    score. Also counts the items scored by pruned queries.
+    """
+
+    def __init__(self, item_vectors, item_biases,
+                 block_size=PRUNING_BLOCK_SIZE, chunk_size=2 ** 16):
+
+        num_items = len(item_vectors)
+
+        norms = np.empty(num_items, dtype=np.float64)
+
+        for start in range(0, num_items, chunk_size):
+            chunk = item_vectors[start:start + chunk_size].astype(np.float64)
+            norms[start:start + chunk_size] = np.sqrt((chunk ** 2).sum(axis=1))
+
+        self.order = np.argsort(-(norms + item_biases),
+                                kind='stable').astype(np.int32)
+        self.block_size = block_size
+
+        starts = np.arange(0, num_items, block_size)
+        block_norms = np.maximum.reduceat(norms[self.order], starts)
+        block_biases = np.maximum.reduceat(
+            item_biases[self.order].astype(np.float64), starts)
+
+        self.block_norms = _round_up(
+            np.maximum.accumulate(block_norms[::-1])[::-1])
+        self.block_biases = _round_up(
+            np.maximum.accumulate(block_biases[::-1])[::-1])
+
+        self.num_scored = 0
+        self.num_candidates = 0
+
+    @property
+    def nbytes(self):
+
+        return (self.order.nbytes +
+                self.block_norms.nbytes +
+                self.block_biases.nbytes)
+
+
+class Scorer(_NativeScorer):
+
+    # Names under which calls are instrumented.
+    _PREDICT_OPERATION = 'scorer.predict'
+    _RANK_OPERATION = 'scorer.rank_of'
+
+    _STATE = ('user_vectors', 'user_biases', 'item_vectors', 'item_biases')
+    _ITEM_STATE = ('item_vectors', 'item_biases')
+
+    def __init__(self,
+                 user_vectors,
+                 user_biases,
+                 item_vectors,
+                 item_biases):
+
+        if isinstance(user_vectors, np.ndarray):
+            user_vectors = align(user_vectors)
+
+        self._user_vectors = user_vectors
+        self._user_biases = align(user_biases)
+        self._item_vectors = align(item_vectors)
+        self._item_biases = align(item_biases)
+
+        self._pruning_index = None
+
+        self._lib = get_lib()
+
+    def _parameters(self):
+
+        return (self._user_vectors,
+                self._item_vectors,
+                self._user_biases,
+                self._item_biases)
+
+    def update_items(self, item_ids, item_vectors, item_biases):
+        """
+        Replace the representations of existing items in place,
+        and increment the scorer's `version`.
+
+        Arguments
+        ---------
+
+        item_ids: np.int32 array of shape [n_updated,]
+        item_vectors: np.float32 array of shape [n_updated, latent_dim]
+        item_biases: np.float32 array of shape [n_updated,]
+        """
+
+        item_ids = np.asarray(item_ids, dtype=np.int64)
+
+        self._item_vectors[item_ids] = item_vectors
+        self._item_biases[item_ids] = item_biases
+
+        # Rebuilt from the new norms by the next pruned query.
+        self._pruning_index = None
+        self.version += 1
+
+    def _get_pruning_index(self):
+
+        # Scorers built from shared state start without an index.
+        if getattr(self, '_pruning_index', None) is None:
+            self._pruning_index = _PruningIndex(self._item_vectors,
+                                                self._item_biases)
+
+        return self._pruning_index
+
+    @property
+    def pruning_rate(self):
+        """
+        The fraction of candidate items that pruned top-k
+        queries have skipped without scoring them.
+        """
+
+        index = getattr(self, '_pruning_index', None)
+
+        if index is None or not index.num_candidates:
+            return 0.0
+
+        return 1.0 - index.num_scored / index.num_candidates
+
+    def top_k(self, user_id, k, exclude=None, prune=False):
+        """
+        Return the `k` highest-scoring items for a user.
+
+        Arguments
+        ---------
+
+        user_id: int
+        k: int
+        exclude: np.int32 array, optional
+             Items that must not be returned, such as training items.
+        prune: bool, optional
+             Visit items in blocks of descending norm plus bias, and
+             stop once no remaining item can reach the k-th score.
+             Results are exactly those of a full scan. The index
+             ordering the items is built on the first pruned query;
+             see `pruning_rate` for the fraction of items skipped.
+
+        Returns
+        -------
+
+        (item_ids, scores): tuple of arrays of shape [min(k, n_items),]
+             Ordered by descending score; ties are broken
+             by ascending item id.
+        """
+
+        if not prune:
+            return super().top_k(user_id, k, exclude)
+
+        if exclude is None:
+            exclude = np.array([], dtype=np.int32)
+        else:
+            exclude = np.unique(exclude).astype(np.int32)
+
+        k = min(k, self.num_items - len(exclude))
+
+        if k <= 0:
+            return (np.array([], dtype=np.int32),
+                    np.array([], dtype=np.float32))
+
+        index = self._get_pruning_index()
+        user_vector = align(self._user_vectors[user_id])
+
+        item_ids, scores, num_scored = self._lib.top_k_float_256(
+            user_vector,
+            self._item_vectors,
+            self._user_biases[user_id],
+            self._item_biases,
+            index.order,
+            index.block_norms,
+            index.block_biases,
+            index.block_size,
+            _round_up(np.linalg.norm(user_vector.astype(np.float64))),
+            k,
+            exclude)
+
+        index.num_scored += num_scored
+        index.num_candidates += self.num_items - len(exclude)
+
+        order = np.lexsort((item_ids, -scores))
+
+        return item_ids[order], scores[order]
+
+    def predict(self, user_id, item_ids=None):
+
+        record = instrumentation.recorder(self._PREDICT_OPERATION)
+
+        if item_ids is None:
+            item_ids = slice(0, None, None)
+
+        user_vector = align(self._user_vectors[user_id])
+        item_vectors = align(self._item_vectors[item_ids])
+        item_biases = align(self._item_biases[item_ids])
+        record('align', lambda: _gathered_bytes(
+            item_ids, user_vector, item_vectors, item_biases))
+
+        out = self._lib.predict_float_256(user_vector,
+                                          item_vectors,
+                                          self._user_biases[user_id],
+                                          item_biases)
+        record('native')
+        record.finish()
+
+        return out
+
+    def _rank(self, user_id, target_item_ids, exclude):
+
+        return self._lib.rank_float_256(
+            align(self._user_vectors[user_id]),
+            self._item_vectors,
+            self._user_biases[user_id],
+            self._item_biases,
+            target_item_ids,
+            exclude)
+
+    def _predict_bench(self, user_id, out):
+
+        return self._lib.predict_float_256(
+            align(self._user_vectors[user_id]),
+            self._item_vectors,
+            self._user_biases[user_id],
+            self._item_biases,
+            out)
+
+
+class XNORScorer(_NativeScorer):
+    """
+    Score with binarized representations.
+
+    With one bit, vectors are replaced by their signs and a per-row
+    norm, and scored with XNOR-popcount. With `bits` > 1, they are
+    encoded as sums of `bits` scaled sign planes (see
+    `binarize_residuals`), and a pair of vectors is scored by
+    combining the XNOR-popcount products of every pair of planes.
+
+    Parameters
+    ----------
+
+    user_vectors: np.float32 array of shape [n_users, latent_dim]
+    user_biases: np.float32 array of shape [n_users]
+    item_vectors: np.float32 array of shape [n_items, latent_dim]
+    item_biases: np.float32 array of shape [n_items]
+    bits: int, optional
+        Number of sign planes per vector. With more than one,
+        latent_dim must be a multiple of 32.
+    """
+
+    _PREDICT_OPERATION = 'xnor_scorer.predict'
+    _RANK_OPERATION = 'xnor_scorer.rank_of'
+
+    _STATE = ('user_norms', 'item_norms',
+              'user_vectors', 'user_biases',
+              'item_vectors', 'item_biases')
+    _ITEM_STATE = ('item_norms', 'item_vectors', 'item_biases')
+
+    def __init__(self,
+                 user_vectors,
+                 user_biases,
+                 item_vectors,
+                 item_biases,
+                 bits=1):
+
+        assert item_vectors.shape[1] >= 32
+
+        if bits == 1:
+            self._user_norms = align(np.abs(user_vectors).mean(axis=1))
+            self._item_norms = align(np.abs(item_vectors).mean(axis=1))
+
+            self._user_vectors = align(binarize_array(user_vectors))
+            self._item_vectors = align(binarize_array(item_vectors))
+        else:
+            user_vectors, user_norms = binarize_residuals(user_vectors, bits)
+            item_vectors, item_norms = binarize_residuals(item_vectors, bits)
+
+            self._user_norms = align(user_norms)
+            self._item_norms = align(item_norms)
+
+            self._user_vectors = align(user_vectors)
+            self._item_vectors = align(item_vectors)
+
+        self._user_biases = align(user_biases)
+        self._item_biases = align(item_biases)
+
+        self._lib = get_lib()
+
+    @property
+    def bits(self):
+
+        # Multi-bit planes are stored as [n_rows, bits, n_bytes].
+        return 1 if self._item_vectors.ndim == 2 else self._item_vectors.shape[1]
+
+    def _parameters(self):
+
+        return (self._user_norms,
+                self._item_norms,
+                self._user_vectors,
+                self._item_vectors,
+                self._user_biases,
+                self._item_biases)
+
+    def _score(self, *args):
+
+        if self.bits == 1:
+            return self._lib.predict_xnor_256(*args)
+        else:
+            return self._lib.predict_xnor_residual(*args)
+
+    def predict(self, user_id, item_ids=None):
+
+        record = instrumentation.recorder(self._PREDICT_OPERATION)
+
+        if item_ids is None:
+            item_ids = slice(0, None, None)
+
+        user_vector = align(self._user_vectors[user_id])
+        item_vectors = align(self._item_vectors[item_ids])
+        item_biases = align(self._item_biases[item_ids])
+        item_norms = align(self._item_norms[item_ids])
+        record('align', lambda: _gathered_bytes(
+            item_ids, user_vector, item_vectors, item_biases, item_norms))
+
+        out = self._score(user_vector,
+                          item_vectors,
+                          self._user_biases[user_id],
+                          item_biases,
+                          self._user_norms[user_id],
+                          item_norms)
+        record('native')
+        record.finish()
+
+        return out
+
+    def _rank(self, user_id, target_item_ids, exclude):
+
+        if self.bits > 1:
+            return _ranks_from_scores(self.predict(user_id),
+                                      target_item_ids, exclude)
+
+        return self._lib.rank_xnor_256(
+            align(self._user_vectors[user_id]),
+            self._item_vectors,
+            self._user_biases[user_id],
+            self._item_biases,
+            self._user_norms[user_id],
+            self._item_norms,
+            target_item_ids,
+            exclude)
+
+    def _predict_bench(self, user_id, out):
+
+        return self._score(
+            align(self._user_vectors[user_id]),
+            self._item_vectors,
+            self._user_biases[user_id],
+            self._item_biases,
+            self._user_norms[user_id],
+            self._item_norms,
+            out)
+
+
+def _quantize_lut(lut):
+    """
+    Quantize a float lookup table to 8 bits with a scale shared by all
+    subspaces, so that sums of entries can be rescaled at once.
+
+    Returns the table, padded to an even number of subspaces,
+    the scale, and the offset to add to rescaled sums.
+    """
+
+    minimums = lut.min(axis=1)
+    lut = lut - minimums[:, np.newaxis]
+
+    scale = float(lut.max()) / 255.0 or 1.0
+
+    quantized = np.zeros((len(lut) + len(lut) % 2, lut.shape[1]),
+                         dtype=np.uint8)
+    quantized[:len(lut)] = np.rint(lut / scale)
+
+    return quantized, scale, float(minimums.sum())
+
+
+class PQScorer(_NativeScorer):
+    """
+    Score with product-quantized item representations.
+
+    Item biases are folded into the item vectors, which are then
+    product-quantized into 4- or 8-bit codes per subspace. Every query
+    builds a lookup table of the user's inner products with every
+    centroid, and an item is scored by summing the entries its codes
+    select. With 4-bit codes, the table is quantized to 8 bits and
+    scanned with in-register shuffles, 32 items at a time.
+
+    Parameters
+    ----------
+
+    user_vectors: np.float32 array of shape [n_users, latent_dim]
+    user_biases: np.float32 array of shape [n_users]
+    item_vectors: np.float32 array of shape [n_items, latent_dim]
+    item_biases: np.float32 array of shape [n_items]
+    num_subspaces: int, optional
+        Defaults to a quarter of the latent dimension. At
+        most 256 for 4-bit codes.
+    bits: int, optional
+        Bits per code: 4 or 8.
+    num_iterations: int, optional
+        Number of k-means iterations used to train the codebooks.
+    random_seed: int, optional
+    """
+
+    _PREDICT_OPERATION = 'pq_scorer.predict'
+    _RANK_OPERATION = 'pq_scorer.rank_of'
+
+    _STATE = ('user_vectors', 'user_biases',
+              'codebooks', 'codes', 'item_count')
+    _ITEM_STATE = ('codes',)
+
+    def __init__(self,
+                 user_vectors,
+                 user_biases,
+                 item_vectors,
+                 item_biases,
+                 num_subspaces=None,
+                 bits=8,
+                 num_iterations=10,
+                 random_seed=None):
+
+        if bits not in (4, 8):
+            raise ValueError('PQ codes must have 4 or 8 bits.')
+
+        if num_subspaces is None:
+            num_subspaces = max(item_vectors.shape[1] // 4, 1)
+
+        if bits == 4 and num_subspaces > 256:
+            raise ValueError('4-bit codes support at most 256 subspaces.')
+
+        # Scores are inner products of [user_vector, 1]
+        # and [item_vector, item_bias].
+        item_vectors = np.hstack([item_vectors,
+                                  item_biases[:, np.newaxis]])
+
+        codebooks = train_codebooks(item_vectors,
+                                    num_subspaces,
+                                    num_centroids=2 ** bits,
+                                    num_iterations=num_iterations,
+                                    random_state=np.random.RandomState(
+                                        random_seed))
+        codes = encode(item_vectors, codebooks)
+
+        if isinstance(user_vectors, np.ndarray):
+            user_vectors = align(user_vectors)
+
+        self._user_vectors = user_vectors
+        self._user_biases = align(user_biases)
+        self._codebooks = align(codebooks)
+        self._codes = align(pack_codes(codes) if bits == 4 else codes)
+        self._item_count = np.array(len(item_vectors), dtype=np.int64)
+
+        self._lib = get_lib()
+
+    @property
+    def bits(self):
+
+        return 4 if self._codebooks.shape[1] == 16 else 8
+
+    @property
+    def num_items(self):
+
+        return int(self._item_count)
+
+    def _parameters(self):
+
+        return (self._user_vectors,
+                self._user_biases,
+                self._codebooks,
+                self._codes)
+
+    def _lut(self, user_id):
+
+        query = pad_subspaces(
+            np.append(self._user_vectors[user_id], 1.0)[np.newaxis, :]
+            .astype(np.float32),
+            len(self._codebooks))
+
+        return np.einsum('mkd,md->mk', self._codebooks,
+                         query.reshape(len(self._codebooks), -1))
+
+    def predict(self, user_id, item_ids=None, out=None):
+
+        record = instrumentation.recorder(self._PREDICT_OPERATION)
+
+        lut = self._lut(user_id)
+        user_bias = self._user_biases[user_id]
+        record('lut', lut.nbytes)
+
+        if self.bits == 8:
+            codes = (self._codes if item_ids is None
+                     else self._codes[item_ids])
+            record('align', 0 if item_ids is None else codes.nbytes)
+
+            out = self._lib.predict_pq8(lut, codes, user_bias, out)
+        else:
+            lut, scale, offset = _quantize_lut(lut)
+
+            if item_ids is None:
+                codes, num_items = self._codes, self.num_items
+            else:
+                codes = pack_codes(unpack_codes(self._codes, item_ids))
+                num_items = len(item_ids)
+            record('align', 0 if item_ids is None else codes.nbytes)
+
+            out = self._lib.predict_pq4(lut, codes, scale,
+                                        offset + user_bias,
+                                        num_items, out)
+
+        record('native')
+        record.finish()
+
+        return out
+
+    def _rank(self, user_id, target_item_ids, exclude):
+
+        return _ranks_from_scores(self.predict(user_id),
+                                  target_item_ids, exclude)
+
+    def _predict_bench(self, user_id, out):
+
+        return self.predict(user_id, out=out)
+
+
+class ScoringPool:
+    """
+    Threads serving queries from a scorer, pinned to NUMA nodes.
+
+    Every NUMA node with CPUs runs `threads_per_node` threads pinned
+    to its CPUs. With `replicate` on a host with several nodes, every
+    node scores from its own copy of the item arrays, bound to its
+    memory, at the cost of one copy per node; otherwise, all threads
+    share one copy. Queries are dispatched to nodes in turn, and cffi
+    releases the GIL during kernel calls, so threads score concurrently.
+
+    Parameters
+    ----------
+
+    scorer: Scorer, XNORScorer or PQScorer
+    threads_per_node: int, optional
+        Defaults to the number of CPUs of every node.
+    replicate: bool, optional
+        Give every node its own copy of the item arrays.
+    huge_pages: bool, optional
+        Back the item arrays with transparent huge pages.
+    """
+
+    def __init__(self,
+                 scorer,
+                 threads_per_node=None,
+                 replicate=True,
+                 huge_pages=True):
+
+        nodes = numa_nodes()
+        replicate = replicate and len(nodes) > 1
+
+        if huge_pages and not replicate:
+            scorer = scorer.place(huge_pages=True)
+
+        self._scorers = {}
+        self._executors = {}
+
+        for node, cpus in nodes.items():
+            self._scorers[node] = (scorer.place(huge_pages=huge_pages,
+                                                node=node)
+                                   if replicate else scorer)
+            self._executors[node] = concurrent.futures.ThreadPoolExecutor(
+                threads_per_node or len(cpus),
+                initializer=pin_to_node,
+                initargs=(node,))
+
+        self._nodes = itertools.cycle(nodes)
+
+    def submit(self, method, *args, **kwargs):
+        """
+        Call the scorer method named `method`, such as 'top_k', on
+        the threads of the next node, returning a
+        `concurrent.futures.Future` of its result.
+        """
+
+        node = next(self._nodes)
+
+        return self._executors[node].submit(
+            getattr(self._scorers[node], method), *args, **kwargs)
+
+    def map(self, method, *iterables):
+        """
+        Call `method` with arguments taken from every iterable in
+        turn, returning the list of results in order.
+        """
+
+        futures = [self.submit(method, *args) for args in zip(*iterables)]
+
+        return [future.result() for future in futures]
+
+    def close(self):
+
+        for executor in self._executors.values():
+            executor.shutdown()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc_info):
+
+        self.close()
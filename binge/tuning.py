@@ -0,0 +1,299 @@
+"""
+Autotuning of the native scoring kernels.
+
+`predict.c` holds variants of the float scoring kernel that differ in
+their number of accumulators, item unrolling and prefetch distance.
+The fastest depends on the latent dimension, the catalog size and the
+CPU, so variants are timed on the arrays being scored and the winners
+are persisted in a per-host profile: a JSON file at `profile_path()`,
+by default ~/.cache/binge/tuning-<hostname>.json, or
+`$BINGE_TUNING_PROFILE`.
+
+Scoring uses the profile's winner for the shape of the catalog, with
+one winner per latent dimension and power-of-two range of catalog
+sizes (see `shape_key`). Full scans, ranking and pruned top-k all
+score with the selected variant, so that their scores agree exactly.
+
+Shapes without a winner use the reference kernel, unless autotuning
+is enabled (with `enable`, or by setting `$BINGE_AUTOTUNE=1`), in
+which case variants are timed on the first call with that shape and
+the profile is updated. `tune_shape` (and `binge_bench tune`) tune
+shapes ahead of time.
+
+A profile records the CPU it was tuned on, and is ignored on others.
+"""
+
+import json
+import os
+import platform
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+
+KERNEL = 'predict_float_256'
+
+# Variant 0 of every kernel is the reference implementation.
+REFERENCE_VARIANT = 0
+
+
+def profile_path():
+
+    return (os.environ.get('BINGE_TUNING_PROFILE') or
+            os.path.join(os.path.expanduser('~'), '.cache', 'binge',
+                         'tuning-{}.json'.format(platform.node())))
+
+
+def _cpu_model():
+
+    try:
+        with open('/proc/cpuinfo') as cpuinfo:
+            for line in cpuinfo:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+
+    return platform.processor() or platform.machine()
+
+
+def shape_key(num_items, latent_dim):
+
+    return '{}:{}'.format(latent_dim, int(num_items).bit_length())
+
+
+class _Profile:
+
+    def __init__(self, path):
+
+        self.path = path
+        self.cpu = _cpu_model()
+        self.winners = {}
+
+        try:
+            with open(path) as profile_file:
+                data = json.load(profile_file)
+        except (OSError, ValueError):
+            return
+
+        if data.get('cpu') == self.cpu:
+            self.winners = data.get('kernels', {})
+
+    def get(self, kernel, key):
+
+        winner = self.winners.get(kernel, {}).get(key)
+
+        return None if winner is None else tuple(winner['config'])
+
+    def set(self, kernel, key, config, seconds):
+
+        self.winners.setdefault(kernel, {})[key] = {
+            'config': list(config),
+            'seconds': seconds}
+
+    def save(self):
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+
+        # Written atomically, as processes may tune concurrently.
+        fd, temporary_path = tempfile.mkstemp(dir=directory)
+
+        with os.fdopen(fd, 'w') as profile_file:
+            json.dump({'cpu': self.cpu, 'kernels': self.winners},
+                      profile_file, indent=2, sort_keys=True)
+
+        os.replace(temporary_path, self.path)
+
+
+class _Tuner:
+
+    def __init__(self):
+
+        self.enabled = os.environ.get('BINGE_AUTOTUNE', '') == '1'
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+
+        self.profile = None
+        # Shape keys to selected variants.
+        self.selected = {}
+
+    def get_profile(self):
+
+        if self.profile is None:
+            self.profile = _Profile(profile_path())
+
+        return self.profile
+
+
+_tuner = _Tuner()
+
+
+def enable():
+    """
+    Time kernel variants on the first call with every
+    untuned shape, and persist the winners.
+    """
+
+    _tuner.enabled = True
+
+
+def disable():
+
+    _tuner.enabled = False
+
+
+def is_enabled():
+
+    return _tuner.enabled
+
+
+def reset():
+    """
+    Forget the loaded profile and the variants selected so far,
+    so that the profile is reloaded from `profile_path()`.
+    """
+
+    with _tuner.lock:
+        _tuner.reset()
+
+
+def float_variants(extension):
+    """
+    Return the configurations of the variants of the float
+    kernel, as tuples of (accumulators, unroll, prefetch).
+    """
+
+    lib = extension._lib
+    config = extension._ffi.new('intptr_t[3]')
+
+    configs = []
+
+    for variant in range(lib.num_float_variants()):
+        lib.float_variant_config(variant, config)
+        configs.append(tuple(config))
+
+    return configs
+
+
+def time_float_variants(extension, args, min_seconds=0.05, min_repeats=3):
+    """
+    Time every variant of the float kernel on the cast arguments of
+    `predict_float_variant` (without the variant), returning the
+    fastest time of every variant in seconds.
+    """
+
+    predict = extension._lib.predict_float_variant
+
+    timings = []
+
+    for variant in range(extension._lib.num_float_variants()):
+        # Warm up caches and branch predictors.
+        predict(variant, *args)
+
+        durations = []
+        start = time.perf_counter()
+
+        while (len(durations) < min_repeats or
+               time.perf_counter() - start < min_seconds):
+            call_start = time.perf_counter()
+            predict(variant, *args)
+            durations.append(time.perf_counter() - call_start)
+
+        timings.append(min(durations))
+
+    return timings
+
+
+def _tune(extension, args, key):
+
+    timings = time_float_variants(extension, args)
+    winner = int(np.argmin(timings))
+
+    profile = _tuner.get_profile()
+    profile.set(KERNEL, key, float_variants(extension)[winner],
+                timings[winner])
+    profile.save()
+
+    return winner, timings
+
+
+def selected_float_variant(num_items, latent_dim):
+    """
+    Return the variant of the float kernel selected for a catalog
+    shape, or None if no call has selected one yet.
+    """
+
+    return _tuner.selected.get(shape_key(num_items, latent_dim))
+
+
+def float_variant(extension, args):
+    """
+    Return the variant of the float kernel to call with the cast
+    arguments `args` of `predict_float_variant`, tuning it first
+    if autotuning is enabled and its shape has no winner yet.
+    """
+
+    key = shape_key(*args[-2:])
+
+    variant = _tuner.selected.get(key)
+
+    if variant is not None:
+        return variant
+
+    with _tuner.lock:
+        config = _tuner.get_profile().get(KERNEL, key)
+        configs = float_variants(extension)
+
+        if config in configs:
+            variant = configs.index(config)
+        elif _tuner.enabled:
+            variant, _ = _tune(extension, args, key)
+        else:
+            variant = REFERENCE_VARIANT
+
+        _tuner.selected[key] = variant
+
+    return variant
+
+
+def tune_shape(num_items, latent_dim, random_seed=None):
+    """
+    Tune the float kernel for a catalog shape on random
+    arrays, and persist the winner.
+
+    Returns
+    -------
+
+    timings: dict of variant configurations to their fastest
+             time in seconds.
+    """
+
+    from binge.memory import place
+    from binge.native import get_lib
+
+    extension = get_lib()
+    random_state = np.random.RandomState(random_seed)
+
+    user_vector = place(random_state.standard_normal(latent_dim)
+                        .astype(np.float32), huge_pages=False)
+    item_vectors = place(random_state.standard_normal(
+        (num_items, latent_dim)).astype(np.float32), huge_pages=False)
+    item_biases = random_state.standard_normal(num_items).astype(np.float32)
+    out = np.empty(num_items, dtype=np.float32)
+
+    cast = extension._cast
+    args = (cast(user_vector), cast(item_vectors), 0.0,
+            cast(item_biases), cast(out), num_items, latent_dim)
+
+    key = shape_key(num_items, latent_dim)
+
+    with _tuner.lock:
+        winner, timings = _tune(extension, args, key)
+        _tuner.selected[key] = winner
+
+    return dict(zip(float_variants(extension), timings))
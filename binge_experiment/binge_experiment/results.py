@@ -1,90 +1,340 @@
 from datetime import datetime
+import json
 import sqlite3
+import time
 
 import pandas as pd
 
 
+HYPERPARAMETERS = ('loss', 'embedding_dim', 'n_iter', 'batch_size',
+                   'l2', 'learning_rate', 'use_cuda', 'xnor')
+
+# Hyperparameters added after the first databases were written,
+# with the values that results without them were fitted with.
+LATER_HYPERPARAMETERS = {'xnor_bits': 1,
+                         'compact_embeddings': None,
+                         'num_buckets': None}
+
+# Seconds a connection waits on a lock before raising.
+LOCK_TIMEOUT = 30.0
+NUM_RETRIES = 5
+
+
+def _with_later_hyperparameters(hyperparameters):
+
+    data = dict(LATER_HYPERPARAMETERS)
+    data.update(hyperparameters)
+
+    return data
+
+
+def _key(hyperparameters):
+    """
+    The identity of a combination: the JSON of its hyperparameters.
+    """
+
+    names = HYPERPARAMETERS + tuple(sorted(LATER_HYPERPARAMETERS))
+
+    # SQLite returns booleans as integers.
+    return json.dumps([int(value) if isinstance(value, bool) else value
+                       for value in (hyperparameters[name]
+                                     for name in names)])
+
+
 class Results:
+    """
+    A SQLite-backed store of search and benchmark results.
+
+    The database is in write-ahead-logging mode so that several
+    processes can write to it concurrently, and every hyperparameter
+    combination is stored at most once: saving a combination that
+    is already present is a no-op.
+
+    Results saved before combinations were made unique are kept as
+    they are, duplicates included, until `deduplicate` is run.
+    """
 
     def __init__(self, fname):
 
         self._fname = fname
         self._conn = sqlite3.connect(fname,
+                                     timeout=LOCK_TIMEOUT,
                                      detect_types=sqlite3.PARSE_DECLTYPES)
         self._conn.row_factory = sqlite3.Row
 
+        self._execute('PRAGMA journal_mode=WAL')
+
         self._setup()
 
+    def _execute(self, query, parameters=()):
+        """
+        Execute and commit a statement, retrying with backoff
+        if the database stays locked by other writers.
+        """
+
+        for attempt in range(NUM_RETRIES):
+            try:
+                cur = self._conn.cursor()
+                cur.execute(query, parameters)
+                self._conn.commit()
+
+                return cur
+            except sqlite3.OperationalError as e:
+                if ('locked' not in str(e) and 'busy' not in str(e)
+                        or attempt == NUM_RETRIES - 1):
+                    raise
+
+                self._conn.rollback()
+                time.sleep(0.1 * 2 ** attempt)
+
     def _setup(self):
 
+        self._execute('CREATE TABLE IF NOT EXISTS results '
+                      '(loss TEXT, '
+                      'embedding_dim INTEGER, '
+                      'n_iter INTEGER, '
+                      'batch_size INTEGER, '
+                      'l2 REAL, '
+                      'learning_rate REAL, '
+                      'use_cuda BOOLEAN, '
+                      'xnor BOOLEAN, '
+                      'mean_mrr REAL, '
+                      'time TIMESTAMP, '
+                      'xnor_bits INTEGER, '
+                      'compact_embeddings TEXT, '
+                      'num_buckets INTEGER, '
+                      'key TEXT) ')
+
+        # Columns added to older databases hold NULL.
+        columns = [row['name'] for row in
+                   self._execute('PRAGMA table_info(results)').fetchall()]
+
+        for column, column_type in (('xnor_bits', 'INTEGER'),
+                                    ('compact_embeddings', 'TEXT'),
+                                    ('num_buckets', 'INTEGER'),
+                                    ('key', 'TEXT')):
+            if column not in columns:
+                self._execute('ALTER TABLE results ADD COLUMN {} {}'
+                              .format(column, column_type))
+
+        self._execute('CREATE TABLE IF NOT EXISTS benchmark '
+                      '(embedding_dim INTEGER, '
+                      'xnor BOOLEAN, '
+                      'duration REAL, '
+                      'memory INTEGER, '
+                      'time TIMESTAMP)')
+
+        # Older rows have no key, and may hold duplicates.
+        self._execute('CREATE UNIQUE INDEX IF NOT EXISTS '
+                      'results_key ON results (key) '
+                      'WHERE key IS NOT NULL')
+
+        # Intermediate scores of multi-fidelity searches.
+        self._execute('CREATE TABLE IF NOT EXISTS rungs '
+                      '(trial TEXT, '
+                      'embedding_dim INTEGER, '
+                      'xnor BOOLEAN, '
+                      'hyperparameters TEXT, '
+                      'rung INTEGER, '
+                      'n_iter INTEGER, '
+                      'mean_mrr REAL, '
+                      'time TIMESTAMP, '
+                      'UNIQUE (trial, rung))')
+
+        self._execute('CREATE TABLE IF NOT EXISTS kernel_benchmark '
+                      '(run TEXT, '
+                      'kernel TEXT, '
+                      'embedding_dim INTEGER, '
+                      'num_items INTEGER, '
+                      'batch_size INTEGER, '
+                      'num_threads INTEGER, '
+                      'p50 REAL, '
+                      'p99 REAL, '
+                      'throughput REAL, '
+                      'bandwidth REAL, '
+                      'machine TEXT, '
+                      'time TIMESTAMP)')
+
+    def deduplicate(self):
+        """
+        Migrate results saved before combinations were made unique.
+        The first unkeyed result of every combination is given its
+        key, and is deleted instead if the combination already has a
+        keyed result; later duplicates are deleted. Returns the
+        number of deleted rows.
+
+        This deletes data, so it is only ever run explicitly.
+        """
+
         cur = self._conn.cursor()
+        cur.execute('SELECT rowid, * FROM results WHERE key IS NULL')
+        legacy = cur.fetchall()
+
+        cur.execute('SELECT key FROM results WHERE key IS NOT NULL')
+        keys = set(row['key'] for row in cur.fetchall())
+
+        deleted = 0
 
-        cur.execute('CREATE TABLE IF NOT EXISTS results '
-                    '(loss TEXT, '
-                    'embedding_dim INTEGER, '
-                    'n_iter INTEGER, '
-                    'batch_size INTEGER, '
-                    'l2 REAL, '
-                    'learning_rate REAL, '
-                    'use_cuda BOOLEAN, '
-                    'xnor BOOLEAN, '
-                    'mean_mrr REAL, '
-                    'time TIMESTAMP) ')
-        cur.execute('CREATE TABLE IF NOT EXISTS benchmark '
-                    '(embedding_dim INTEGER, '
-                    'xnor BOOLEAN, '
-                    'duration REAL, '
-                    'memory INTEGER, '
-                    'time TIMESTAMP)')
+        for row in sorted(legacy, key=lambda x: x['rowid']):
+            hyperparameters = {name: row[name] for name in HYPERPARAMETERS}
+            hyperparameters.update(LATER_HYPERPARAMETERS)
+            key = _key(hyperparameters)
+
+            if key in keys:
+                self._execute('DELETE FROM results WHERE rowid = ?',
+                              (row['rowid'],))
+                deleted += 1
+            else:
+                self._execute('UPDATE results SET xnor_bits = :xnor_bits, '
+                              'key = :key WHERE rowid = :rowid',
+                              {'xnor_bits': hyperparameters['xnor_bits'],
+                               'key': key,
+                               'rowid': row['rowid']})
+                keys.add(key)
+
+        return deleted
 
     def save(self, hyperparameters, mrrs):
+        """
+        Save the result of a hyperparameter combination, returning
+        False if it had already been saved.
+        """
 
-        data = hyperparameters.copy()
+        data = _with_later_hyperparameters(hyperparameters)
+        data['key'] = _key(data)
         data['mean_mrr'] = mrrs.mean()
         data['time'] = datetime.now()
 
+        cur = self._execute('INSERT OR IGNORE INTO results '
+                            '(loss, embedding_dim, n_iter, batch_size, l2, '
+                            'learning_rate, use_cuda, xnor, mean_mrr, time, '
+                            'xnor_bits, compact_embeddings, num_buckets, key) '
+                            'VALUES (:loss, :embedding_dim, :n_iter, '
+                            ':batch_size, :l2, :learning_rate, :use_cuda, '
+                            ':xnor, :mean_mrr, :time, :xnor_bits, '
+                            ':compact_embeddings, :num_buckets, :key)', data)
+
+        return cur.rowcount > 0
+
+    def save_rung(self, trial, hyperparameters, rung, mean_mrr):
+        """
+        Save the score of a trial of a multi-fidelity search
+        after reaching `rung`.
+        """
+
+        self._execute('INSERT OR IGNORE INTO rungs '
+                      'VALUES (:trial, :embedding_dim, :xnor, '
+                      ':hyperparameters, :rung, :n_iter, :mean_mrr, :time)',
+                      {'trial': trial,
+                       'embedding_dim': hyperparameters['embedding_dim'],
+                       'xnor': hyperparameters['xnor'],
+                       'hyperparameters': json.dumps(hyperparameters,
+                                                     sort_keys=True),
+                       'rung': rung,
+                       'n_iter': hyperparameters['n_iter'],
+                       'mean_mrr': mean_mrr,
+                       'time': datetime.now()})
+
+    def load_rung(self, trial, rung):
+        """
+        Return the score saved for a trial at `rung`, or None.
+        """
+
         cur = self._conn.cursor()
 
-        cur.execute('INSERT INTO results '
-                    'VALUES (:loss, :embedding_dim, :n_iter, '
-                    ':batch_size, :l2, :learning_rate, :use_cuda, :xnor, '
-                    ':mean_mrr, :time)', data)
-        self._conn.commit()
+        cur.execute('SELECT mean_mrr FROM rungs '
+                    'WHERE trial = :trial AND rung = :rung',
+                    {'trial': trial, 'rung': rung})
+
+        row = cur.fetchone()
+
+        return None if row is None else row['mean_mrr']
 
     def save_benchmark(self, embedding_dim, xnor, duration, memory):
 
+        self._execute('INSERT INTO benchmark '
+                      'VALUES (:embedding_dim, '
+                      ':xnor, :duration, :memory, :time)',
+                      {'embedding_dim': embedding_dim,
+                       'xnor': xnor,
+                       'duration': duration,
+                       'memory': memory,
+                       'time': datetime.now()})
+
+    def save_kernel_benchmark(self, run, machine, benchmark):
+        """
+        Save one configuration of a kernel benchmark suite run.
+        `benchmark` holds the configuration, the p50 and p99
+        per-user latency in seconds, and the achieved and
+        machine memory bandwidth in GB/s.
+        """
+
+        data = benchmark.copy()
+        data['run'] = run
+        data['machine'] = json.dumps(machine, sort_keys=True)
+        data['time'] = datetime.now()
+
+        self._execute('INSERT INTO kernel_benchmark '
+                      'VALUES (:run, :kernel, :embedding_dim, :num_items, '
+                      ':batch_size, :num_threads, :p50, :p99, '
+                      ':throughput, :bandwidth, :machine, :time)', data)
+
+    def kernel_benchmark_runs(self):
+        """
+        Return the ids of kernel benchmark runs, oldest first.
+        """
+
         cur = self._conn.cursor()
 
-        cur.execute('INSERT INTO benchmark '
-                    'VALUES (:embedding_dim, '
-                    ':xnor, :duration, :memory, :time)',
-                    {'embedding_dim': embedding_dim,
-                     'xnor': xnor,
-                     'duration': duration,
-                     'memory': memory,
-                     'time': datetime.now()})
+        cur.execute('SELECT run FROM kernel_benchmark '
+                    'GROUP BY run ORDER BY MIN(time)')
 
-        self._conn.commit()
+        return [row['run'] for row in cur.fetchall()]
 
-    def clear_benchmarks(self):
+    def load_kernel_benchmarks(self, run):
 
         cur = self._conn.cursor()
 
-        cur.execute('DELETE FROM benchmark')
+        cur.execute('SELECT * FROM kernel_benchmark WHERE run = :run',
+                    {'run': run})
 
-        self._conn.commit()
+        data = [dict(x) for x in cur.fetchall()]
+
+        if not data:
+            raise Exception('No benchmarks for run {}'.format(run))
+
+        return pd.DataFrame(data)
+
+    def clear_benchmarks(self):
+
+        self._execute('DELETE FROM benchmark')
 
     def __contains__(self, hyperparameters):
 
+        data = _with_later_hyperparameters(hyperparameters)
+        data['key'] = _key(data)
+
         cur = self._conn.cursor()
 
+        cur.execute('SELECT COUNT(*) FROM results WHERE key = :key', data)
+
+        if cur.fetchone()[0]:
+            return True
+
+        if any(data[name] != value for name, value
+               in LATER_HYPERPARAMETERS.items()):
+            return False
+
+        # Rows saved without a key used the defaults of
+        # the later hyperparameters.
         cur.execute('SELECT COUNT(*) FROM results '
-                    'WHERE loss=:loss AND embedding_dim=:embedding_dim '
+                    'WHERE key IS NULL '
+                    'AND loss=:loss AND embedding_dim=:embedding_dim '
                     'AND n_iter=:n_iter AND batch_size=:batch_size '
                     'AND l2=:l2 AND learning_rate=:learning_rate '
-                    'AND use_cuda=:use_cuda AND xnor=:xnor', hyperparameters)
+                    'AND use_cuda=:use_cuda AND xnor=:xnor', data)
 
-        return cur.fetchone()[0]
+        return cur.fetchone()[0] > 0
 
     def load_best(self, embedding_dim, xnor):
 
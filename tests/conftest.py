@@ -0,0 +1,44 @@
+import numpy as np
+
+import pytest
+
+import scipy.sparse as sp
+
+from binge import tuning
+
+
+@pytest.fixture(autouse=True)
+def _tuning_profile(tmp_path, monkeypatch):
+    """
+    Tune into a temporary profile, rather than the
+    developer's own, and start every test untuned.
+    """
+
+    monkeypatch.setenv('BINGE_TUNING_PROFILE',
+                       str(tmp_path / 'tuning.json'))
+    tuning.reset()
+
+    yield
+
+    tuning.reset()
+
+
+@pytest.fixture
+def get_interactions():
+    """
+    Return a factory of random COO interaction matrices
+    with unit ratings, repeated interactions included.
+    """
+
+    def _get_interactions(num_users=100, num_items=50, num_interactions=2000,
+                          random_seed=42):
+
+        random_state = np.random.RandomState(random_seed)
+
+        return sp.coo_matrix(
+            (np.ones(num_interactions, dtype=np.float32),
+             (random_state.randint(0, num_users, num_interactions),
+              random_state.randint(0, num_items, num_interactions))),
+            shape=(num_users, num_items))
+
+    return _get_interactions
@@ -0,0 +1,94 @@
+import numpy as np
+
+import pytest
+
+from binge.cache import ENTRY_OVERHEAD, ResultCache
+from binge.serving import Scorer
+
+
+def _get_scorer(num_users=50, num_items=1000, latent_dim=16):
+
+    random_state = np.random.RandomState(42)
+
+    return Scorer(
+        random_state.normal(size=(num_users, latent_dim)).astype(np.float32),
+        random_state.normal(size=num_users).astype(np.float32),
+        random_state.normal(size=(num_items, latent_dim)).astype(np.float32),
+        random_state.normal(size=num_items).astype(np.float32))
+
+
+def _assert_equal(result, expected):
+
+    for x, y in zip(result, expected):
+        assert np.all(x == y)
+
+
+@pytest.mark.parametrize('policy', ['lru', 'tinylfu'])
+def test_result_cache(policy):
+
+    scorer = _get_scorer()
+    cache = ResultCache(scorer, policy=policy)
+
+    exclude = np.array([5, 3, 9], dtype=np.int32)
+
+    first = cache.top_k(0, 10, exclude=exclude)
+    _assert_equal(first, scorer.top_k(0, 10, exclude=exclude))
+
+    # Excluded items are matched as a set.
+    assert cache.top_k(0, 10, exclude=exclude[::-1]) is first
+    assert cache.top_k(0, 10) is not first
+    assert cache.top_k(0, 5, exclude=exclude) is not first
+    assert cache.hits == 1 and cache.misses == 3
+
+    with pytest.raises(ValueError):
+        first[0][0] = 1
+
+    # Updating items invalidates cached results.
+    random_state = np.random.RandomState(0)
+    item_ids = first[0][:3]
+    scorer.update_items(item_ids,
+                        random_state.normal(size=(3, 16)).astype(np.float32),
+                        np.full(3, -100.0, dtype=np.float32))
+
+    updated = cache.top_k(0, 10, exclude=exclude)
+    _assert_equal(updated, scorer.top_k(0, 10, exclude=exclude))
+    assert not np.any(np.isin(item_ids, updated[0]))
+    _assert_equal(scorer.top_k(0, 10, exclude=exclude, prune=True), updated)
+
+    cache.reload(_get_scorer(latent_dim=8))
+    assert len(cache) == 0
+
+    stats = cache.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 4
+    assert stats['hit_rate'] == pytest.approx(0.2)
+
+
+def test_eviction():
+
+    scorer = _get_scorer(num_users=110)
+
+    entry_bytes = ENTRY_OVERHEAD + 10 * 8
+    max_bytes = 20 * entry_bytes
+
+    caches = {policy: ResultCache(scorer, max_bytes=max_bytes,
+                                  policy=policy, window_fraction=0.1)
+              for policy in ('lru', 'tinylfu')}
+
+    for cache in caches.values():
+        # Heavy users, then a crawl over one-off users.
+        for _ in range(5):
+            for user_id in range(10):
+                cache.top_k(user_id, 10)
+
+        for user_id in range(10, 110):
+            cache.top_k(user_id, 10)
+
+        assert cache.nbytes - (cache._sketch.nbytes if cache._sketch
+                               else 0) <= max_bytes
+
+        for user_id in range(10):
+            cache.top_k(user_id, 10)
+
+    assert caches['lru'].hits == 40
+    assert caches['tinylfu'].hits == 50
+    assert caches['tinylfu'].rejections > 0
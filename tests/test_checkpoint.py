@@ -0,0 +1,38 @@
+import os
+
+import numpy as np
+
+import torch
+
+from binge import FactorizationModel
+
+
+def _get_model(n_iter):
+
+    return FactorizationModel(loss='bpr',
+                              n_iter=n_iter,
+                              batch_size=64,
+                              random_seed=42)
+
+
+def test_resume_is_exact(tmpdir, get_interactions):
+
+    interactions = get_interactions()
+    path = os.path.join(str(tmpdir), 'checkpoint.pt')
+
+    # Weight initialization draws from the global torch generator.
+    torch.manual_seed(42)
+    uninterrupted = _get_model(n_iter=4)
+    uninterrupted.fit(interactions)
+
+    torch.manual_seed(42)
+    interrupted = _get_model(n_iter=2)
+    interrupted.fit(interactions, checkpoint=path)
+
+    resumed = _get_model(n_iter=4)
+    resumed.fit(interactions, resume_from=path)
+
+    expected = uninterrupted._net.state_dict()
+
+    for name, value in resumed._net.state_dict().items():
+        assert np.array_equal(value.numpy(), expected[name].numpy())
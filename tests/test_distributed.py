@@ -0,0 +1,32 @@
+import numpy as np
+
+import pytest
+
+from binge import FactorizationModel
+from binge.distributed import fit_distributed
+
+
+def test_replicas_in_sync(get_interactions):
+
+    interactions = get_interactions()
+
+    model = FactorizationModel(loss='bpr',
+                               n_iter=2,
+                               batch_size=64,
+                               random_seed=42)
+    state_dicts = fit_distributed(model, interactions, num_processes=2)
+
+    for name, value in state_dicts[0].items():
+        assert np.allclose(value, state_dicts[1][name])
+
+    for name, value in model._net.state_dict().items():
+        assert np.allclose(value.numpy(), state_dicts[0][name])
+
+
+
+def test_sparse_rejected(get_interactions):
+
+    model = FactorizationModel(loss='bpr', sparse=True, random_seed=42)
+
+    with pytest.raises(ValueError):
+        fit_distributed(model, get_interactions(), num_processes=2)
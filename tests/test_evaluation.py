@@ -0,0 +1,339 @@
+import warnings
+
+import numpy as np
+
+import scipy.stats as st
+
+from sklearn.metrics import roc_auc_score
+
+from binge.evaluation import auc_score, evaluate, mrr_score, sampled_evaluate
+from binge.models import (FactorizationModel, PopularityModel, Scorer,
+                          XNORScorer)
+
+
+def _get_train_test(get_interactions, num_users, num_items):
+    """
+    Return binary CSR train and test interactions.
+    """
+
+    train, test = (get_interactions(num_users, num_items, 500,
+                                    random_seed=random_seed).tocsr()
+                   for random_seed in (42, 43))
+
+    train.data[:] = 1.0
+    test.data[:] = 1.0
+
+    return train, test
+
+
+class _RandomModel:
+
+    def __init__(self, num_users, num_items, num_distinct=None):
+
+        random_state = np.random.RandomState(42)
+
+        if num_distinct is None:
+            self._scores = random_state.randn(num_users, num_items)
+        else:
+            self._scores = random_state.randint(0, num_distinct,
+                                                (num_users, num_items))
+
+        self._scores = self._scores.astype(np.float32)
+
+    def predict(self, user_id, item_ids=None):
+
+        if item_ids is None:
+            return self._scores[user_id].copy()
+
+        return self._scores[user_id, item_ids]
+
+
+def _reference_mrr_score(model, test, train):
+
+    mrrs = []
+
+    for user_id, row in enumerate(test):
+
+        if not len(row.indices):
+            continue
+
+        predictions = -model.predict(user_id)
+        predictions[train[user_id].indices] = np.finfo(np.float32).max
+
+        mrrs.append((1.0 / st.rankdata(predictions)[row.indices]).mean())
+
+    return np.array(mrrs)
+
+
+def _reference_auc_score(model, test, train):
+
+    aucs = []
+
+    for user_id, row in enumerate(test):
+
+        if not len(row.indices):
+            continue
+
+        # Copy: PopularityModel returns its own popularity array.
+        predictions = model.predict(user_id).copy()
+        predictions[train[user_id].indices] = np.finfo(np.float32).max
+
+        aucs.append(roc_auc_score(np.squeeze(np.array(row.todense())),
+                                  predictions))
+
+    return np.array(aucs)
+
+
+def _get_models(num_users, num_items, train):
+
+    popularity = PopularityModel()
+    popularity.fit(train)
+
+    return (_RandomModel(num_users, num_items),
+            _RandomModel(num_users, num_items, num_distinct=5),
+            popularity)
+
+
+def test_metrics_match_reference(get_interactions):
+
+    num_users, num_items = 100, 50
+
+    train, test = _get_train_test(get_interactions, num_users, num_items)
+
+    for model in _get_models(num_users, num_items, train):
+        for block_size in (1, 7, 256):
+            assert np.allclose(mrr_score(model, test, train,
+                                         block_size=block_size),
+                               _reference_mrr_score(model, test, train))
+            assert np.allclose(auc_score(model, test, train,
+                                         block_size=block_size),
+                               _reference_auc_score(model, test, train))
+
+
+def test_parallel_evaluation(get_interactions):
+
+    num_users, num_items = 100, 64
+
+    train, test = _get_train_test(get_interactions, num_users, num_items)
+
+    random_state = np.random.RandomState(42)
+    scorer = Scorer(random_state.randn(num_users, 32).astype(np.float32),
+                    random_state.randn(num_users).astype(np.float32),
+                    random_state.randn(num_items, 32).astype(np.float32),
+                    random_state.randn(num_items).astype(np.float32))
+
+    popularity = PopularityModel()
+    popularity.fit(train)
+
+    # Fitted models are scored the same way whatever n_jobs is.
+    model = FactorizationModel(loss='bpr', embedding_dim=32,
+                               n_iter=1, random_seed=42)
+    model.fit(train.tocoo())
+
+    for model in (scorer, popularity, model):
+        for metric in (mrr_score, auc_score):
+            assert np.allclose(metric(model, test, train, n_jobs=2),
+                               metric(model, test, train))
+
+        parallel = evaluate(model, test, train, n_jobs=2)
+
+        for name, values in evaluate(model, test, train).items():
+            assert np.allclose(parallel[name], values)
+
+
+class _PredictOnly:
+    """
+    Hide a scorer's `rank_of`, so that evaluation
+    compares its full predictions in numpy instead.
+    """
+
+    def __init__(self, scorer):
+
+        self._scorer = scorer
+
+    def predict(self, user_id):
+
+        return self._scorer.predict(user_id)
+
+
+def test_native_ranks(get_interactions):
+
+    num_users, num_items = 100, 64
+
+    train, test = _get_train_test(get_interactions, num_users, num_items)
+
+    random_state = np.random.RandomState(42)
+
+    # Integer-valued scores are computed exactly by every
+    # code path, and produce plenty of ties.
+    user_vectors = random_state.choice([-1.0, 1.0], (num_users, 64))
+    item_vectors = random_state.choice([-1.0, 1.0], (num_items, 64))
+    user_biases = random_state.randint(0, 3, num_users)
+    item_biases = random_state.randint(0, 3, num_items)
+
+    for scorer_class in (Scorer, XNORScorer):
+        scorer = scorer_class(user_vectors.astype(np.float32),
+                              user_biases.astype(np.float32),
+                              item_vectors.astype(np.float32),
+                              item_biases.astype(np.float32))
+
+        for metric in (mrr_score, auc_score):
+            assert np.allclose(metric(scorer, test, train),
+                               metric(_PredictOnly(scorer), test, train))
+
+        ranks = scorer.rank_of(0, np.arange(num_items))
+        expected = st.rankdata(-scorer.predict(0))
+
+        assert np.allclose(ranks, expected)
+
+
+def _reference_top_k_metrics(model, test, train, k):
+
+    precisions, recalls, ndcgs = [], [], []
+
+    for user_id, row in enumerate(test):
+
+        if not len(row.indices):
+            continue
+
+        predictions = model.predict(user_id).copy()
+        predictions[train[user_id].indices] = -np.finfo(np.float32).max
+
+        top_k = np.argsort(-predictions, kind='stable')[:k]
+        hits = np.isin(top_k, row.indices)
+
+        precisions.append(hits.sum() / k)
+        recalls.append(hits.sum() / len(row.indices))
+
+        discounts = 1.0 / np.log2(np.arange(2, k + 2))
+        ndcgs.append((hits * discounts).sum() /
+                     discounts[:min(len(row.indices), k)].sum())
+
+    return np.array(precisions), np.array(recalls), np.array(ndcgs)
+
+
+def _reference_auc_excluding_train(model, test, train):
+
+    aucs = []
+
+    for user_id, row in enumerate(test):
+
+        candidates = np.setdiff1d(np.arange(test.shape[1]),
+                                  train[user_id].indices)
+        labels = np.isin(candidates, row.indices)
+
+        # AUC is undefined without both positives and negatives.
+        if labels.all() or not labels.any():
+            continue
+
+        aucs.append(roc_auc_score(labels,
+                                  model.predict(user_id)[candidates]))
+
+    return np.array(aucs)
+
+
+def test_evaluate(get_interactions):
+
+    num_users, num_items = 100, 50
+
+    train, test = _get_train_test(get_interactions, num_users, num_items)
+
+    # Continuous scores, so that top-k sets are unambiguous.
+    model = _RandomModel(num_users, num_items)
+
+    for k in (1, 5, 10):
+        results = evaluate(model, test, train, k=k, block_size=7)
+
+        precision, recall, ndcg = _reference_top_k_metrics(model, test,
+                                                           train, k)
+
+        assert np.allclose(results['mrr'], mrr_score(model, test, train))
+        assert np.allclose(results['precision'], precision)
+        assert np.allclose(results['recall'], recall)
+        assert np.allclose(results['ndcg'], ndcg)
+
+    for model in _get_models(num_users, num_items, train):
+        results = evaluate(model, test, train,
+                           metrics=['auc', 'filtered_auc'], block_size=7)
+
+        assert np.allclose(results['auc'], auc_score(model, test, train))
+
+        # Test items that are also training items are
+        # counted neither as positives nor as negatives.
+        filtered_aucs = results['filtered_auc']
+
+        assert np.allclose(filtered_aucs[~np.isnan(filtered_aucs)],
+                           _reference_auc_excluding_train(model, test, train))
+
+
+def test_evaluate_undefined_auc(get_interactions):
+
+    num_users, num_items = 100, 50
+
+    train, test = (interactions.tolil() for interactions
+                   in _get_train_test(get_interactions, num_users, num_items))
+
+    # User 0's test items are all training items, so it has no filtered
+    # AUC, and user 1 has every item in its test set, so it has no AUC.
+    test[0] = train[0]
+    test[1, :] = 1.0
+
+    train, test = train.tocsr(), test.tocsr()
+    model = _RandomModel(num_users, num_items)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        results = evaluate(model, test, train, block_size=7)
+
+    # Every metric has a value, possibly NaN, for every test user.
+    num_test_users = np.count_nonzero(test.getnnz(axis=1))
+    assert all(len(values) == num_test_users for values in results.values())
+
+    assert np.isnan(results['auc'][1])
+    assert np.isnan(results['auc']).sum() == 1
+
+    with np.errstate(invalid='ignore'):
+        assert np.allclose(results['auc'][2:],
+                           auc_score(model, test, train)[2:])
+
+    filtered_aucs = results['filtered_auc']
+    assert np.all(np.isnan(filtered_aucs[:2]))
+    assert not np.isnan(filtered_aucs[2:]).any()
+    assert np.allclose(filtered_aucs[2:],
+                       _reference_auc_excluding_train(model, test, train))
+
+
+def test_sampled_evaluate(get_interactions):
+
+    num_users, num_items = 200, 100
+
+    train, test = _get_train_test(get_interactions, num_users, num_items)
+    test = test - test.multiply(train)
+    test.eliminate_zeros()
+
+    model = _RandomModel(num_users, num_items)
+
+    mrrs = mrr_score(model, test, train)
+    recalls = evaluate(model, test, train, metrics=['recall'], k=10)
+
+    # Sampling every item and every user gives exact results.
+    estimates = sampled_evaluate(model, test, train,
+                                 num_negatives=num_items,
+                                 num_users=num_users,
+                                 random_seed=42)
+
+    assert np.allclose(estimates['mrr'].value, mrrs.mean())
+    assert estimates['mrr'].lower <= mrrs.mean() <= estimates['mrr'].upper
+
+    # Per-user recall@k differs from the top-k recall only in tie handling,
+    # which continuous random scores do not produce.
+    assert np.allclose(estimates['recall'].value, recalls['recall'].mean())
+
+    # Fewer users give wider intervals.
+    subsampled = sampled_evaluate(model, test, train,
+                                  num_negatives=num_items,
+                                  num_users=50,
+                                  random_seed=42)
+
+    assert (subsampled['mrr'].upper - subsampled['mrr'].lower >
+            estimates['mrr'].upper - estimates['mrr'].lower)
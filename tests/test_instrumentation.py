@@ -0,0 +1,86 @@
+import numpy as np
+
+import pytest
+
+from binge import instrumentation
+from binge.models import Scorer, XNORScorer
+
+
+def _get_scorers(num_users=10, num_items=100, latent_dim=64):
+
+    random_state = np.random.RandomState(42)
+
+    representations = (
+        random_state.randn(num_users, latent_dim).astype(np.float32),
+        random_state.randn(num_users).astype(np.float32),
+        random_state.randn(num_items, latent_dim).astype(np.float32),
+        random_state.randn(num_items).astype(np.float32))
+
+    return Scorer(*representations), XNORScorer(*representations)
+
+
+def test_instrumentation():
+
+    scorer, xnor_scorer = _get_scorers()
+
+    instrumentation.reset()
+    scorer.predict(0)
+    assert instrumentation.snapshot() == {}
+
+    def _unexpected_bytes():
+        raise AssertionError('Bytes counted while disabled')
+
+    # Byte counts given as callables are not computed while disabled.
+    instrumentation.recorder('lazy')('phase', _unexpected_bytes)
+
+    instrumentation.enable()
+
+    try:
+        record = instrumentation.recorder('lazy')
+        record('phase', lambda: 42)
+        record.finish()
+
+        for user_id in range(5):
+            scorer.predict(user_id)
+            scorer.predict(user_id, np.arange(10))
+            xnor_scorer.rank_of(user_id, np.arange(3), exclude=[5])
+
+        stats = instrumentation.snapshot()
+        text = instrumentation.prometheus()
+    finally:
+        instrumentation.disable()
+        instrumentation.reset()
+
+    assert stats['lazy']['phase']['bytes'] == 42
+    assert stats['scorer.predict']['align']['count'] == 10
+    assert stats['scorer.predict']['native']['count'] == 10
+    assert stats['xnor_scorer.rank_of']['postprocess']['count'] == 5
+
+    kernel = stats['native.predict_float_256']['kernel']
+    assert sum(kernel['histogram'].values()) == kernel['count'] == 10
+    # Full-catalog calls read the item vectors and biases.
+    assert kernel['bytes'] > 5 * 100 * (64 + 1) * 4
+
+    assert ('binge_phase_seconds_count{operation="scorer.predict",'
+            'phase="native"} 10') in text
+    assert ('binge_phase_seconds_bucket{operation="scorer.predict",'
+            'phase="native",le="+Inf"} 10') in text
+
+
+def test_perf_events():
+
+    scorer, _ = _get_scorers()
+
+    try:
+        instrumentation.enable(perf_events=True)
+    except OSError:
+        pytest.skip('perf events are not available')
+
+    try:
+        scorer.predict(0)
+        stats = instrumentation.snapshot()
+    finally:
+        instrumentation.disable()
+        instrumentation.reset()
+
+    assert stats['native.predict_float_256']['kernel']['cycles'] > 0
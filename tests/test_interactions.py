@@ -0,0 +1,112 @@
+import numpy as np
+
+from binge.data.interactions import IdMapping, load_interactions
+
+
+def _get_log(num_interactions=5000):
+
+    random_state = np.random.RandomState(42)
+
+    return (random_state.randint(0, 2 ** 40, 300)[
+                random_state.randint(0, 300, num_interactions)],
+            random_state.randint(-10 ** 6, 10 ** 6, num_interactions),
+            random_state.randint(1, 6, num_interactions),
+            random_state.randint(0, 10 ** 9, num_interactions))
+
+
+def _reference_mapping(raw_ids):
+
+    mapping = {}
+
+    return np.array([mapping.setdefault(x, len(mapping)) for x in raw_ids])
+
+
+def test_id_mapping(tmpdir):
+
+    raw_ids = _get_log(50000)[1]
+    mapping = IdMapping()
+
+    # Map in chunks, growing the table several times.
+    dense_ids = np.concatenate([mapping.map(raw_ids[i:i + 777])
+                                for i in range(0, len(raw_ids), 777)])
+
+    assert np.all(dense_ids == _reference_mapping(raw_ids))
+    assert np.all(mapping.raw_ids[dense_ids] == raw_ids)
+    assert np.all(mapping.map(np.array([10 ** 7]), insert=False) == -1)
+
+    path = str(tmpdir.join('mapping.npy'))
+    mapping.save(path)
+
+    assert np.all(IdMapping.load(path).map(raw_ids, insert=False) ==
+                  dense_ids)
+
+
+def test_load_interactions(tmpdir):
+
+    users, items, ratings, timestamps = _get_log()
+
+    path = str(tmpdir.join('log.csv'))
+
+    with open(path, 'w') as datafile:
+        datafile.write('user,item,rating,timestamp\n')
+        for row in zip(users, items, ratings, timestamps):
+            datafile.write(','.join(str(x) for x in row) + '\n')
+
+    for split in ('random', 'timestamp'):
+        (train, test, validation), (user_mapping, item_mapping) = (
+            load_interactions(path, skip_header=True, chunk_size=1000,
+                              split=split, random_seed=42))
+
+        assert train.nnz + test.nnz + validation.nnz == len(users)
+        assert test.nnz == validation.nnz == len(users) // 10
+
+        loaded = set()
+
+        for matrix in (train, test, validation):
+            assert matrix.shape == (len(set(users)), len(set(items)))
+
+            loaded |= set(zip(user_mapping.raw_ids[matrix.row],
+                              item_mapping.raw_ids[matrix.col],
+                              matrix.data))
+
+        assert loaded == set(zip(users, items, ratings.astype(np.float32)))
+
+    # The latest interactions are held out.
+    timestamp_of = dict(zip(zip(users, items), timestamps))
+
+    def _timestamps(matrix):
+        return [timestamp_of[pair] for pair in
+                zip(user_mapping.raw_ids[matrix.row],
+                    item_mapping.raw_ids[matrix.col])]
+
+    assert max(_timestamps(train)) <= min(_timestamps(validation))
+    assert max(_timestamps(validation)) <= min(_timestamps(test))
+
+
+def test_load_binary_with_persisted_mapping(tmpdir):
+
+    users, items, ratings, timestamps = _get_log()
+
+    records = np.zeros(len(users), dtype=[('user', '<i8'), ('item', '<i8'),
+                                          ('timestamp', '<i8')])
+    records['user'] = users
+    records['item'] = items
+    records['timestamp'] = timestamps
+
+    path = str(tmpdir.join('log.npy'))
+    np.save(path, records)
+
+    mapping_dir = str(tmpdir.join('mappings'))
+
+    (train, _, _), (user_mapping, _) = load_interactions(
+        path, chunk_size=4096, mapping_dir=mapping_dir, random_seed=42)
+
+    assert np.all(train.data == 1.0)
+
+    # Reloading part of the log keeps the saved indices.
+    np.save(path, records[::-1][:100])
+
+    _, (reloaded_mapping, _) = load_interactions(path,
+                                                 mapping_dir=mapping_dir)
+
+    assert np.all(reloaded_mapping.raw_ids == user_mapping.raw_ids)
@@ -0,0 +1,50 @@
+import numpy as np
+
+import torch
+
+from torch.autograd import Variable
+
+from binge.layers import HashEmbedding, QREmbedding
+from binge.models import Scorer, _get_vectors
+
+
+def test_compact_embeddings():
+
+    num_embeddings = 1000
+
+    for layer in (QREmbedding(num_embeddings, 32),
+                  QREmbedding(num_embeddings, 32, num_buckets=7),
+                  HashEmbedding(num_embeddings, 32),
+                  HashEmbedding(num_embeddings, 32, num_hashes=3)):
+
+        ids = np.arange(num_embeddings)
+
+        expected = layer(Variable(torch.from_numpy(ids))).data.numpy()
+        lazy = _get_vectors(layer, lazy=True)
+
+        assert lazy.shape == expected.shape
+        assert lazy.nbytes < expected.nbytes
+        assert np.allclose(_get_vectors(layer), expected)
+        assert np.allclose(lazy[17], expected[17])
+        assert np.allclose(lazy[ids[::3]], expected[::3])
+
+
+def test_lazy_scorer():
+
+    num_users = 100
+    num_items = 50
+
+    users = _get_vectors(QREmbedding(num_users, 32), lazy=True)
+    items = np.random.random((num_items, 32)).astype(np.float32)
+    user_biases = np.random.random(num_users).astype(np.float32)
+    item_biases = np.random.random(num_items).astype(np.float32)
+
+    lazy = Scorer(users, user_biases, items, item_biases)
+    materialized = Scorer(users.materialize(), user_biases,
+                          items, item_biases)
+
+    for user_id in (0, 13, 99):
+        assert np.allclose(lazy.predict(user_id),
+                           materialized.predict(user_id))
+
+    assert lazy.memory() < materialized.memory()
@@ -0,0 +1,48 @@
+import numpy as np
+
+import pytest
+
+from binge import memory
+
+
+def _huge_pages_enabled():
+
+    try:
+        with open('/sys/kernel/mm/transparent_hugepage/enabled') as mode:
+            return '[never]' not in mode.read()
+    except OSError:
+        return False
+
+
+@pytest.mark.parametrize('huge_pages', [False, True])
+def test_place(huge_pages):
+
+    array = np.random.RandomState(42).rand(3 * 2 ** 17, 4).astype(np.float32)
+
+    placed = memory.place(array, huge_pages=huge_pages)
+
+    assert placed.dtype == array.dtype
+    assert np.all(placed == array)
+
+    page_size = memory.HUGE_PAGE_SIZE if huge_pages else 4096
+    assert placed.ctypes.data % page_size == 0
+
+    if huge_pages and _huge_pages_enabled():
+        assert memory.huge_page_bytes(placed) > 0
+
+    try:
+        placed = memory.place(array, node=min(memory.numa_nodes()))
+    except OSError:
+        pytest.skip('NUMA placement is not available')
+
+    assert np.all(placed == array)
+
+
+def test_allocate_empty():
+
+    array = memory.allocate((0, 8), np.float32)
+
+    assert array.shape == (0, 8)
+
+    with pytest.raises(ValueError):
+        memory.allocate((8,), np.float32, node=0, interleave=True)
@@ -0,0 +1,89 @@
+import numpy as np
+
+import torch
+
+from binge import FactorizationModel
+from binge.evaluation import mrr_score
+from binge.models import (EarlyStopping, residual_binarize,
+                          residual_binary_dot)
+from binge.serving import binarize_residuals
+
+
+def test_early_stopping(get_interactions):
+
+    train = get_interactions()
+    test = get_interactions(num_interactions=200, random_seed=43)
+
+    early_stopping = EarlyStopping(test, train, patience=2, num_users=50,
+                                   random_seed=42)
+
+    model = FactorizationModel(loss='bpr',
+                               n_iter=50,
+                               batch_size=64,
+                               learning_rate=1e-1,
+                               random_seed=42)
+    model.fit(train, early_stopping=early_stopping)
+
+    scores = early_stopping.scores
+
+    assert len(scores) < 50
+    assert len(scores) - early_stopping.best_epoch == 2
+    assert early_stopping.best_score == max(scores)
+
+    # The best weights are restored.
+    sampled_test = early_stopping._test
+    assert np.isclose(mrr_score(model.get_scorer(), sampled_test, train).mean(),
+                      early_stopping.best_score)
+
+
+def test_residual_binarize():
+
+    # Training and serving encode vectors the same way.
+    vectors = np.random.RandomState(42).normal(size=(20, 64)
+                                               ).astype(np.float32)
+
+    for bits in (1, 2, 3):
+        planes, scales = binarize_residuals(vectors, bits)
+        signs = np.unpackbits(planes, axis=-1).astype(np.float32) * 2 - 1
+        expected = (signs * scales[..., np.newaxis]).sum(axis=1)
+
+        approximation = residual_binarize(torch.from_numpy(vectors), bits)
+
+        assert np.allclose(approximation.numpy(), expected, atol=1e-5)
+
+
+def test_residual_binary_dot(get_interactions):
+
+    random_state = np.random.RandomState(42)
+
+    x, y = (torch.from_numpy(random_state.normal(scale=0.8, size=(16, 32))
+                             .astype(np.float32)).requires_grad_()
+            for _ in range(2))
+    weights = torch.from_numpy(random_state.normal(size=16)
+                               .astype(np.float32))
+
+    dot = residual_binary_dot(x, y, 2)
+    (dot * weights).sum().backward()
+
+    x_approximation = residual_binarize(x.detach(), 2)
+    y_approximation = residual_binarize(y.detach(), 2)
+
+    assert torch.allclose(dot, (x_approximation * y_approximation).sum(1))
+
+    # Gradients pass straight through where inputs are within [-1, 1].
+    assert torch.allclose(x.grad, weights.view(-1, 1) * y_approximation *
+                          (x.detach().abs() <= 1.0).float())
+    assert torch.allclose(y.grad, weights.view(-1, 1) * x_approximation *
+                          (y.detach().abs() <= 1.0).float())
+
+    model = FactorizationModel(loss='bpr',
+                               embedding_dim=32,
+                               n_iter=2,
+                               batch_size=64,
+                               xnor=True,
+                               xnor_bits=2,
+                               random_seed=42)
+    model.fit(get_interactions())
+
+    assert model.get_scorer().bits == 2
+    assert np.all(np.isfinite(model.predict(0)))
@@ -0,0 +1,67 @@
+import os
+import zipfile
+
+import numpy as np
+
+from binge.data import movielens
+
+
+def _reference_load_data(lines, separator):
+
+    user_dict = {}
+    item_dict = {}
+
+    uids, iids, timestamps = [], [], []
+
+    for line in lines:
+
+        if not line:
+            continue
+
+        uid, iid, rating, timestamp = line.split(separator)
+
+        uids.append(user_dict.setdefault(int(uid), len(user_dict)))
+        iids.append(item_dict.setdefault(int(iid), len(item_dict)))
+        timestamps.append(int(timestamp))
+
+    return np.array(uids), np.array(iids), np.array(timestamps)
+
+
+def _write_zip(path, member, separator, num_lines=1000):
+
+    random_state = np.random.RandomState(42)
+
+    lines = [separator.join(str(x) for x in
+                            (random_state.randint(1, 300),
+                             random_state.randint(1, 2000),
+                             random_state.randint(1, 6),
+                             random_state.randint(8 * 10 ** 8, 10 ** 9)))
+             for _ in range(num_lines)]
+
+    with zipfile.ZipFile(path, 'w') as datafile:
+        datafile.writestr(member, '\n'.join(lines) + '\n')
+
+    return lines
+
+
+def test_load_data(tmpdir):
+
+    for member, separator, read_raw_data in (
+            ('ml-100k/u.data', '\t', movielens._read_raw_data_100k),
+            ('ml-1m/ratings.dat', '::', movielens._read_raw_data_1M)):
+
+        zip_path = str(tmpdir.join('movielens.zip'))
+        lines = _write_zip(zip_path, member, separator)
+
+        expected = _reference_load_data(lines, separator)
+
+        for _ in range(2):
+            # The second load is served from the parsed cache.
+            loaded = movielens._load_cached(zip_path, read_raw_data,
+                                            separator.encode())
+
+            for loaded_column, expected_column in zip(loaded, expected):
+                assert np.all(loaded_column == expected_column)
+
+        assert os.path.isfile(movielens._cache_path(zip_path))
+        os.remove(movielens._cache_path(zip_path))
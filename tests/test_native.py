@@ -71,6 +71,28 @@ def test_predict_float_256():
         assert np.allclose(expected, ffi_result)
 
 
+def test_get_lib_is_cached():
+
+    assert get_lib() is get_lib()
+
+
+def test_predict_float_256_read_only():
+
+    lib = get_lib()
+
+    user_vector = align(np.random.random(32).astype(np.float32))
+    item_vectors = align(np.random.random((64, 32)).astype(np.float32))
+    item_biases = align(np.random.random(64).astype(np.float32))
+
+    for array in (user_vector, item_vectors, item_biases):
+        array.flags.writeable = False
+
+    assert np.allclose(_predict_float_256(user_vector, item_vectors,
+                                          1.0, item_biases),
+                       lib.predict_float_256(user_vector, item_vectors,
+                                             1.0, item_biases))
+
+
 def test_scorer():
 
     for latent_dim in (32, 64, 128, 256):
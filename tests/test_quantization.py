@@ -0,0 +1,45 @@
+import numpy as np
+
+from binge.quantization import (decode, encode, pack_codes,
+                                train_codebooks, unpack_codes)
+
+
+def test_pack_codes():
+
+    random_state = np.random.RandomState(42)
+
+    for num_items, num_subspaces in ((1, 1), (31, 3), (32, 4), (100, 7)):
+        codes = random_state.randint(0, 16, (num_items, num_subspaces)
+                                     ).astype(np.uint8)
+        packed = pack_codes(codes)
+
+        assert packed.shape == (-(-num_items // 32),
+                                num_subspaces + num_subspaces % 2, 16)
+
+        item_ids = random_state.permutation(num_items)
+        unpacked = unpack_codes(packed, item_ids)
+
+        assert np.all(unpacked[:, :num_subspaces] == codes[item_ids])
+        assert np.all(unpacked[:, num_subspaces:] == 0)
+
+
+def test_codebooks():
+
+    random_state = np.random.RandomState(42)
+
+    # Vectors clustered around 16 centers.
+    centers = random_state.normal(size=(16, 10)).astype(np.float32)
+    vectors = (centers[random_state.randint(0, 16, 2000)] +
+               random_state.normal(scale=0.01, size=(2000, 10))
+               ).astype(np.float32)
+
+    codebooks = train_codebooks(vectors, 3, num_centroids=16,
+                                random_state=random_state)
+
+    assert codebooks.shape == (3, 16, 4)
+
+    reconstructed = decode(encode(vectors, codebooks), codebooks)
+    error = np.abs(reconstructed[:, :10] - vectors).mean()
+
+    assert error < 0.1
+    assert np.all(reconstructed[:, 10:] == 0)
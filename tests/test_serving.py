@@ -0,0 +1,286 @@
+import json
+import subprocess
+import sys
+
+import numpy as np
+
+import pytest
+
+from binge.quantization import decode, pad_subspaces, unpack_codes
+from binge.serving import (PQScorer, Scorer, ScoringPool, XNORScorer,
+                           _quantize_lut, binarize_array, binarize_residuals)
+
+
+IMPORT_SCRIPT = """
+import json
+import sys
+
+from binge.serving import PQScorer, Scorer, XNORScorer
+
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+def test_serving_import():
+
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT])
+    modules = json.loads(output.decode('utf-8'))
+
+    # Serving does not pull in the training stack.
+    for module in ('torch', 'scipy', 'sklearn', 'binge.models'):
+        assert module not in modules
+
+
+def _pq_reference(scorer, user_id):
+
+    if scorer.bits == 4:
+        codes = unpack_codes(scorer._codes, np.arange(scorer.num_items))
+    else:
+        codes = scorer._codes
+
+    item_vectors = decode(codes[:, :len(scorer._codebooks)],
+                          scorer._codebooks)
+    user_vector = pad_subspaces(
+        np.append(scorer._user_vectors[user_id], 1.0)[np.newaxis, :],
+        len(scorer._codebooks))[0]
+
+    return np.dot(item_vectors, user_vector) + scorer._user_biases[user_id]
+
+
+def test_pq_scorer():
+
+    random_state = np.random.RandomState(42)
+
+    num_users, num_items, latent_dim = 5, 1000, 32
+
+    user_vectors = random_state.normal(size=(num_users, latent_dim)
+                                       ).astype(np.float32)
+    item_vectors = random_state.normal(size=(num_items, latent_dim)
+                                       ).astype(np.float32)
+    user_biases = random_state.normal(size=num_users).astype(np.float32)
+    item_biases = random_state.normal(size=num_items).astype(np.float32)
+
+    for bits, num_subspaces in ((8, 8), (4, 8), (4, 5)):
+        scorer = PQScorer(user_vectors, user_biases,
+                          item_vectors, item_biases,
+                          num_subspaces=num_subspaces,
+                          bits=bits,
+                          random_seed=42)
+
+        assert scorer.bits == bits
+        assert scorer.num_items == num_items
+
+        for user_id in range(num_users):
+            expected = _pq_reference(scorer, user_id)
+            predictions = scorer.predict(user_id)
+
+            if bits == 8:
+                tolerance = 1e-4
+            else:
+                # Every lookup table entry is rounded once.
+                lut, scale, _ = _quantize_lut(scorer._lut(user_id))
+                tolerance = len(lut) * scale / 2 + 1e-4
+
+            assert np.allclose(predictions, expected, rtol=0, atol=tolerance)
+
+            item_ids = random_state.choice(num_items, 50)
+            assert np.allclose(scorer.predict(user_id, item_ids),
+                               predictions[item_ids])
+
+            targets = np.arange(10, dtype=np.int32)
+            exclude = np.arange(5, 20, dtype=np.int32)
+            included = np.delete(predictions, exclude)
+
+            ranks = scorer.rank_of(user_id, targets, exclude)
+
+            for target, rank in zip(targets, ranks):
+                if target in exclude:
+                    continue
+                score = predictions[target]
+                assert rank == ((included > score).sum() +
+                                ((included == score).sum() + 1) / 2.0)
+
+
+def _decode_residuals(planes, scales):
+
+    signs = np.unpackbits(planes, axis=-1).astype(np.float32) * 2 - 1
+
+    return (signs * scales[..., np.newaxis]).sum(axis=-2)
+
+
+def test_binarize_residuals():
+
+    vectors = np.random.RandomState(42).normal(size=(100, 64))
+
+    planes, scales = binarize_residuals(vectors, 1)
+
+    assert np.all(planes[:, 0] == binarize_array(vectors))
+    assert np.allclose(scales[:, 0], np.abs(vectors).mean(axis=1))
+
+    errors = [np.abs(_decode_residuals(*binarize_residuals(vectors, bits))
+                     - vectors).mean()
+              for bits in (1, 2, 3, 4)]
+
+    assert all(x > y for (x, y) in zip(errors, errors[1:]))
+
+    # Planes must fill whole 32-bit words.
+    with pytest.raises(AssertionError):
+        binarize_residuals(vectors[:, :48], 2)
+
+
+def test_residual_xnor_scorer():
+
+    random_state = np.random.RandomState(42)
+
+    num_users, num_items, latent_dim = 5, 1000, 64
+
+    user_vectors = random_state.normal(size=(num_users, latent_dim)
+                                       ).astype(np.float32)
+    item_vectors = random_state.normal(size=(num_items, latent_dim)
+                                       ).astype(np.float32)
+    user_biases = random_state.normal(size=num_users).astype(np.float32)
+    item_biases = random_state.normal(size=num_items).astype(np.float32)
+
+    for bits in (2, 3):
+        scorer = XNORScorer(user_vectors, user_biases,
+                            item_vectors, item_biases,
+                            bits=bits)
+
+        assert scorer.bits == bits
+
+        item_approximations = _decode_residuals(scorer._item_vectors,
+                                                scorer._item_norms)
+
+        for user_id in range(num_users):
+            user_approximation = _decode_residuals(
+                scorer._user_vectors[user_id],
+                scorer._user_norms[user_id])
+            expected = (np.dot(item_approximations, user_approximation) +
+                        user_biases[user_id] + item_biases)
+
+            predictions = scorer.predict(user_id)
+
+            assert np.allclose(predictions, expected, atol=1e-4)
+
+            item_ids = random_state.choice(num_items, 50)
+            assert np.allclose(scorer.predict(user_id, item_ids),
+                               predictions[item_ids])
+
+            targets = np.arange(5, dtype=np.int32)
+            ranks = scorer.rank_of(user_id, targets)
+
+            for target, rank in zip(targets, ranks):
+                score = predictions[target]
+                assert rank == ((predictions > score).sum() +
+                                ((predictions == score).sum() + 1) / 2.0)
+
+
+def test_top_k():
+
+    num_users, num_items = 10, 50
+
+    random_state = np.random.RandomState(42)
+
+    # Integer-valued scores with many ties.
+    scorer = Scorer(
+        random_state.choice([-1.0, 1.0], (num_users, 8)).astype(np.float32),
+        random_state.randint(0, 3, num_users).astype(np.float32),
+        random_state.choice([-1.0, 1.0], (num_items, 8)).astype(np.float32),
+        random_state.randint(0, 3, num_items).astype(np.float32))
+
+    exclude = np.array([0, 3, 3, 7], dtype=np.int32)
+
+    for user_id in range(num_users):
+        scores = scorer.predict(user_id).copy()
+        scores[exclude] = -np.inf
+        expected = np.lexsort((np.arange(num_items), -scores))[:5]
+
+        item_ids, item_scores = scorer.top_k(user_id, 5, exclude=exclude)
+
+        assert np.all(item_ids == expected)
+        assert np.all(item_scores == scores[expected])
+
+    assert len(scorer.top_k(0, 100, exclude=exclude)[0]) == num_items - 3
+
+
+def test_pruned_top_k():
+
+    num_users, num_items, latent_dim = 20, 5000, 32
+
+    random_state = np.random.RandomState(42)
+
+    # A long tail of small-norm items, and duplicated items to create ties.
+    item_vectors = (random_state.normal(size=(num_items // 2, latent_dim)) *
+                    random_state.pareto(2.0, (num_items // 2, 1)))
+    item_vectors = np.concatenate([item_vectors] * 2).astype(np.float32)
+    item_biases = np.concatenate([random_state.normal(
+        scale=0.1, size=num_items // 2)] * 2).astype(np.float32)
+
+    scorer = Scorer(
+        random_state.normal(size=(num_users, latent_dim)).astype(np.float32),
+        random_state.normal(size=num_users).astype(np.float32),
+        item_vectors,
+        item_biases)
+
+    for user_id in range(num_users):
+        for k in (1, 10, 100):
+            exclude = (random_state.choice(num_items, 20)
+                       if user_id % 2 else None)
+
+            expected_ids, expected_scores = scorer.top_k(user_id, k, exclude)
+            item_ids, scores = scorer.top_k(user_id, k, exclude, prune=True)
+
+            assert np.all(item_ids == expected_ids)
+            assert np.all(scores == expected_scores)
+
+    assert scorer.pruning_rate > 0.5
+
+    # Every candidate is returned when k exceeds their number.
+    item_ids, _ = scorer.top_k(0, num_items + 1, np.arange(10), prune=True)
+    assert np.all(np.sort(item_ids) == np.arange(10, num_items))
+
+
+def test_scoring_pool():
+
+    random_state = np.random.RandomState(42)
+
+    num_users, num_items, latent_dim = 20, 5000, 32
+
+    scorer = Scorer(
+        random_state.normal(size=(num_users, latent_dim)).astype(np.float32),
+        random_state.normal(size=num_users).astype(np.float32),
+        random_state.normal(size=(num_items, latent_dim)).astype(np.float32),
+        random_state.normal(size=num_items).astype(np.float32))
+
+    placed = scorer.place()
+    assert placed._item_vectors is not scorer._item_vectors
+    assert placed._user_vectors is scorer._user_vectors
+    assert np.all(placed.predict(3) == scorer.predict(3))
+
+    user_ids = range(num_users)
+
+    with ScoringPool(scorer, threads_per_node=2) as pool:
+        results = pool.map('top_k', user_ids, [10] * num_users)
+
+    for user_id, (item_ids, scores) in zip(user_ids, results):
+        expected_ids, expected_scores = scorer.top_k(user_id, 10)
+        assert np.all(item_ids == expected_ids)
+        assert np.all(scores == expected_scores)
+
+
+def test_rank_of_out_of_range():
+
+    random_state = np.random.RandomState(42)
+
+    scorer = Scorer(random_state.normal(size=(2, 8)).astype(np.float32),
+                    np.zeros(2, dtype=np.float32),
+                    random_state.normal(size=(10, 8)).astype(np.float32),
+                    np.zeros(10, dtype=np.float32))
+
+    for targets, exclude in (([5, 100000], None),
+                             ([-1], None),
+                             ([5], [3, 10])):
+        with pytest.raises(ValueError):
+            scorer.rank_of(0, np.array(targets, dtype=np.int32), exclude)
+
+    assert scorer.rank_of(0, np.array([9], dtype=np.int32), [0]).shape == (1,)
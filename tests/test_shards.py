@@ -0,0 +1,50 @@
+import numpy as np
+
+from binge.data.shards import InteractionShards, write_shards
+
+
+def _get_rated_interactions(get_interactions):
+
+    interactions = get_interactions(num_interactions=1000)
+    # Distinct ratings identify every interaction.
+    interactions.data = np.arange(interactions.nnz, dtype=np.float32)
+
+    return interactions
+
+
+def test_write_shards(tmpdir, get_interactions):
+
+    interactions = _get_rated_interactions(get_interactions)
+
+    shards = write_shards(str(tmpdir), interactions, shard_size=128)
+
+    assert shards.shape == interactions.shape
+    assert len(shards) == interactions.nnz
+
+    loaded = shards.tocoo()
+
+    assert np.all(loaded.row == interactions.row)
+    assert np.all(loaded.col == interactions.col)
+    assert np.all(loaded.data == interactions.data)
+
+
+def test_iter_shuffled(tmpdir, get_interactions):
+
+    interactions = _get_rated_interactions(get_interactions)
+
+    write_shards(str(tmpdir), interactions, shard_size=128)
+
+    for buffer_size in (1, 100, 128, 300, 5000):
+
+        shards = InteractionShards(str(tmpdir), buffer_size=buffer_size)
+        chunks = list(shards.iter_shuffled(np.random.RandomState(42)))
+
+        assert all(len(users) <= buffer_size for users, _, _ in chunks)
+
+        users, items, ratings = (np.concatenate(x) for x in zip(*chunks))
+
+        # Every interaction is visited exactly once.
+        order = np.argsort(ratings)
+        assert np.all(ratings[order] == interactions.data)
+        assert np.all(users[order] == interactions.row)
+        assert np.all(items[order] == interactions.col)
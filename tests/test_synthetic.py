@@ -0,0 +1,31 @@
+import numpy as np
+
+from binge.data.synthetic import PowerLawGenerator
+
+
+def test_power_law_generator(tmpdir):
+
+    num_users, num_items = 1000, 2000
+
+    generator = PowerLawGenerator(num_users, num_items, random_seed=42)
+    interactions = generator.generate(200000, chunk_size=10000)
+
+    assert interactions.shape == (num_users, num_items)
+    assert interactions.nnz == 200000
+    assert interactions.data.dtype == np.float32
+
+    # Heavy-tailed popularity: the top 1% of items take a large share.
+    item_counts = np.sort(np.bincount(interactions.col,
+                                      minlength=num_items))[::-1]
+    assert item_counts[:num_items // 100].sum() > 0.2 * interactions.nnz
+
+    # Chosen items have higher planted affinity than random ones.
+    affinities = (generator.user_factors[interactions.row] *
+                  generator.item_factors[interactions.col]).sum(axis=1)
+    assert affinities.mean() > 0.5
+
+    shards = generator.write_shards(str(tmpdir), 5000, shard_size=2048)
+
+    assert len(shards) == 5000
+    assert shards.shape == (num_users, num_items)
+    assert len(shards._lengths) == 3
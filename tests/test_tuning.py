@@ -0,0 +1,114 @@
+import json
+
+import numpy as np
+
+import pytest
+
+import scipy.stats as st
+
+from binge import tuning
+from binge.native import align, get_lib
+from binge.serving import Scorer
+
+
+def _representations(num_users, num_items, latent_dim):
+
+    random_state = np.random.RandomState(42)
+
+    # A long-tailed catalog, so that pruned top-k skips items.
+    item_vectors = (random_state.normal(size=(num_items, latent_dim)) *
+                    random_state.pareto(2.0, size=(num_items, 1)))
+
+    return (random_state.normal(size=(num_users, latent_dim))
+            .astype(np.float32),
+            random_state.normal(size=num_users).astype(np.float32),
+            item_vectors.astype(np.float32),
+            random_state.normal(size=num_items).astype(np.float32))
+
+
+@pytest.mark.parametrize('latent_dim', [8, 40, 96])
+def test_float_variants(latent_dim):
+
+    extension = get_lib()
+    lib = extension._lib
+    cast = extension._cast
+
+    _, _, item_vectors, item_biases = _representations(1, 1003, latent_dim)
+    user_vector = align(item_vectors[0] / 2)
+    item_vectors = align(item_vectors)
+
+    expected = extension.predict_float_256(user_vector, item_vectors,
+                                           0.5, item_biases)
+
+    configs = tuning.float_variants(extension)
+    assert configs[tuning.REFERENCE_VARIANT] == (1, 1, 0)
+    assert len(set(configs)) == len(configs)
+
+    for variant in range(len(configs)):
+        out = np.empty_like(item_biases)
+        lib.predict_float_variant(variant, cast(user_vector),
+                                  cast(item_vectors), 0.5, cast(item_biases),
+                                  cast(out), len(item_biases), latent_dim)
+
+        assert np.allclose(out, expected, rtol=1e-5, atol=1e-4)
+
+        # Scores do not depend on the position of the item.
+        shifted = np.empty_like(out[1:])
+        lib.predict_float_variant(variant, cast(user_vector),
+                                  cast(align(item_vectors[1:])), 0.5,
+                                  cast(item_biases[1:]), cast(shifted),
+                                  len(item_biases) - 1, latent_dim)
+
+        assert np.all(shifted == out[1:])
+
+
+def test_autotune(tmp_path, monkeypatch):
+
+    path = tmp_path / 'profile.json'
+    monkeypatch.setenv('BINGE_TUNING_PROFILE', str(path))
+
+    scorer = Scorer(*_representations(10, 3000, 32))
+
+    tuning.reset()
+    tuning.enable()
+
+    try:
+        scores = scorer.predict(0)
+
+        variant = tuning.selected_float_variant(3000, 32)
+        config = tuning.float_variants(get_lib())[variant]
+
+        profile = json.loads(path.read_text())
+        winner = profile['kernels'][tuning.KERNEL][tuning.shape_key(3000, 32)]
+        assert tuple(winner['config']) == config
+
+        # A fresh process reads the winner back from the profile.
+        tuning.reset()
+        tuning.disable()
+        assert np.all(scorer.predict(0) == scores)
+        assert tuning.selected_float_variant(3000, 32) == variant
+
+        # Catalogs in the same power-of-two range share the selection.
+        assert tuning.selected_float_variant(2500, 32) == variant
+
+        # Ranking and pruned top-k score with the full scan's variant.
+        for variant in range(len(tuning.float_variants(get_lib()))):
+            tuning._tuner.selected[tuning.shape_key(3000, 32)] = variant
+
+            for user_id in range(10):
+                item_ids, scores = scorer.top_k(user_id, 10)
+                pruned_ids, pruned_scores = scorer.top_k(user_id, 10,
+                                                         prune=True)
+
+                assert np.all(item_ids == pruned_ids)
+                assert np.all(scores == pruned_scores)
+
+                target_ids = np.arange(0, 3000, 7)
+                expected = st.rankdata(-scorer.predict(user_id))[target_ids]
+
+                assert np.all(scorer.rank_of(user_id, target_ids) == expected)
+
+        assert scorer.pruning_rate > 0.0
+    finally:
+        tuning.disable()
+        tuning.reset()